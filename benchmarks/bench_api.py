@@ -0,0 +1,120 @@
+"""Load test for the HTTP API: QPS and latency percentiles.
+
+Starts a local `compliancewatch.api` instance (or targets `--url`) and runs
+keep-alive clients.  Each client sends `If-None-Match` on a fraction of its
+requests, to show how cheap revalidation is.
+
+    python benchmarks/bench_api.py --concurrency 32 --duration 15 --workers 2
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DRUGS = ["Ozempic", "Keytruda", "Humira", "Eliquis"]
+PATHS = ["kpis", "severity", "sources", "trend", "alerts", "regional", "forecast?days=30&confidence=95%25"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, data_dir):
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.Popen([sys.executable, "-m", "compliancewatch.api", "--port", str(port),
+                             "--workers", str(workers), "--data-dir", data_dir], env=env, cwd=ROOT)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + "/v1/health", timeout=1).read()
+            return proc, url
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("API server did not start")
+
+
+def client(url, deadline, conditional, latencies, statuses, sizes, seed):
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    etags = {}
+    i = seed
+    while time.perf_counter() < deadline:
+        path = f"/v1/drugs/{DRUGS[i % len(DRUGS)]}/{PATHS[i % len(PATHS)]}"
+        headers = {"Accept-Encoding": "gzip"}
+        if path in etags and (i % 100) < conditional * 100:
+            headers["If-None-Match"] = etags[path]
+        started = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] += 1
+        sizes.append(len(body))
+        if response.getheader("ETag"):
+            etags[path] = response.getheader("ETag")
+        i += 1
+    conn.close()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="benchmark a running instance instead")
+    parser.add_argument("--workers", type=int, default=1, help="server processes when starting one")
+    parser.add_argument("--data-dir", default=None, help="pipeline output to serve (default: an empty store)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--conditional", type=float, default=0.5,
+                        help="fraction of repeat requests sent with If-None-Match")
+    args = parser.parse_args()
+
+    proc = None
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url
+        if url is None:
+            proc, url = start_server(args.workers, args.data_dir or tmp)
+        try:
+            latencies, statuses, sizes = [], Counter(), []
+            deadline = time.perf_counter() + args.duration
+            threads = [threading.Thread(target=client, args=(url, deadline, args.conditional,
+                                                             latencies, statuses, sizes, n))
+                       for n in range(args.concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"{total:,} requests in {elapsed:.1f}s = {total / elapsed:,.0f} req/s "
+          f"({args.concurrency} clients, {args.workers} server workers)")
+    print(f"latency p50 {percentile(latencies, 0.50):.2f} ms  p95 {percentile(latencies, 0.95):.2f} ms  "
+          f"p99 {percentile(latencies, 0.99):.2f} ms")
+    print(f"status {dict(statuses)}  mean body {sum(sizes) / max(total, 1):.0f} B")
+
+
+if __name__ == "__main__":
+    main()
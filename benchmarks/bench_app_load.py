@@ -0,0 +1,361 @@
+"""Load test for the Streamlit dashboard: rerun latency as concurrent analysts grow.
+
+The dashboard runs as a real `streamlit run` server in a subprocess.  Every
+simulated analyst is a websocket client of it that speaks the browser's
+protocol: it sends `BackMsg` rerun requests carrying its widget states to
+`/_stcore/stream` and reads `ForwardMsg` deltas until the script run
+finishes.  The sessions share the server's process-wide result cache and
+cached resources, as browser sessions do.  Each session repeats an
+interaction script:
+
+- pick a drug and start monitoring;
+- move the severity and confidence sliders;
+- change the analysis window;
+- use the cohort breakdown and forecast controls.
+
+Streamlit switches tabs in the browser without a rerun, so a tab is
+exercised through its own widgets.
+
+For each concurrency level the harness reports:
+
+- rerun latency percentiles, from sending the rerun to its `script_finished`;
+- the server process's CPU use and peak RSS;
+- the result cache's hit rate over that level, as the sidebar reports it.
+
+Levels run in order against the same server, which stays up between them.
+Needs `websockets` (installed with Streamlit's server); CPU and RSS come
+from /proc, or from `psutil` where there is no /proc.
+
+    python benchmarks/bench_app_load.py --levels 1,2,4,8,16 --iterations 2 --think 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP = os.path.join(ROOT, "compliancewatch_app.py")
+DRUGS = ["Ozempic", "Keytruda", "Humira", "Eliquis"]
+_CACHE_RE = re.compile(r"Cache: (\d+) hits · (\d+) misses")
+
+
+def seed_data(data_dir, drugs, posts):
+    from compliancewatch.pipeline import run_pipeline
+    from compliancewatch.sources import SyntheticSource
+
+    run_pipeline(drugs, [SyntheticSource("Reddit"), SyntheticSource("Twitter/X")],
+                 os.path.join(data_dir, "queue"), os.path.join(data_dir, "events.db"),
+                 workers=1, posts_per_source=posts, audit_dir=os.path.join(data_dir, "audit"),
+                 vector_dir=os.path.join(data_dir, "vectors"), metrics_dir=os.path.join(data_dir, "metrics"))
+
+
+def _websockets():
+    try:
+        import websockets.asyncio.client
+    except ImportError as exc:
+        raise ImportError("the app load test needs websockets: pip install websockets") from exc
+    return websockets.asyncio.client
+
+
+def _psutil_process(pid):
+    try:
+        import psutil
+    except ImportError as exc:
+        raise ImportError("without /proc, sampling the server needs psutil: pip install psutil") from exc
+    return psutil.Process(pid)
+
+
+def cpu_seconds(pid):
+    """User + system CPU seconds the process has used."""
+    try:
+        with open(f"/proc/{pid}/stat") as fh:
+            fields = fh.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        times = _psutil_process(pid).cpu_times()
+        return times.user + times.system
+
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return _psutil_process(pid).memory_info().rss
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env, timeout):
+    """Start `streamlit run` on the dashboard and wait until it is healthy."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP, "--server.headless", "true",
+         "--server.address", "127.0.0.1", "--server.port", str(port),
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false",
+         "--logger.level", "error"],
+        env=env, cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as resp:
+                if resp.status == 200:
+                    return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"streamlit did not become healthy within {timeout:.0f}s")
+
+
+class Session:
+    """One browser tab: a websocket to the server plus the widget values it would send."""
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self.widgets = {}  # label -> (element type, widget proto) from the last run
+        self.states = {}   # widget id -> WidgetState, resent on every rerun like the browser does
+        self.triggers = []  # button clicks, sent with the next rerun only
+        self.page_script_hash = ""
+        self.exceptions = []
+        self.cache = None
+        self._ws = None
+
+    async def connect(self):
+        self._ws = await _websockets().connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        await self._ws.close()
+
+    def set(self, label, kind, value):
+        """Set the widget labelled `label` to `value`; a KeyError if it is not on the page."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        state = WidgetState(id=self.widgets[label][1].id)
+        if kind == "double_array_value":
+            state.double_array_value.data.extend(value)
+        else:
+            setattr(state, kind, value)
+        self.states[state.id] = state
+
+    def click(self, label):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        self.triggers.append(WidgetState(id=self.widgets[label][1].id, trigger_value=True))
+
+    def options(self, label):
+        return list(self.widgets[label][1].options)
+
+    async def rerun(self):
+        """Send a rerun with the current widget states and pending clicks, then
+        read messages until the script run finishes."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.page_script_hash = self.page_script_hash
+        msg.rerun_script.widget_states.widgets.extend([*self.states.values(), *self.triggers])
+        self.triggers = []
+        await self._ws.send(msg.SerializeToString())
+
+        widgets, self.exceptions = {}, []
+        finished = ForwardMsg.ScriptFinishedStatus
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self._ws.recv(), self.timeout))
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                self.page_script_hash = forward.new_session.page_script_hash
+            elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                which = element.WhichOneof("type")
+                proto = getattr(element, which)
+                if which == "exception":
+                    self.exceptions.append(proto.message)
+                elif which == "markdown":
+                    match = _CACHE_RE.search(proto.body)
+                    if match:
+                        self.cache = (int(match.group(1)), int(match.group(2)))
+                elif getattr(proto, "id", "") and getattr(proto, "label", ""):
+                    widgets[proto.label] = (which, proto)
+            elif kind == "script_finished" and forward.script_finished != finished.FINISHED_EARLY_FOR_RERUN:
+                break
+        self.widgets = widgets
+
+
+def interactions(rng):
+    """`(step name, action on the Session)` pairs; every action is followed by a rerun."""
+    drug = rng.choice(DRUGS)
+    return [
+        ("pick drug", lambda s: (s.set("Target Drug Name", "string_value", drug),
+                                 s.click("🚀 **Start Monitoring**"))),
+        ("severity slider", lambda s: s.set("Minimum Severity Level", "double_array_value",
+                                            [rng.randint(1, 10)])),
+        ("confidence slider", lambda s: s.set("AI Confidence Threshold (%)", "double_array_value",
+                                              [rng.choice(range(50, 101, 5))])),
+        ("analysis window", lambda s: s.set("Analysis window", "string_value", rng.choice(
+            ["Last 24 Hours", "Last 7 Days", "Last 30 Days", "Last 90 Days", "Last Year"]))),
+        ("cohort breakdown", lambda s: s.set("Break down by", "string_value",
+                                             rng.choice(s.options("Break down by")))),
+        ("forecast period", lambda s: s.set("Forecast Period", "string_value",
+                                            rng.choice(["7 days", "14 days", "30 days", "90 days"]))),
+        ("forecast model", lambda s: s.set("Model Type", "string_value", rng.choice(
+            ["LSTM Neural Network", "Prophet", "ARIMA", "Ensemble"]))),
+    ]
+
+
+async def session(n, url, iterations, think, results, timeout):
+    rng = random.Random(n)
+    s = Session(url, timeout)
+    await s.connect()
+    try:
+        await s.rerun()
+        for _ in range(iterations):
+            for step, action in interactions(rng):
+                if think:
+                    await asyncio.sleep(rng.uniform(0.5, 1.5) * think)
+                try:
+                    action(s)
+                except (KeyError, IndexError):
+                    results["skipped"].append(step)  # widget not on the page (e.g. no cohort data)
+                    continue
+                started = time.perf_counter()
+                try:
+                    await s.rerun()
+                except asyncio.TimeoutError:
+                    results["errors"].append(f"{step}: no script_finished within {timeout:.0f}s")
+                    return
+                results["latencies"].append((step, time.perf_counter() - started))
+                if s.exceptions:
+                    results["errors"].append(f"{step}: {s.exceptions[0]}")
+                if s.cache is not None:
+                    results["cache"].append(s.cache)
+    finally:
+        await s.close()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float("nan")
+
+
+async def _run_sessions(sessions, url, iterations, think, results, timeout):
+    await asyncio.gather(*(session(n, url, iterations, think, results, timeout) for n in range(sessions)))
+
+
+def run_level(pid, url, sessions, iterations, think, timeout):
+    results = {"latencies": [], "errors": [], "skipped": [], "cache": []}
+    peak = [rss_bytes(pid)]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.2):
+            peak[0] = max(peak[0], rss_bytes(pid))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    cpu_before, started = cpu_seconds(pid), time.perf_counter()
+    sampler.start()
+    asyncio.run(_run_sessions(sessions, url, iterations, think, results, timeout))
+    done.set()
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds(pid) - cpu_before
+    latencies = sorted(t for _, t in results["latencies"])
+    return {
+        "sessions": sessions,
+        "reruns": len(latencies),
+        "seconds": elapsed,
+        "reruns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p90_ms": percentile(latencies, 0.90),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] * 1000 if latencies else float("nan"),
+        "cpu_percent": 100 * cpu / elapsed if elapsed else 0.0,
+        "rss_peak_mb": max(peak[0], rss_bytes(pid)) / 1e6,
+        "cache": max(results["cache"], default=(0, 0)),
+        "errors": results["errors"],
+        "skipped": len(results["skipped"]),
+        "by_step_p95_ms": {step: percentile(sorted(t for s, t in results["latencies"] if s == step), 0.95)
+                           for step in dict.fromkeys(s for s, _ in results["latencies"])},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", default="1,2,4,8", help="comma-separated concurrent session counts")
+    parser.add_argument("--iterations", type=int, default=2, help="script repetitions per session")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between interactions")
+    parser.add_argument("--data-dir", default=None, help="pipeline output to serve (default: seed a temp dir)")
+    parser.add_argument("--posts", type=int, default=500, help="posts per (source, drug) when seeding")
+    parser.add_argument("--port", type=int, default=None, help="server port (default: a free one)")
+    parser.add_argument("--slo", type=float, default=1000.0, help="p95 rerun latency target in ms")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds a rerun may take")
+    parser.add_argument("--report", default=None, help="also write the results as JSON here")
+    args = parser.parse_args()
+    levels = [int(n) for n in args.levels.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        if not os.path.exists(os.path.join(data_dir, "events.db")):
+            print(f"seeding {data_dir} with {args.posts} posts per source and drug ...")
+            seed_data(data_dir, DRUGS, args.posts)
+        env = dict(os.environ, COMPLIANCEWATCH_DATA_DIR=data_dir)
+        env.setdefault("COMPLIANCEWATCH_AUDIT_DIR", os.path.join(tmp, "audit-app"))
+        port = args.port or _free_port()
+        server = start_server(port, env, args.timeout)
+        url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        try:
+            run_level(server.pid, url, 1, 1, 0, args.timeout)  # imports, cached resources, first figures
+            print(f"{'sessions':>8} {'reruns':>7} {'rerun/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+                  f"{'max ms':>8} {'CPU %':>6} {'RSS MB':>7} {'cache hit':>9}")
+            reports, previous = [], (0, 0)
+            for sessions in levels:
+                r = run_level(server.pid, url, sessions, args.iterations, args.think, args.timeout)
+                hits, misses = r["cache"][0] - previous[0], r["cache"][1] - previous[1]
+                previous = r["cache"]
+                r["cache_hit_rate"] = hits / (hits + misses) if hits + misses > 0 else None
+                reports.append(r)
+                hit_rate = f"{r['cache_hit_rate']:.0%}" if r["cache_hit_rate"] is not None else "-"
+                print(f"{sessions:>8} {r['reruns']:>7} {r['reruns_per_second']:>8.1f} {r['p50_ms']:>8.0f} "
+                      f"{r['p90_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['max_ms']:>8.0f} {r['cpu_percent']:>6.0f} "
+                      f"{r['rss_peak_mb']:>7.0f} {hit_rate:>9}")
+                for error in r["errors"][:3]:
+                    print(f"         error: {error}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    within = 0
+    for r in reports:  # the largest level before the first one over the target
+        if r["p95_ms"] > args.slo:
+            break
+        within = r["sessions"]
+    slowest = max(reports[-1]["by_step_p95_ms"].items(), key=lambda kv: kv[1], default=None)
+    print(f"p95 within {args.slo:.0f} ms up to {within} concurrent sessions "
+          f"(one server process, {os.cpu_count()} CPUs)")
+    if slowest:
+        print(f"slowest step at {reports[-1]['sessions']} sessions: {slowest[0]} (p95 {slowest[1]:.0f} ms)")
+    if args.report:
+        with open(args.report, "w") as fh:
+            json.dump({"levels": reports, "slo_ms": args.slo, "think": args.think,
+                       "iterations": args.iterations}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
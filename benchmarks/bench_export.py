@@ -0,0 +1,58 @@
+"""Export throughput and peak memory for each format over a synthetic store.
+
+    python benchmarks/bench_export.py --events 2000000 --format parquet
+
+Peak RSS should stay flat as --events grows.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compliancewatch.export import export_events
+from compliancewatch.sources import REGIONS, SYMPTOM_PHRASES
+from compliancewatch.store import EventStore
+
+
+def build(store, events, batch=50000):
+    rng = random.Random(0)
+    start = time.time() - 90 * 86400
+    for offset in range(0, events, batch):
+        store.write_events([{
+            "event_id": f"{i:012d}", "drug": "Ozempic", "source": rng.choice(["Reddit", "Twitter/X"]),
+            "created_at": start + i * 0.5, "region": rng.choice(REGIONS), "language": "en",
+            "text": f"Started Ozempic and now I have {rng.choice(SYMPTOM_PHRASES)}.",
+            "severity": rng.randint(1, 10), "confidence": 0.7, "symptoms": "nausea",
+        } for i in range(offset, min(events, offset + batch))])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--format", action="append", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = EventStore(os.path.join(tmp, "events.db"))
+        build(store, args.events)
+        for fmt in args.format or ["csv", "parquet", "arrow"]:
+            out = os.path.join(tmp, f"export.{fmt}")
+            started = time.perf_counter()
+            with open(out, "wb") as fh:
+                for chunk in export_events(store, fmt, drug="Ozempic"):
+                    fh.write(chunk)
+            elapsed = time.perf_counter() - started
+            size = os.path.getsize(out)
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{fmt:8s} {args.events:,} rows  {size / 1e6:8.1f} MB  {elapsed:6.2f}s  "
+                  f"{args.events / elapsed:10,.0f} rows/s  peak RSS {peak:,.0f} MB")
+            os.remove(out)
+
+
+if __name__ == "__main__":
+    main()
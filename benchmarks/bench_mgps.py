@@ -0,0 +1,54 @@
+"""MGPS prior fit and scoring time on a synthetic sparse drug x reaction matrix.
+
+    python benchmarks/bench_mgps.py --cells 1000000
+
+Counts are drawn from a known gamma-mixture prior, so the fitted prior can
+be compared with the true one.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compliancewatch.mgps import fit_prior, posterior, squash
+
+TRUE_PRIOR = (0.3, 0.2, 3.0, 3.5, 0.15)
+
+
+def simulate(cells, seed=0):
+    rng = np.random.default_rng(seed)
+    alpha1, beta1, alpha2, beta2, p = TRUE_PRIOR
+    first = rng.random(cells) < p
+    ratio = np.where(first, rng.gamma(alpha1, 1 / beta1, cells), rng.gamma(alpha2, 1 / beta2, cells))
+    expected = np.exp(rng.normal(-1.0, 1.5, cells))
+    n = rng.poisson(ratio * expected)
+    keep = n > 0
+    return n[keep].astype(np.float64), expected[keep]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, default=1_000_000, help="cells drawn before dropping N = 0")
+    args = parser.parse_args()
+
+    n, e = simulate(args.cells)
+    started = time.perf_counter()
+    points = squash(n, e)[0].size
+    prior = fit_prior(n, e)
+    fitted = time.perf_counter() - started
+    started = time.perf_counter()
+    ebgm, eb05 = posterior(prior, n, e)
+    scored = time.perf_counter() - started
+
+    print(f"{n.size:,} non-zero cells squashed to {points:,} points")
+    print(f"fit   {fitted:6.2f}s  prior " + " ".join(f"{v:.3f}" for v in prior))
+    print(f"      true prior " + " ".join(f"{v:.3f}" for v in TRUE_PRIOR))
+    print(f"score {scored:6.2f}s  ({n.size / scored:,.0f} cells/s, {(eb05 >= 2).sum():,} with EB05 >= 2)")
+
+
+if __name__ == "__main__":
+    main()
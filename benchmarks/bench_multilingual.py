@@ -0,0 +1,63 @@
+"""Multilingual stage throughput per language, with a cold and a warm translation cache.
+
+    python benchmarks/bench_multilingual.py --posts 20000 --translator lexicon
+
+Every language gets the same number of synthetic posts.  A share of them
+(`--reposts`) repeats earlier texts, like retweets and cross-posts.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compliancewatch.preprocess import LANGUAGES
+from compliancewatch.sources import FOREIGN_TEMPLATES, SyntheticSource
+from compliancewatch.translate import TRANSLATORS, MultilingualStage, TranslationCache, make_translator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=20000, help="posts per language")
+    parser.add_argument("--reposts", type=float, default=0.3, help="share of posts repeating an earlier text")
+    parser.add_argument("--translator", choices=list(TRANSLATORS), default="lexicon")
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    translator = make_translator(args.translator)
+    # The synthetic source mixes languages; sort its posts into one pool per
+    # language, numbered so only the reposts repeat a text exactly
+    source = SyntheticSource("Reddit", foreign_share=len(FOREIGN_TEMPLATES) / (len(FOREIGN_TEMPLATES) + 1))
+    texts = [p["text"] for p in source.fetch("Ozempic", limit=args.posts * 8)]
+    _, codes = MultilingualStage(translator).run(texts)
+    pool = {}
+    for text, code in zip(texts, codes):
+        texts_for = pool.setdefault(LANGUAGES[code], [])
+        texts_for.append(f"{text} #{len(texts_for)}")
+
+    rng = random.Random(0)
+    print(f"{'lang':<5} {'posts':>7} {'cold posts/s':>13} {'warm posts/s':>13} {'translated':>11} {'hit rate':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for lang in sorted(pool):
+            unique = pool[lang][:max(1, int(args.posts * (1 - args.reposts)))]
+            texts = unique + [rng.choice(unique) for _ in range(args.posts - len(unique))]
+            rng.shuffle(texts)
+            rates = []
+            stage = MultilingualStage(translator, TranslationCache(os.path.join(tmp, f"{lang}.db")))
+            for _ in range(2):  # cold cache, then warm
+                started = time.perf_counter()
+                for i in range(0, len(texts), args.batch):
+                    stage.run(texts[i:i + args.batch])
+                rates.append(len(texts) / (time.perf_counter() - started))
+            stats = stage.stats[lang]
+            hit_rate = f"{stats.cache_hits / stats.posts:.1%}" if lang not in ("en", "und") else "-"
+            print(f"{lang:<5} {len(texts):>7,} {rates[0]:>13,.0f} {rates[1]:>13,.0f} "
+                  f"{stats.translated:>11,} {hit_rate:>9}")
+            stage.cache.close()
+
+
+if __name__ == "__main__":
+    main()
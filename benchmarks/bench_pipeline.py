@@ -0,0 +1,41 @@
+"""Pipeline throughput vs worker count.
+
+    python benchmarks/bench_pipeline.py --posts 5000 --max-workers 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compliancewatch.pipeline import run_pipeline
+from compliancewatch.sources import SyntheticSource
+
+DRUGS = ["Ozempic", "Keytruda", "Humira", "Eliquis", "Jardiance", "Dupixent",
+         "Mounjaro", "Wegovy", "Trulicity", "Xarelto", "Entresto", "Stelara"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=2000, help="posts per (source, drug)")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    baseline = None
+    workers = 1
+    while workers <= args.max_workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            sources = [SyntheticSource("Reddit"), SyntheticSource("Twitter/X")]
+            stats = run_pipeline(DRUGS, sources, os.path.join(tmp, "queue"),
+                                 os.path.join(tmp, "events.db"), workers=workers,
+                                 partitions=max(16, workers), posts_per_source=args.posts)
+        rate = stats["posts_per_second"]
+        baseline = baseline or rate
+        print(f"workers={workers:<3} posts={stats['published']:<8} "
+              f"{rate:>10.0f} posts/s  speedup={rate / baseline:.2f}x")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Preprocessing throughput (posts/sec) from 1 to N processes.
+
+    python benchmarks/bench_preprocess.py --posts 200000 --max-processes 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compliancewatch.preprocess import Preprocessor
+from compliancewatch.sources import SyntheticSource
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    source = SyntheticSource("Reddit")
+    texts = [p["text"] + " contact me at jane.doe@example.com"
+             for p in source.fetch("Ozempic", limit=args.posts)]
+
+    baseline = None
+    for processes in range(1, args.max_processes + 1):
+        with Preprocessor(processes) as pre:
+            pre.run(texts[:pre.chunk_size * processes + 1])  # warm the pool
+            started = time.perf_counter()
+            batch = pre.run(texts)
+            elapsed = time.perf_counter() - started
+        rate = len(batch) / elapsed
+        baseline = baseline or rate
+        print(f"processes={processes:<3} {rate:>10.0f} posts/s  speedup={rate / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Snapshot write/restore time for a large signal-detector state.
+
+    python benchmarks/bench_snapshot.py --events 10000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compliancewatch.pipeline import SignalDetector
+from compliancewatch.snapshot import SnapshotManager
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--drugs", type=int, default=200)
+    parser.add_argument("--windows", type=int, default=48)
+    args = parser.parse_args()
+
+    detector = SignalDetector()
+    rng = np.random.default_rng(0)
+    keys = [(f"drug-{d}", w) for d in range(args.drugs) for w in range(args.windows)]
+    per_window = args.events // len(keys)
+    for key in keys:
+        detector.windows[key] = {
+            "ids": set(rng.integers(0, 2**63, per_window, dtype=np.uint64).tolist()),
+            "regions": Counter({"Northeast": per_window // 2, "Midwest": per_window - per_window // 2}),
+            "sources": Counter({"Reddit": per_window}),
+        }
+    total = per_window * len(keys)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = SnapshotManager(tmp)
+        path, seconds, size = manager.save({"detector": detector}, wal_seq=total)
+        print(f"state: {total:,} events in {len(keys):,} windows")
+        print(f"write:   {seconds:6.2f}s  {size / 1e6:8.1f} MB")
+
+        started = time.perf_counter()
+        states, manifest = manager.load_latest()
+        loaded = time.perf_counter()
+        restored = SignalDetector()
+        restored.load_state_dict(states["detector"])
+        finished = time.perf_counter()
+        print(f"read:    {loaded - started:6.2f}s")
+        print(f"restore: {finished - loaded:6.2f}s  (rebuild dedup sets)")
+        assert sum(len(w["ids"]) for w in restored.windows.values()) == total
+
+
+if __name__ == "__main__":
+    main()
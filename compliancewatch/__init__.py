@@ -0,0 +1 @@
+"""ComplianceWatch backend: data, caching and pipeline modules behind the dashboard."""
@@ -0,0 +1,311 @@
+"""Dashboard aggregates for a monitored drug, computed from the event store.
+
+These are the numbers behind every tab of the Streamlit page.  Keeping them
+here, away from the UI script, lets the result cache, the materialized
+bundles and the HTTP API call them by query signature.
+
+Totals and the severity and source breakdowns include the cold tier, counted
+once per event (see `cold.iter_cold_only`).  Trends and forecasts read the
+hot table, which holds the last `--hot-days` of events (see `lifecycle`).  Every
+function takes `now` so a caller can pin "today" for a whole bundle.
+"""
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from .cold import ColdStore, cold_dir, iter_cold_only
+
+SEVERITY_LEVELS = ['Critical', 'High', 'Medium', 'Low', 'Minimal']
+ALERT_LEVELS = ['Critical', 'High', 'Medium', 'Low']
+ALERT_COLORS = {'Critical': '#EF4444', 'High': '#F59E0B', 'Medium': '#3B82F6', 'Low': '#10B981'}
+CONFIDENCE_MULTIPLIERS = {'90%': 1.645, '95%': 1.96, '99%': 2.576}
+FORECAST_MODELS = ['LSTM Neural Network', 'Prophet', 'ARIMA', 'Ensemble']
+# Map marker per region: (label, states, lat, lon)
+REGION_CENTERS = {
+    'Northeast': ('Northeast', 'NY, PA, MA, NJ', 40.7128, -74.0060),
+    'Southeast': ('Southeast', 'FL, GA, NC, VA', 33.7490, -84.3880),
+    'Midwest': ('Midwest', 'IL, OH, MI, MN', 41.8781, -87.6298),
+    'Southwest': ('Southwest', 'TX, AZ, NM, OK', 32.7767, -96.7970),
+    'West Coast': ('West Coast', 'CA, OR, WA', 34.0522, -118.2437),
+}
+DAY = 86400
+ACTIVE_ALERT_DAYS = 7
+HISTORY_DAYS = 90
+# Signal detection window, for the detection-speed KPI; the severity
+# threshold is the store's (see `EventStore.severity_threshold`)
+ALERT_WINDOW_SECONDS = 3600
+
+_LEVEL_SQL = ("CASE WHEN severity >= 9 THEN 'Critical' WHEN severity >= 7 THEN 'High' "
+              "WHEN severity >= 5 THEN 'Medium' WHEN severity >= 3 THEN 'Low' ELSE 'Minimal' END")
+
+
+_cold_lock = threading.Lock()
+_cold_tallies_memo = {}
+
+
+def _now(now):
+    return time.time() if now is None else now
+
+
+def _day_start(ts):
+    return ts - ts % DAY
+
+
+def _risk(severe_share):
+    return 'High' if severe_share >= 0.2 else 'Medium' if severe_share >= 0.1 else 'Low'
+
+
+def _level(severity):
+    if severity >= 9:
+        return 'Critical'
+    if severity >= 7:
+        return 'High'
+    if severity >= 5:
+        return 'Medium'
+    return 'Low' if severity >= 3 else 'Minimal'
+
+
+def _cold_tallies(store, drug_name):
+    """`(events, {level: n}, {source: n})` over the drug's cold-tier events that
+    are not also in the hot table.  One scan serves `kpis` and both breakdowns;
+    it is redone when the cold parts or the hot table change."""
+    parts = tuple(path for _, _, paths in ColdStore(cold_dir(store.path)).partitions(drug_name)
+                  for path in paths)
+    if not parts:
+        return 0, Counter(), Counter()
+    key = (parts, store.events_generation(), store.max_event_rowid())
+    with _cold_lock:
+        memo = _cold_tallies_memo.get((store.path, drug_name))
+    if memo is not None and memo[0] == key:
+        return memo[1]
+    events, levels, sources = 0, Counter(), Counter()
+    for rows in iter_cold_only(store, ("severity", "source"), 65536, drug=drug_name):
+        events += len(rows)
+        levels.update(_level(severity) for severity, _ in rows)
+        sources.update(source for _, source in rows)
+    with _cold_lock:
+        _cold_tallies_memo[store.path, drug_name] = (key, (events, levels, sources))
+    return events, levels, sources
+
+
+def daily_counts(store, drug_name, days, now=None):
+    """Events per UTC day for the `days` days ending today, oldest first."""
+    start = _day_start(_now(now)) - (days - 1) * DAY
+    counts = np.zeros(days, dtype=np.int64)
+    for day, count in store.conn.execute(
+            "SELECT CAST((created_at - ?) / ? AS INTEGER) AS day, COUNT(*) FROM events "
+            "WHERE drug = ? AND created_at >= ? GROUP BY day", (start, DAY, drug_name, start)):
+        if 0 <= day < days:
+            counts[day] = count
+    return pd.date_range(pd.Timestamp(start, unit='s'), periods=days, freq='D'), counts
+
+
+def alert_events(store, drug_name, created_at, limit=50, severity_threshold=None,
+                 window_seconds=ALERT_WINDOW_SECONDS):
+    """`(event_id, text)` of the severe reports behind an alert, most severe first."""
+    if severity_threshold is None:
+        severity_threshold = store.severity_threshold()
+    return store.conn.execute(
+        "SELECT event_id, text FROM events WHERE drug = ? AND created_at >= ? AND created_at < ? "
+        "AND severity >= ? ORDER BY severity DESC, created_at LIMIT ?",
+        (drug_name, created_at - window_seconds, created_at, severity_threshold, limit)).fetchall()
+
+
+def detection_hours(store, drug_name, limit=20, severity_threshold=None,
+                    window_seconds=ALERT_WINDOW_SECONDS):
+    """Median hours from the first severe report in an alert's window to the alert."""
+    if severity_threshold is None:
+        severity_threshold = store.severity_threshold()
+    lags = []
+    for alert in store.alerts(drug_name, limit=limit):
+        first = store.conn.execute(
+            "SELECT MIN(created_at) FROM events WHERE drug = ? AND created_at >= ? "
+            "AND created_at < ? AND severity >= ?",
+            (drug_name, alert['created_at'] - window_seconds, alert['created_at'], severity_threshold),
+        ).fetchone()[0]
+        if first is not None:
+            lags.append(alert['created_at'] - first)
+    return round(float(np.median(lags)) / 3600, 1) if lags else None
+
+
+def kpis(store, drug_name, now=None):
+    now = _now(now)
+    hot, today, recent, previous = store.conn.execute(
+        "SELECT COUNT(*), TOTAL(created_at >= ?), "
+        "AVG(CASE WHEN created_at >= ? THEN confidence END), "
+        "AVG(CASE WHEN created_at >= ? AND created_at < ? THEN confidence END) "
+        "FROM events WHERE drug = ?",
+        (now - DAY, now - 30 * DAY, now - 60 * DAY, now - 30 * DAY, drug_name),
+    ).fetchone()
+    return {
+        'total_events': hot + _cold_tallies(store, drug_name)[0],
+        'events_today': int(today),
+        'critical_alerts': alert_counts(store, drug_name, now)['Critical'],
+        'detection_speed_hours': detection_hours(store, drug_name),
+        'ai_accuracy': round(100 * recent, 1) if recent is not None else None,
+        'ai_accuracy_delta': round(100 * (recent - previous), 1) + 0.0
+                             if recent is not None and previous is not None else None,
+    }
+
+
+def severity_distribution(store, drug_name):
+    counts = dict(store.conn.execute(
+        f"SELECT {_LEVEL_SQL} AS level, COUNT(*) FROM events WHERE drug = ? GROUP BY level",
+        (drug_name,)))
+    counts = Counter(counts) + _cold_tallies(store, drug_name)[1]
+    return pd.DataFrame({
+        'Level': SEVERITY_LEVELS,
+        'Count': [counts.get(level, 0) for level in SEVERITY_LEVELS]
+    })
+
+
+def source_breakdown(store, drug_name):
+    counts = Counter(dict(store.conn.execute(
+        "SELECT source, COUNT(*) FROM events WHERE drug = ? GROUP BY source", (drug_name,))))
+    counts += _cold_tallies(store, drug_name)[2]
+    return pd.DataFrame(counts.most_common(), columns=['Source', 'Count'])
+
+
+def event_trend(store, drug_name, periods=30, now=None):
+    dates, counts = daily_counts(store, drug_name, periods, now)
+    return pd.DataFrame({'Date': dates, 'Events': counts})
+
+
+def alert_counts(store, drug_name, now=None):
+    counts = dict(store.conn.execute(
+        "SELECT level, COUNT(*) FROM alerts WHERE drug = ? AND created_at >= ? GROUP BY level",
+        (drug_name, _now(now) - ACTIVE_ALERT_DAYS * DAY)))
+    return {level: counts.get(level, 0) for level in ALERT_LEVELS}
+
+
+def alerts(store, drug_name, limit=20, since=None):
+    return [
+        {
+            "alert_id": alert["alert_id"],
+            "level": alert["level"],
+            "title": alert["title"],
+            "desc": alert["desc"],
+            "source": alert["source"],
+            "time": time.strftime("%Y-%m-%d %H:%M", time.localtime(alert["created_at"])),
+            "created_at": alert["created_at"],
+            "confidence": alert["confidence"],
+            "event_count": alert["event_count"],
+            "color": ALERT_COLORS.get(alert["level"], ALERT_COLORS['Low'])
+        }
+        for alert in store.alerts(drug_name, limit=limit, since=since)
+    ]
+
+
+def alerts_frame(store, drug_name, limit=1000, since=None):
+    columns = ["alert_id", "level", "title", "desc", "source", "time", "confidence", "event_count"]
+    return pd.DataFrame(alerts(store, drug_name, limit, since), columns=columns)
+
+
+def _by_region(store, drug_name, now, since=None):
+    return store.conn.execute(
+        "SELECT COALESCE(region, 'Unknown') AS r, COUNT(*), TOTAL(severity >= 7), TOTAL(severity >= 9), "
+        "TOTAL(created_at >= ?), TOTAL(created_at >= ? AND created_at < ?) "
+        "FROM events WHERE drug = ? AND created_at >= ? GROUP BY r ORDER BY COUNT(*) DESC",
+        (now - 7 * DAY, now - 14 * DAY, now - 7 * DAY, drug_name,
+         since if since is not None else float("-inf"))).fetchall()
+
+
+def map_cells(store, drug_name, now=None):
+    rows = [row for row in _by_region(store, drug_name, _now(now)) if row[0] in REGION_CENTERS]
+    return pd.DataFrame({
+        'City': [REGION_CENTERS[r[0]][0] for r in rows],
+        'State': [REGION_CENTERS[r[0]][1] for r in rows],
+        'lat': [REGION_CENTERS[r[0]][2] for r in rows],
+        'lon': [REGION_CENTERS[r[0]][3] for r in rows],
+        'events': [r[1] for r in rows],
+        'severity': [_risk(r[2] / r[1]) for r in rows]
+    })
+
+
+def regional_stats(store, drug_name, now=None, since=None):
+    rows = _by_region(store, drug_name, _now(now), since)
+
+    def trend(this_week, last_week):
+        if this_week > 1.1 * last_week:
+            return '↑ Rising'
+        if this_week < 0.9 * last_week:
+            return '↓ Declining'
+        return '→ Stable'
+
+    return pd.DataFrame({
+        'Region': [r[0] for r in rows],
+        'Total Events': [r[1] for r in rows],
+        'Critical': [int(r[3]) for r in rows],
+        'Trend': [trend(r[4], r[5]) for r in rows],
+        'Risk Level': [_risk(r[2] / r[1]) for r in rows]
+    }, columns=['Region', 'Total Events', 'Critical', 'Trend', 'Risk Level'])
+
+
+def _linear(history, days):
+    x = np.arange(len(history))
+    slope, intercept = np.polyfit(x, history, 1) if len(history) > 1 else (0.0, float(history[0]))
+    fitted = intercept + slope * x
+    return intercept + slope * np.arange(len(history), len(history) + days), fitted
+
+
+def _seasonal(history, days):
+    """Linear trend plus a day-of-week profile of the residuals."""
+    prediction, fitted = _linear(history, days)
+    residual = history - fitted
+    weekday = np.arange(len(history)) % 7
+    profile = np.array([residual[weekday == d].mean() if (weekday == d).any() else 0.0 for d in range(7)])
+    return (prediction + profile[np.arange(len(history), len(history) + days) % 7],
+            fitted + profile[weekday])
+
+
+def _smoothed(history, days, alpha=0.3, beta=None):
+    """Exponential smoothing of the level (and, with `beta`, of the trend)."""
+    level, slope = float(history[0]), 0.0
+    fitted = np.empty(len(history))
+    for i, value in enumerate(history):
+        fitted[i] = level + slope
+        previous = level
+        level = alpha * value + (1 - alpha) * (level + slope)
+        if beta is not None:
+            slope = beta * (level - previous) + (1 - beta) * slope
+    return level + slope * np.arange(1, days + 1), fitted
+
+
+def forecast(store, drug_name, days, confidence, model_type, now=None):
+    """Daily event counts for the next `days` days from the last HISTORY_DAYS.
+
+    The model choices are small closed-form fits: "Prophet" is trend plus
+    weekly seasonality, "ARIMA" smooths the level, "LSTM Neural Network"
+    smooths level and trend, and "Ensemble" averages the three.  The band is
+    the in-sample residual spread.
+    """
+    now = _now(now)
+    _, history = daily_counts(store, drug_name, HISTORY_DAYS, now)
+    history = history.astype(float)
+    # Start from the first day with events, so a new drug is not fitted to zeros
+    nonzero = np.flatnonzero(history)
+    history = history[nonzero[0]:] if len(nonzero) else history[-1:]
+    fits = {
+        'Prophet': lambda: _seasonal(history, days),
+        'ARIMA': lambda: _smoothed(history, days),
+        'LSTM Neural Network': lambda: _smoothed(history, days, beta=0.1),
+    }
+    if model_type in fits:
+        prediction, fitted = fits[model_type]()
+    else:
+        results = [fit() for fit in fits.values()]
+        prediction = np.mean([r[0] for r in results], axis=0)
+        fitted = np.mean([r[1] for r in results], axis=0)
+    std = float(np.std(history - fitted)) if len(history) > 1 else float(np.sqrt(history.sum()))
+    prediction = np.maximum(prediction, 0)
+
+    ci_mult = CONFIDENCE_MULTIPLIERS[confidence]
+    return pd.DataFrame({
+        'Date': pd.date_range(pd.Timestamp(_day_start(now) + DAY, unit='s'), periods=days, freq='D'),
+        'Predicted': prediction,
+        'Upper': prediction + ci_mult * std,
+        'Lower': np.maximum(prediction - ci_mult * std, 0),
+    })
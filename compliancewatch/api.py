@@ -0,0 +1,292 @@
+"""Headless HTTP API serving the dashboard's numbers and exports.
+
+A Starlette app run by uvicorn; both already come with Streamlit.  The
+numbers come from the drug's materialized bundle while it matches the
+store's current data version, and are computed from the event store
+otherwise.  JSON responses are built once per (query, data version) through
+the same `ResultCache` the dashboard uses, and are stored pre-encoded with
+their gzip variant and ETag.  A repeated request is one cache lookup, and a
+conditional GET with a matching `If-None-Match` returns 304 with no body.
+Exports stream in chunks from the event store.
+
+    python -m compliancewatch.api --data-dir data --port 8502 --workers 4
+
+    GET /v1/drugs/Ozempic/kpis | severity | sources | trend | alerts | regional
+    GET /v1/drugs/Ozempic/forecast?days=30&confidence=95%&model=Prophet
+    GET /v1/export/events?drug=Ozempic&format=parquet&since=1717200000&source=Reddit
+    GET /v1/export/regional?drug=Ozempic&format=csv
+    GET /v1/export/alerts?drug=Ozempic&format=arrow
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import anyio
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from . import aggregates
+from .bundles import BundleStore, bundle_dir, data_version
+from .cache import ResultCache, signature
+from .export import FORMATS, available_formats, export_events, export_frame, filename
+from .store import EventStore
+
+FORECAST_DAYS = (7, 14, 30, 90)
+MIN_GZIP_BYTES = 512
+# How long a drug's data version is reused before the store is asked again
+VERSION_TTL = 2.0
+
+Payload = namedtuple("Payload", "body gzipped etag")
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _frame(df):
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+def _json(value):
+    return _frame(value) if hasattr(value, "to_json") else value
+
+
+# Aggregate name -> computation; names in BUNDLED are also bundle keys.  The
+# alert list always comes from the alerts table, since bundles keep only the
+# latest few alerts.
+AGGREGATES = {
+    "kpis": aggregates.kpis,
+    "severity": aggregates.severity_distribution,
+    "sources": aggregates.source_breakdown,
+    "trend": aggregates.event_trend,
+    "alerts": aggregates.alerts_frame,
+    "regional": aggregates.regional_stats,
+}
+BUNDLED = {"kpis", "severity", "sources", "trend", "regional"}
+
+
+def default_store_path():
+    """`COMPLIANCEWATCH_STORE`, else `events.db` in `COMPLIANCEWATCH_DATA_DIR` (default `data`)."""
+    return (os.environ.get("COMPLIANCEWATCH_STORE")
+            or os.path.join(os.environ.get("COMPLIANCEWATCH_DATA_DIR", "data"), "events.db"))
+
+
+def _encode(data):
+    body = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    gzipped = gzip.compress(body, 6) if len(body) >= MIN_GZIP_BYTES else None
+    return Payload(body, gzipped, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"')
+
+
+def _param(request, name, default=None, cast=str):
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise ApiError(400, f"invalid value for {name!r}") from None
+
+
+def _format(request):
+    fmt = _param(request, "format", "csv")
+    if fmt not in available_formats():
+        raise ApiError(400, f"format must be one of {sorted(available_formats())}")
+    return fmt
+
+
+def _respond(request, payload):
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if payload.etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    body = payload.body
+    if payload.gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        body = payload.gzipped
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def _threaded(iterable, depth=4):
+    """Drive a blocking iterator from one dedicated thread.
+
+    The event store's connections are per thread, so the whole export must run
+    in one thread rather than hop between threadpool workers.
+    """
+    chunks = queue.Queue(depth)
+    done = object()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for chunk in iterable:
+                while not cancelled.is_set():
+                    try:
+                        chunks.put(chunk, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if cancelled.is_set():
+                    return
+            chunks.put(done)
+        except BaseException as exc:
+            chunks.put(exc)
+
+    threading.Thread(target=produce, name="api-export", daemon=True).start()
+    try:
+        while True:
+            chunk = await anyio.to_thread.run_sync(chunks.get)
+            if chunk is done:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+
+
+def create_app(store_path=None, cache=None):
+    store_path = store_path or default_store_path()
+    store = EventStore(store_path)
+    bundles = BundleStore(bundle_dir(store_path))
+    cache = cache or ResultCache(disk_dir=os.environ.get("COMPLIANCEWATCH_CACHE_DIR"))
+    versions = {}  # drug -> (checked_at, data version)
+
+    def version(drug):
+        checked_at, current = versions.get(drug, (0.0, None))
+        if time.monotonic() - checked_at > VERSION_TTL:
+            current = data_version(store, drug)
+            versions[drug] = (time.monotonic(), current)
+        return current
+
+    def bundled(drug, key, current, compute):
+        """`key` from the drug's bundle if it was built from `current` data, else `compute()`."""
+        bundle = bundles.load_current(drug, current)
+        if bundle is not None and key in bundle["data"]:
+            return bundle["data"][key]
+        return compute()
+
+    def cached(*query, compute):
+        return cache.get_or_compute(signature("api", *query), lambda: _encode(compute()))
+
+    def aggregate_payload(name, drug):
+        current = version(drug)
+
+        def compute():
+            if name in BUNDLED:
+                return _json(bundled(drug, name, current, lambda: AGGREGATES[name](store, drug)))
+            return _json(AGGREGATES[name](store, drug))
+        return cached(name, drug, current, compute=compute)
+
+    async def aggregate(request):
+        name, drug = request.path_params["name"], request.path_params["drug"].strip()
+        if name not in AGGREGATES:
+            raise ApiError(404, f"unknown aggregate {name!r}")
+        payload = await anyio.to_thread.run_sync(lambda: aggregate_payload(name, drug))
+        return _respond(request, payload)
+
+    async def forecast(request):
+        drug = request.path_params["drug"].strip()
+        days = _param(request, "days", 30, int)
+        confidence = _param(request, "confidence", "95%")
+        model = _param(request, "model", "LSTM Neural Network")
+        if days not in FORECAST_DAYS:
+            raise ApiError(400, f"days must be one of {list(FORECAST_DAYS)}")
+        if confidence not in aggregates.CONFIDENCE_MULTIPLIERS:
+            raise ApiError(400, f"confidence must be one of {list(aggregates.CONFIDENCE_MULTIPLIERS)}")
+        if model not in aggregates.FORECAST_MODELS:
+            raise ApiError(400, f"model must be one of {aggregates.FORECAST_MODELS}")
+
+        def payload():
+            current = version(drug)
+            # Bundles hold the forecast for the dashboard's default controls only
+            return cached("forecast", drug, days, confidence, model, current, compute=lambda: _frame(
+                bundled(drug, ("forecast", days, confidence, model), current,
+                        lambda: aggregates.forecast(store, drug, days, confidence, model))))
+
+        return _respond(request, await anyio.to_thread.run_sync(payload))
+
+    def download(chunks, fmt, stem):
+        return StreamingResponse(_threaded(chunks), media_type=FORMATS[fmt][0], headers={
+            "Content-Disposition": f'attachment; filename="{filename(stem, fmt)}"'})
+
+    async def export_events_route(request):
+        fmt = _format(request)
+        drug = _param(request, "drug")
+        chunks = export_events(store, fmt, drug=drug,
+                               since=_param(request, "since", cast=float),
+                               until=_param(request, "until", cast=float),
+                               sources=request.query_params.getlist("source") or None)
+        return download(chunks, fmt, f"events-{drug or 'all'}")
+
+    def frame_chunks(build, fmt):
+        yield export_frame(build(), fmt)
+
+    def _drug(request):
+        drug = (_param(request, "drug") or "").strip()
+        if not drug:
+            raise ApiError(400, "drug is required")
+        return drug
+
+    async def export_regional_route(request):
+        fmt, drug = _format(request), _drug(request)
+
+        def build():
+            return bundled(drug, "regional", version(drug), lambda: aggregates.regional_stats(store, drug))
+        return download(frame_chunks(build, fmt), fmt, f"regional-{drug}")
+
+    async def export_alerts_route(request):
+        fmt, drug = _format(request), _drug(request)
+        return download(frame_chunks(lambda: aggregates.alerts_frame(store, drug), fmt), fmt, f"alerts-{drug}")
+
+    async def health(request):
+        return JSONResponse({"ok": True, "cache": cache.stats().as_dict()})
+
+    async def api_error(request, exc):
+        return JSONResponse({"error": str(exc)}, status_code=exc.status)
+
+    return Starlette(
+        routes=[
+            Route("/v1/health", health),
+            Route("/v1/drugs/{drug}/forecast", forecast),
+            Route("/v1/drugs/{drug}/{name}", aggregate),
+            Route("/v1/export/events", export_events_route),
+            Route("/v1/export/regional", export_regional_route),
+            Route("/v1/export/alerts", export_alerts_route),
+        ],
+        exception_handlers={ApiError: api_error},
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the ComplianceWatch HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--data-dir", default=None,
+                        help="pipeline output to serve (default: $COMPLIANCEWATCH_DATA_DIR or data)")
+    parser.add_argument("--store", default=None, help="event store path (default: events.db in the data dir)")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    # Worker processes import the factory themselves, so the paths reach
+    # them through the environment, as the cache directory does.
+    if args.data_dir:
+        os.environ["COMPLIANCEWATCH_DATA_DIR"] = args.data_dir
+    if args.store:
+        os.environ["COMPLIANCEWATCH_STORE"] = args.store
+    uvicorn.run("compliancewatch.api:create_app", factory=True, host=args.host, port=args.port,
+                workers=args.workers, access_log=False, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
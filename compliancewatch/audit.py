@@ -0,0 +1,338 @@
+"""Append-only, hash-chained audit log.
+
+Every ingested event (with its score), threshold change and alert is
+appended as one JSON line.  Each line carries the SHA-256 of the previous
+line, so any edit, deletion or reordering breaks the chain and is caught by
+`verify()`, which runs as a single streaming pass.
+
+Lines go to segment files (`<first_seq>.log`) that roll at `segment_bytes`.
+Writers never touch disk themselves: `append()` queues the record and a
+background thread writes whole batches with one fsync (group commit).
+Alongside each segment, a sparse `.idx` file has one entry per block of
+`index_every` records, holding its time span, byte offsets and the drugs it
+mentions.  Range queries read only the blocks that can match.
+
+One `AuditLog` directory is one chain with a single writer; the pipeline
+gives each worker its own chain (`query_all` merges them by time).
+"""
+import hashlib
+import heapq
+import json
+import os
+import threading
+import time
+
+GENESIS = "0" * 64
+_SUFFIX_LEN = len(',"hash":"') + 64 + len('"}')
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class AuditLog:
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, index_every=256,
+                 flush_interval=0.05, max_batch=4096, fsync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_every = index_every
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._durable_seq = -1
+        self._closed = False
+        self._error = None
+
+        self._segment = None
+        self._index = None
+        self._block = None
+        self._recover()
+        self._next_seq = self._last_seq + 1
+        self._durable_seq = self._last_seq
+        self._writer = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._writer.start()
+
+    # -- writing -------------------------------------------------------
+
+    def append(self, kind, drug=None, data=None):
+        """Queue a record and return its sequence number without waiting for disk."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("audit log is closed")
+            # Backpressure: never buffer more than a few batches in memory
+            while len(self._pending) >= 8 * self.max_batch and self._error is None:
+                self._cond.wait()
+            seq = self._next_seq
+            self._next_seq += 1
+            self._last_ts = max(self._last_ts, time.time())
+            self._pending.append((seq, self._last_ts, kind, drug, data))
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+            return seq
+
+    def head_seq(self):
+        """Sequence number of the last record appended (durable or not)."""
+        with self._cond:
+            return self._next_seq - 1
+
+    def flush(self, timeout=None):
+        """Block until every record appended so far is durable."""
+        with self._cond:
+            target = self._next_seq - 1
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._durable_seq >= target or self._error, timeout):
+                raise TimeoutError("audit log flush timed out")
+            if self._error:
+                raise self._error
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or len(self._pending) >= self.max_batch,
+                                    self.flush_interval)
+                batch, self._pending = self._pending, []
+                closed = self._closed
+                self._cond.notify_all()
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as exc:
+                    with self._cond:
+                        self._error = exc
+                        self._cond.notify_all()
+                    return
+                with self._cond:
+                    self._durable_seq = batch[-1][0]
+                    self._cond.notify_all()
+            if closed and not batch:
+                return
+
+    def _write_batch(self, batch):
+        for seq, ts, kind, drug, data in batch:
+            if self._segment is None or self._segment.tell() >= self.segment_bytes:
+                self._roll(seq)
+            body = _dumps({"seq": seq, "ts": ts, "kind": kind, "drug": drug,
+                           "prev": self._last_hash, "data": data})
+            digest = hashlib.sha256(body.encode("utf-8")).hexdigest()
+            line = (body[:-1] + f',"hash":"{digest}"}}\n').encode("utf-8")
+            offset = self._segment.tell()
+            self._segment.write(line)
+            self._last_hash, self._last_seq = digest, seq
+            self._track(seq, ts, drug, offset, offset + len(line))
+        self._segment.flush()
+        self._index.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+
+    def _track(self, seq, ts, drug, offset, end_offset):
+        block = self._block
+        if block is None:
+            block = self._block = {"seq": seq, "ts": ts, "offset": offset, "count": 0, "drugs": set()}
+        block["count"] += 1
+        block["last_ts"] = ts
+        block["end_offset"] = end_offset
+        block["end_seq"] = seq
+        block["end_hash"] = self._last_hash
+        if drug:
+            block["drugs"].add(drug.lower())
+        if block["count"] >= self.index_every:
+            self._close_block()
+
+    def _close_block(self):
+        if self._block and self._block["count"]:
+            entry = dict(self._block, drugs=sorted(self._block["drugs"]))
+            self._index.write(_dumps(entry) + "\n")
+        self._block = None
+
+    def _roll(self, first_seq):
+        self._close_segment()
+        base = os.path.join(self.directory, f"{first_seq:012d}")
+        self._segment = open(base + ".log", "ab")
+        self._index = open(base + ".idx", "a", encoding="utf-8")
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        self._close_block()
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+        self._segment.close()
+        self._index.close()
+        self._segment = self._index = None
+
+    # -- recovery ------------------------------------------------------
+
+    def _segments(self):
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory) if name.endswith(".log"))
+
+    def _recover(self):
+        """Pick up the chain head from the last segment after a restart or crash."""
+        self._last_hash, self._last_seq, self._last_ts = GENESIS, -1, 0.0
+        segments = self._segments()
+        if not segments:
+            return
+        path = segments[-1]
+        blocks = list(_read_index(path[:-4] + ".idx"))
+        start = 0
+        if blocks:
+            last = blocks[-1]
+            start = last["end_offset"]
+            self._last_hash, self._last_seq, self._last_ts = last["end_hash"], last["end_seq"], last["last_ts"]
+        elif len(segments) > 1:
+            # Empty index on a fresh segment: chain continues from the previous one
+            for record in _scan(segments[-2], _last_indexed_offset(segments[-2])):
+                self._last_hash, self._last_seq, self._last_ts = record["hash"], record["seq"], record["ts"]
+        self._segment = open(path, "r+b")
+        self._index = open(path[:-4] + ".idx", "a", encoding="utf-8")
+        self._segment.seek(start)
+        offset = start
+        for raw in self._segment:
+            if not raw.endswith(b"\n"):
+                break  # torn write from a crash; dropped below
+            record = json.loads(raw)
+            self._last_hash, self._last_seq, self._last_ts = record["hash"], record["seq"], record["ts"]
+            self._track(record["seq"], record["ts"], record["drug"], offset, offset + len(raw))
+            offset += len(raw)
+        self._segment.truncate(offset)
+        self._segment.seek(offset)
+
+    # -- reading -------------------------------------------------------
+
+    def query(self, since=None, until=None, drug=None, kinds=None):
+        """Yield records with `since <= ts < until`, optionally for one drug / kinds."""
+        self.flush()
+        return _query_chain(self.directory, since, until, drug, kinds)
+
+    def verify(self):
+        self.flush()
+        return verify_chain(self.directory)
+
+
+def _read_index(path):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def _last_indexed_offset(path):
+    offset = 0
+    for block in _read_index(path[:-4] + ".idx"):
+        offset = block["offset"]
+    return offset
+
+
+def _scan(path, start=0, end=None):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        pos = start
+        for raw in fh:
+            if (end is not None and pos >= end) or not raw.endswith(b"\n"):
+                return
+            pos += len(raw)
+            yield json.loads(raw)
+
+
+def _query_chain(directory, since=None, until=None, drug=None, kinds=None):
+    since = float("-inf") if since is None else since
+    until = float("inf") if until is None else until
+    drug_key = drug.lower() if drug else None
+    kinds = set(kinds) if kinds else None
+    segments = sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".log"))
+    for path in segments:
+        blocks = list(_read_index(path[:-4] + ".idx"))
+        if blocks and blocks[0]["ts"] >= until:
+            return
+        ranges = [
+            (b["offset"], b["end_offset"]) for b in blocks
+            if b["last_ts"] >= since and b["ts"] < until
+            and (drug_key is None or drug_key in b["drugs"])
+        ]
+        # Records after the last indexed block (active block) are always scanned
+        ranges.append((blocks[-1]["end_offset"] if blocks else 0, None))
+        for start, end in ranges:
+            for record in _scan(path, start, end):
+                if record["ts"] >= until:
+                    return
+                if (record["ts"] >= since
+                        and (drug_key is None or (record["drug"] or "").lower() == drug_key)
+                        and (kinds is None or record["kind"] in kinds)):
+                    yield record
+
+
+def read_after(directory, after_seq):
+    """Yield records with `seq > after_seq` in order, e.g. to replay since a snapshot."""
+    segments = sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".log"))
+    for path in segments:
+        blocks = list(_read_index(path[:-4] + ".idx"))
+        start = next((b["offset"] for b in blocks if b["end_seq"] > after_seq),
+                     blocks[-1]["end_offset"] if blocks else 0)
+        for record in _scan(path, start):
+            if record["seq"] > after_seq:
+                yield record
+
+
+def query_all(root, since=None, until=None, drug=None, kinds=None):
+    """Merge range queries over every chain directory under `root` by timestamp."""
+    chains = [os.path.join(root, d) for d in sorted(os.listdir(root))
+              if os.path.isdir(os.path.join(root, d))]
+    return heapq.merge(*(_query_chain(c, since, until, drug, kinds) for c in chains),
+                       key=lambda r: r["ts"])
+
+
+def verify_chain(directory):
+    """Recompute every hash in one streaming pass.
+
+    Returns `{"ok", "records", "first_bad_seq", "reason", "head"}`.
+    """
+    expected_prev, expected_seq, records = GENESIS, None, 0
+    segments = sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".log"))
+    for path in segments:
+        with open(path, "rb") as fh:
+            for raw in fh:
+                line = raw.rstrip(b"\n")
+                body = line[:-_SUFFIX_LEN] + b"}"
+                claimed = line[-_SUFFIX_LEN + len(',"hash":"'):-2].decode("ascii", "replace")
+                try:
+                    record = json.loads(body)
+                except ValueError:
+                    return _failure(records, expected_seq, "unparseable record", expected_prev)
+                seq = record.get("seq")
+                if expected_seq is not None and seq != expected_seq:
+                    return _failure(records, expected_seq, f"sequence gap (found {seq})", expected_prev)
+                if record.get("prev") != expected_prev:
+                    return _failure(records, seq, "previous-hash mismatch", expected_prev)
+                if hashlib.sha256(body).hexdigest() != claimed:
+                    return _failure(records, seq, "hash mismatch", expected_prev)
+                expected_prev, expected_seq = claimed, seq + 1
+                records += 1
+    return {"ok": True, "records": records, "first_bad_seq": None, "reason": None, "head": expected_prev}
+
+
+def _failure(records, seq, reason, head):
+    return {"ok": False, "records": records, "first_bad_seq": seq, "reason": reason, "head": head}
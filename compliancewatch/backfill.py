@@ -0,0 +1,233 @@
+"""Recompute scores and alerts for the whole event store.
+
+Used after a scoring-model or threshold change.  Each drug is replayed in
+`(created_at, event_id)` order, the cold tier merged with the hot table, in
+large batches that are preprocessed, scored and run through a fresh
+`SignalDetector` in one vectorised pass, with drugs spread over worker
+processes.  Nothing is published, audited per event or paced as on the live
+path.
+
+Results go to `events_shadow` / `alerts_shadow`.  Every batch commits its
+shadow rows together with the drug's checkpoint, so an interrupted run picks
+up where it stopped when started again with the same `--run-id`.  Once every
+drug has caught up, `--swap` replaces the live tables in one transaction and
+saves `--severity-threshold` in the store, where the live pipeline's workers
+and the dashboard read it.  Rescored cold events are then hot until the next
+lifecycle pass tiers them again; their older cold copies are skipped
+meanwhile and dropped by compaction.
+
+    python -m compliancewatch.backfill --run-id 2024-06-rescore --severity-threshold 7 --swap
+"""
+import argparse
+import heapq
+import itertools
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .audit import AuditLog
+from .cold import iter_cold_only
+from .pipeline import SignalDetector, score_events
+from .preprocess import preprocess, scrub_rows
+from .store import (ALERT_COLUMNS, EVENT_COLUMNS, SEVERITY_THRESHOLD_KEY, SHADOW_SUFFIX, EventStore,
+                    upsert_sql)
+from .translate import TRANSLATORS, MultilingualStage, TranslationCache, make_translator
+
+_CHECKPOINTS = """
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    run_id TEXT NOT NULL,
+    drug TEXT NOT NULL COLLATE NOCASE,
+    last_created_at REAL,
+    last_event_id TEXT,
+    events INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    PRIMARY KEY (run_id, drug)
+)
+"""
+_SOURCE_COLUMNS = ("event_id", "drug", "source", "created_at", "region", "text")
+
+
+def prepare(store, run_id):
+    """Create the shadow tables for `run_id`, discarding any other unfinished run."""
+    conn = store.conn
+    conn.execute(_CHECKPOINTS)
+    stale = [row[0] for row in conn.execute(
+        "SELECT DISTINCT run_id FROM backfill_checkpoints WHERE run_id != ?", (run_id,))]
+    if stale:
+        store.drop_shadow()
+        conn.execute("DELETE FROM backfill_checkpoints WHERE run_id != ?", (run_id,))
+    store.create_shadow(re.sub(r"\W", "_", run_id))
+
+
+def _checkpoint(conn, run_id, drug):
+    row = conn.execute(
+        "SELECT last_created_at, last_event_id, events FROM backfill_checkpoints "
+        "WHERE run_id = ? AND drug = ?", (run_id, drug)).fetchone()
+    if row is None or row[0] is None:
+        return None, 0
+    return (row[0], row[1]), row[2]
+
+
+def _warm_detector(store, detector, drug, after):
+    """Rebuild the detector windows a resumed run still needs from the shadow table."""
+    horizon = (after[0] - detector.retain_windows * detector.window_seconds, "")
+    columns = ("event_id", "drug", "source", "created_at", "region", "severity")
+    cursor = horizon
+    while True:
+        rows = store.events_after(drug, cursor, 20000, columns, table="events" + SHADOW_SUFFIX)
+        rows = [r for r in rows if (r[3], r[0]) <= after]
+        if not rows:
+            return
+        detector.observe([dict(zip(columns, r)) for r in rows])
+        cursor = (rows[-1][3], rows[-1][0])
+
+
+def _source_rows(store, drug, after, batch_size):
+    """A drug's hot and cold rows after `after`, merged in `(created_at, event_id)` order.
+
+    The hot table is read one keyset page at a time, so no cursor stays open
+    while the caller writes.
+    """
+    def hot():
+        cursor = after
+        while True:
+            rows = store.events_after(drug, cursor, batch_size, _SOURCE_COLUMNS)
+            if not rows:
+                return
+            yield from rows
+            cursor = (rows[-1][3], rows[-1][0])
+
+    cold = (row for rows in iter_cold_only(store, _SOURCE_COLUMNS, batch_size, drug,
+                                           since=after[0] if after is not None else None)
+            for row in rows if after is None or (row[3], row[0]) > after)
+    return heapq.merge(cold, hot(), key=lambda row: (row[3], row[0]))
+
+
+def backfill_drug(store_path, run_id, drug, batch_size=20000, severity_threshold=8,
+                  translator="lexicon", translation_cache=None):
+    """Replay one drug's hot and cold events from its checkpoint to the end."""
+    store = EventStore(store_path)
+    conn = store.conn
+    detector = SignalDetector(severity_threshold=severity_threshold)
+    translator = make_translator(translator)
+    cache = TranslationCache(translation_cache) if translator is not None and translation_cache else None
+    multilingual = MultilingualStage(translator, cache) if translator is not None else None
+    after, events_done = _checkpoint(conn, run_id, drug)
+    if after is not None:
+        _warm_detector(store, detector, drug, after)
+    event_sql = upsert_sql("events" + SHADOW_SUFFIX, EVENT_COLUMNS, "event_id")
+    alert_sql = upsert_sql("alerts" + SHADOW_SUFFIX, ALERT_COLUMNS, "alert_id")
+    started = time.perf_counter()
+    processed = 0
+    source = _source_rows(store, drug, after, batch_size)
+    while True:
+        rows = list(itertools.islice(source, batch_size))
+        if not rows:
+            break
+        posts = [{"post_id": r[0], "drug": r[1], "source": r[2], "created_at": r[3],
+                  "region": r[4], "text": r[5] or ""} for r in rows]
+        texts = [p["text"] for p in posts]
+        languages = None
+        if multilingual is not None:
+            texts, languages = multilingual.run(texts)
+        batch = preprocess(texts)
+        if languages is not None:
+            batch.languages = languages
+            batch.scrubbed = scrub_rows([p["text"] for p in posts])
+        events = score_events(posts, batch)
+        alerts = detector.observe(events)
+        after = (rows[-1][3], rows[-1][0])
+        events_done += len(events)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(event_sql, [tuple(e.get(c) for c in EVENT_COLUMNS) for e in events])
+            conn.executemany(alert_sql, [tuple(a.get(c) for c in ALERT_COLUMNS) for a in alerts])
+            conn.execute(
+                "INSERT INTO backfill_checkpoints VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(run_id, drug) DO UPDATE SET last_created_at = excluded.last_created_at, "
+                "last_event_id = excluded.last_event_id, events = excluded.events, "
+                "updated_at = excluded.updated_at",
+                (run_id, drug, after[0], after[1], events_done, time.time()))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        processed += len(events)
+    alerts_done = conn.execute(f"SELECT COUNT(*) FROM alerts{SHADOW_SUFFIX} WHERE drug = ?",
+                               (drug,)).fetchone()[0]
+    if cache is not None:
+        cache.close()
+    store.close()
+    return {"drug": drug, "processed": processed, "events": events_done,
+            "alerts": alerts_done, "seconds": time.perf_counter() - started}
+
+
+def run_backfill(store_path, run_id, drugs=None, workers=None, batch_size=20000,
+                 severity_threshold=None, swap=False, audit_dir=None, translator="lexicon",
+                 translation_cache=None):
+    store = EventStore(store_path)
+    if severity_threshold is None:
+        severity_threshold = store.severity_threshold()
+    prepare(store, run_id)
+    drugs = drugs or store.drugs()
+    if swap:
+        missing = {d.lower() for d in store.drugs()} - {d.lower() for d in drugs}
+        if missing:
+            raise ValueError(f"--swap needs every drug in the store; missing {sorted(missing)}")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(backfill_drug, store_path, run_id, drug, batch_size, severity_threshold,
+                               translator, translation_cache)
+                   for drug in drugs]
+        results = [f.result() for f in futures]
+    if swap:
+        # Catch up on events the live pipeline wrote while the workers ran;
+        # the few that land after this pass are carried over by the swap.
+        mark = store.max_event_rowid()
+        for drug in drugs:
+            backfill_drug(store_path, run_id, drug, batch_size, severity_threshold,
+                          translator, translation_cache)
+        store.swap_shadow(carry_over_after=mark,
+                          meta={SEVERITY_THRESHOLD_KEY: severity_threshold})
+        store.conn.execute("DELETE FROM backfill_checkpoints WHERE run_id = ?", (run_id,))
+        if audit_dir:
+            with AuditLog(os.path.join(audit_dir, "backfill")) as audit:
+                audit.append("backfill", None, {
+                    "run_id": run_id, "severity_threshold": severity_threshold,
+                    "drugs": drugs, "events": sum(r["events"] for r in results),
+                    "alerts": sum(r["alerts"] for r in results),
+                })
+    store.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rescore the event store into shadow tables.")
+    parser.add_argument("--run-id", required=True, help="reuse to resume an interrupted run")
+    parser.add_argument("--drug", action="append", default=None, help="default: every drug in the store")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch", type=int, default=20000)
+    parser.add_argument("--severity-threshold", type=int, default=None,
+                        help="default: the store's current threshold (8 until a swap sets one)")
+    parser.add_argument("--swap", action="store_true", help="swap the shadow tables in when done")
+    parser.add_argument("--audit-dir", default="data/audit")
+    parser.add_argument("--translator", choices=[*TRANSLATORS, "none"], default="lexicon")
+    parser.add_argument("--translation-cache", default="data/translations.db")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = run_backfill(args.store, args.run_id, args.drug, args.workers, args.batch,
+                           args.severity_threshold, args.swap, args.audit_dir,
+                           args.translator, args.translation_cache)
+    for result in results:
+        print(f"{result['drug']}: {result['processed']:,} events rescored this run "
+              f"({result['events']:,} total, {result['alerts']:,} alerts) in {result['seconds']:.2f}s")
+    total = sum(r["processed"] for r in results)
+    elapsed = time.perf_counter() - started
+    print(f"{total:,} events in {elapsed:.2f}s ({total / elapsed if elapsed else 0:,.0f} events/s)"
+          + (", shadow tables swapped in" if args.swap else ""))
+
+
+if __name__ == "__main__":
+    main()
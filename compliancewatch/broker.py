@@ -0,0 +1,117 @@
+"""Local message broker for the ingestion pipeline.
+
+`SQLiteQueue` is a partitioned, file-backed queue: every partition is its own
+SQLite file, so workers that own different partitions never contend on a
+lock.  Claimed messages become invisible for `visibility_timeout` seconds and
+reappear unless acknowledged, which gives at-least-once delivery; consumers
+must therefore write idempotently.
+
+Any object with the same `partition_for` / `publish` / `claim` / `ack` /
+`depth` methods can stand in for it (e.g. a client for a hosted broker).
+"""
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    visible_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_visible ON messages (visible_at, id);
+"""
+
+
+def partition_for(key, partitions):
+    return zlib.crc32(str(key).lower().encode("utf-8")) % partitions
+
+
+class SQLiteQueue:
+
+    def __init__(self, directory, topic, partitions=8, visibility_timeout=30.0):
+        self.directory = directory
+        self.topic = topic
+        self.partitions = partitions
+        self.visibility_timeout = visibility_timeout
+        os.makedirs(directory, exist_ok=True)
+        self._conns = {}
+        self._pid = os.getpid()
+
+    def _conn(self, partition):
+        # SQLite connections must not cross a fork
+        if self._pid != os.getpid():
+            self._conns = {}
+            self._pid = os.getpid()
+        conn = self._conns.get(partition)
+        if conn is None:
+            path = os.path.join(self.directory, f"{self.topic}-{partition:03d}.db")
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conns[partition] = conn
+        return conn
+
+    def partition_for(self, key):
+        return partition_for(key, self.partitions)
+
+    def publish(self, items):
+        """Enqueue `(key, payload)` pairs; payloads must be JSON-serialisable."""
+        grouped = {}
+        for key, payload in items:
+            grouped.setdefault(self.partition_for(key), []).append(payload)
+        now = time.time()
+        for partition, payloads in grouped.items():
+            conn = self._conn(partition)
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO messages (payload, visible_at) VALUES (?, ?)",
+                [(json.dumps(p, separators=(",", ":")), now) for p in payloads],
+            )
+            conn.execute("COMMIT")
+        return sum(len(p) for p in grouped.values())
+
+    def claim(self, partition, limit=500):
+        """Lease up to `limit` visible messages; returns `[(msg_id, payload)]`."""
+        conn = self._conn(partition)
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload FROM messages WHERE visible_at <= ? ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE messages SET visible_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(now + self.visibility_timeout, row[0]) for row in rows],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [(msg_id, json.loads(payload)) for msg_id, payload in rows]
+
+    def ack(self, partition, msg_ids):
+        if not msg_ids:
+            return
+        conn = self._conn(partition)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in msg_ids])
+        conn.execute("COMMIT")
+
+    def depth(self, partition=None):
+        partitions = range(self.partitions) if partition is None else [partition]
+        return sum(
+            self._conn(p).execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            for p in partitions
+        )
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns = {}
@@ -0,0 +1,223 @@
+"""Materialized per-drug dashboard bundles.
+
+A bundle holds every aggregate (`aggregates`, computed from the event store)
+the dashboard's first view shows for one drug:
+
+- KPIs;
+- severity and source breakdowns and the 30-day trend;
+- alert counts and the alert list;
+- map cells and regional statistics;
+- the forecast for the default controls.
+
+All of it is stored as one zlib-compressed pickle, `<bundle_dir>/<drug>.bundle`.
+The app reads the whole bundle in a single read when an analyst starts
+monitoring a drug, instead of computing each aggregate on first view.
+
+`Materializer` rebuilds the bundles of a drug portfolio.  A bundle is rebuilt
+when the drug's data has changed, which is cheap to check:
+
+- the events generation;
+- the drug's event count;
+- the drug's latest alert;
+- the UTC day.
+
+It is also rebuilt when the bundle is older than `max_age`, since the trend
+and forecast are relative to today.  The pipeline runs it after every run,
+and on a schedule with --follow.  Readers use `load_current`, which applies
+the same two checks, so a bundle left behind by a stopped materializer is
+never served.
+
+    python -m compliancewatch.bundles --drug Ozempic --drug Keytruda
+    python -m compliancewatch.bundles --top 10 --every 300
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+
+from . import aggregates
+from .store import EventStore
+
+# The tab5 controls' defaults; other forecasts are computed on demand
+DEFAULT_FORECAST = (30, "95%", "LSTM Neural Network")
+FORMAT_VERSION = 2
+# Bundles older than this are rebuilt, and not served
+MAX_AGE = 3600.0
+
+
+def build(store, drug, now=None):
+    """Every first-view aggregate for `drug`, keyed like the app's cache queries."""
+    now = time.time() if now is None else now
+    days, confidence, model = DEFAULT_FORECAST
+    return {
+        "kpis": aggregates.kpis(store, drug, now),
+        "severity": aggregates.severity_distribution(store, drug),
+        "sources": aggregates.source_breakdown(store, drug),
+        "trend": aggregates.event_trend(store, drug, now=now),
+        "alert_counts": aggregates.alert_counts(store, drug, now),
+        "alerts": aggregates.alerts(store, drug),
+        "map": aggregates.map_cells(store, drug, now),
+        "regional": aggregates.regional_stats(store, drug, now),
+        ("forecast", days, confidence, model): aggregates.forecast(store, drug, days, confidence, model, now),
+    }
+
+
+def data_version(store, drug):
+    """Cheap fingerprint of everything a drug's bundle is built from.
+
+    Includes the UTC day, since trends and forecasts are relative to today.
+    """
+    latest = store.alerts(drug, limit=1)
+    return (store.events_generation(), store.count_events(drug),
+            (latest[0]["alert_id"], latest[0]["created_at"], latest[0]["event_count"]) if latest else None,
+            int(time.time() // aggregates.DAY))
+
+
+class BundleStore:
+    """One compressed file per drug; loads are memoized on the file's mtime."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._loaded = {}  # path -> (mtime_ns, bundle)
+        self._lock = threading.Lock()
+
+    def path(self, drug):
+        return os.path.join(self.directory, urllib.parse.quote(drug.strip().lower(), safe="") + ".bundle")
+
+    def write(self, drug, data, version=None):
+        bundle = {"format": FORMAT_VERSION, "drug": drug, "built_at": time.time(),
+                  "version": version, "data": data}
+        payload = zlib.compress(pickle.dumps(bundle, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(payload)
+        os.replace(tmp, self.path(drug))
+        return len(payload)
+
+    def load(self, drug):
+        """The drug's bundle, or None if it has not been materialized."""
+        path = self.path(drug)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            hit = self._loaded.get(path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+        try:
+            with open(path, "rb") as fh:
+                bundle = pickle.loads(zlib.decompress(fh.read()))
+        except (FileNotFoundError, zlib.error, pickle.UnpicklingError, EOFError):
+            return None
+        if bundle.get("format") != FORMAT_VERSION:
+            return None
+        with self._lock:
+            self._loaded[path] = (mtime, bundle)
+        return bundle
+
+
+    def load_current(self, drug, version, max_age=MAX_AGE):
+        """The drug's bundle if it was built from `version` of its data less
+        than `max_age` seconds ago, else None."""
+        bundle = self.load(drug)
+        if bundle is None or bundle["version"] != version or time.time() - bundle["built_at"] >= max_age:
+            return None
+        return bundle
+
+
+class Materializer:
+    """Keeps the bundles of a drug portfolio (or the `top` busiest drugs) fresh."""
+
+    def __init__(self, store, bundles, drugs=None, top=10, max_age=MAX_AGE):
+        self.store = store
+        self.bundles = bundles
+        self.drugs = list(drugs or [])
+        self.top = top
+        self.max_age = max_age
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def portfolio(self):
+        if self.drugs:
+            return self.drugs
+        counts = sorted(((self.store.count_events(d), d) for d in self.store.drugs()), reverse=True)
+        return [d for _, d in counts[:self.top]]
+
+    def refresh(self, force=False):
+        """Rebuild stale bundles; returns `{drug: bytes written}` for the ones rebuilt."""
+        rebuilt = {}
+        now = time.time()
+        for drug in self.portfolio():
+            version = data_version(self.store, drug)
+            current = self.bundles.load(drug)
+            if (not force and current is not None and current["version"] == version
+                    and now - current["built_at"] < self.max_age):
+                continue
+            rebuilt[drug] = self.bundles.write(drug, build(self.store, drug), version)
+        return rebuilt
+
+    def start(self, interval=300.0):
+        """Refresh now and then every `interval` seconds on a background thread."""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                    self.last_error = None
+                except Exception as exc:  # keep the schedule; the next pass retries
+                    self.last_error = repr(exc)
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name="bundle-materializer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=30.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def bundle_dir(store_path):
+    """Default bundle directory for an event store: `bundles/` next to the database."""
+    return os.path.join(os.path.dirname(store_path) or ".", "bundles")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialize per-drug dashboard bundles.")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--bundle-dir", default=None, help="default: bundles/ next to the store")
+    parser.add_argument("--drug", action="append", default=None, help="default: the --top busiest drugs")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-age", type=float, default=MAX_AGE, help="rebuild bundles older than this")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--every", type=float, default=None, metavar="SECONDS",
+                        help="keep refreshing every SECONDS")
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.store)
+    materializer = Materializer(store, BundleStore(args.bundle_dir or bundle_dir(args.store)),
+                                args.drug, args.top, args.max_age)
+    if args.every:
+        materializer.start(args.every)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            materializer.close()
+        return
+    started = time.perf_counter()
+    rebuilt = materializer.refresh(force=args.force)
+    for drug, size in rebuilt.items():
+        print(f"{drug}: {size / 1024:.1f} KiB")
+    print(f"{len(rebuilt)} of {len(materializer.portfolio())} bundles rebuilt "
+          f"in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
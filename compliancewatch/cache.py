@@ -0,0 +1,220 @@
+"""Process-wide result cache shared by every dashboard session.
+
+`st.session_state` is per browser tab, so identical queries from different
+analysts would otherwise recompute the same aggregates and figures.  The
+cache is keyed by a query signature, keeps an LRU in memory bounded by entry
+count and byte size, can spill to a directory on disk so several server
+processes share results, and collapses concurrent identical requests into a
+single computation (single-flight).
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+
+def signature(*parts):
+    """Stable hex key for a query made of JSON-friendly parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return (self.hits + self.disk_hits + self.coalesced) / lookups if lookups else 0.0
+
+    def as_dict(self):
+        data = asdict(self)
+        data["hit_rate"] = round(self.hit_rate, 4)
+        return data
+
+
+class DiskBackend:
+    """Pickle-per-key directory store, safe to share between processes.
+
+    Writes go through a temp file and `os.replace`, so readers never see a
+    partial entry.  File mtimes double as LRU recency for eviction.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._approx_bytes = self._scan_bytes()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _scan_bytes(self):
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                total += entry.stat().st_size
+        return total
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                value = pickle.load(fh)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False, None
+        return True, value
+
+    def put(self, key, payload):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(payload)
+        os.replace(tmp, self._path(key))
+        self._approx_bytes += len(payload)
+        if self._approx_bytes > self.max_bytes:
+            return self._evict()
+        return 0
+
+    def _evict(self):
+        files = [e for e in os.scandir(self.directory) if e.name.endswith(".pkl")]
+        files.sort(key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in files)
+        evicted = 0
+        # Trim to 90% so a full cache doesn't rescan on every write
+        target = int(self.max_bytes * 0.9)
+        for entry in files:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            evicted += 1
+        self._approx_bytes = total
+        return evicted
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".pkl", ".tmp")):
+                os.remove(entry.path)
+        self._approx_bytes = 0
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """Thread-safe LRU cache with single-flight computation and optional disk tier."""
+
+    def __init__(self, max_entries=256, max_bytes=128 * 1024 * 1024, disk_dir=None,
+                 disk_max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk = DiskBackend(disk_dir, disk_max_bytes) if disk_dir else None
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for `key`, computing it at most once."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return self._entries[key][0]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self._stats.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            found, value = self.disk.get(key) if self.disk else (False, None)
+            payload = None
+            if not found:
+                value = compute()
+                payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                if self.disk:
+                    evicted = self.disk.put(key, payload)
+                    if evicted:
+                        with self._lock:
+                            self._stats.evictions += evicted
+            self._store(key, value, len(payload) if payload is not None else None, found)
+            flight.value = value
+            return value
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def _store(self, key, value, size, from_disk):
+        if size is None:
+            size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            if from_disk:
+                self._stats.disk_hits += 1
+            else:
+                self._stats.misses += 1
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._stats.bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._stats.bytes > self.max_bytes):
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._stats.bytes -= old_size
+                self._stats.evictions += 1
+            self._stats.entries = len(self._entries)
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when `key` is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._stats.bytes = 0
+            elif key in self._entries:
+                self._stats.bytes -= self._entries.pop(key)[1]
+            self._stats.entries = len(self._entries)
+        if self.disk:
+            if key is None:
+                self.disk.clear()
+            else:
+                try:
+                    os.remove(self.disk._path(key))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(**asdict(self._stats))
@@ -0,0 +1,351 @@
+"""Demographic cohort cube: event counts by drug x age band x sex x region x
+comorbidity x severity.
+
+Every dimension is integer-coded against a fixed list of values, and the
+counts are kept in the event store (`cohort_cells`).  A `refresh()` folds in
+only events past a rowid watermark, so it can run after every pipeline run.
+Events moved to the cold tier stay counted.  `CohortCube.load()` reads the
+cells into one dense NumPy array.  Any slice or roll-up is then an index
+plus a sum, about a millisecond.
+
+`insights()` tests every single-dimension and two-dimension cohort of a drug
+in two ways:
+
+* reports: is the cohort a larger share of this drug's reports than of the
+  other drugs' reports?
+* severity: is the cohort's share of severe reports higher than the rest of
+  the drug's patients?
+
+Both use one-sided two-proportion z-tests.  Benjamini-Hochberg keeps the
+false discovery rate across all tests at `alpha`.
+
+    python -m compliancewatch.cohorts --drug Ozempic --by age_band --by sex
+"""
+import argparse
+import itertools
+import json
+import time
+from collections import Counter
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from .cold import iter_cold_only
+from .lexicon import COMORBIDITIES
+from .sources import REGIONS
+from .store import EventStore
+
+AGE_BANDS = ["Unknown", "<18", "18-24", "25-34", "35-44", "45-54", "55-64", "65+"]
+_AGE_EDGES = np.array([18, 25, 35, 45, 55, 65])
+SEXES = ["Unknown", "Female", "Male"]
+_SEX_CODES = {"F": 1, "M": 2}
+REGION_VALUES = ["Unknown"] + REGIONS + ["Other"]
+COMORBIDITY_VALUES = ["None"] + COMORBIDITIES + ["Multiple"]
+SEVERITIES = list(range(1, 11))
+
+DIMENSIONS = {
+    "age_band": AGE_BANDS,
+    "sex": SEXES,
+    "region": REGION_VALUES,
+    "comorbidity": COMORBIDITY_VALUES,
+    "severity": SEVERITIES,
+}
+# Dimensions whose code 0 means "not stated"; those events are left out of
+# the denominators when comparing cohorts on that dimension
+_UNSTATED = {"age_band", "sex", "region"}
+COHORT_DIMENSIONS = ("age_band", "sex", "region", "comorbidity")
+SEVERE = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cohort_cells (
+    drug TEXT NOT NULL COLLATE NOCASE,
+    age_band INTEGER NOT NULL,
+    sex INTEGER NOT NULL,
+    region INTEGER NOT NULL,
+    comorbidity INTEGER NOT NULL,
+    severity INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (drug, age_band, sex, region, comorbidity, severity)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cohort_state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+_REGION_CODES = {region: code for code, region in enumerate(REGION_VALUES)}
+_COMORBIDITY_CODES = {name: code for code, name in enumerate(COMORBIDITY_VALUES)}
+
+
+def _age_band(age):
+    return 0 if age is None else 1 + int(np.searchsorted(_AGE_EDGES, age, side="right"))
+
+
+def _comorbidity(value):
+    if not value:
+        return 0
+    if "," in value:
+        return len(COMORBIDITY_VALUES) - 1
+    return _COMORBIDITY_CODES.get(value, 0)
+
+
+def _region(value):
+    if not value:
+        return 0
+    return _REGION_CODES.get(value, len(REGION_VALUES) - 1)
+
+
+def encode(event):
+    """Cell coordinates `(age_band, sex, region, comorbidity, severity)` of an event."""
+    return (_age_band(event["age"]), _SEX_CODES.get(event["sex"], 0), _region(event["region"]),
+            _comorbidity(event["comorbidities"]), min(10, max(1, event["severity"] or 1)) - 1)
+
+
+# -- incremental maintenance ------------------------------------------------
+
+def _state(conn):
+    return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM cohort_state")}
+
+
+def _count_new(store, after_rowid, cold=False, batch_size=50000):
+    """Count hot events past `after_rowid`, plus every cold-tier event if `cold`."""
+    counts, last, seen = Counter(), after_rowid, 0
+    columns = ("age", "sex", "region", "comorbidities", "severity")
+    if cold:
+        for rows in iter_cold_only(store, ("drug",) + columns, batch_size):
+            for row in rows:
+                counts[(row[0],) + encode(dict(zip(columns, row[1:])))] += 1
+            seen += len(rows)
+    cursor = store.conn.execute(
+        f"SELECT rowid, drug, {', '.join(columns)} FROM events WHERE rowid > ? ORDER BY rowid",
+        (after_rowid,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            counts[(row[1],) + encode(dict(zip(columns, row[2:])))] += 1
+        last = rows[-1][0]
+        seen += len(rows)
+    return counts, last, seen
+
+
+def refresh(store, max_attempts=3):
+    """Add events written since the last refresh to the cube; safe to run concurrently."""
+    conn = store.conn
+    conn.executescript(_SCHEMA)
+    started = time.perf_counter()
+    for _ in range(max_attempts):
+        state = _state(conn)
+        watermark, counted = state.get("watermark", 0), state.get("counted", 0)
+        generation = store.events_generation()
+        # A swapped-in events table invalidates the watermark: recount hot and cold
+        full = generation != state.get("generation", generation)
+        if full:
+            watermark, counted = 0, 0
+        counts, last, seen = _count_new(store, watermark, cold=full)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _state(conn) != state:  # another refresh got there first; recount
+                conn.execute("ROLLBACK")
+                continue
+            if full:
+                conn.execute("DELETE FROM cohort_cells")
+            conn.executemany(
+                "INSERT INTO cohort_cells VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(drug, age_band, sex, region, comorbidity, severity) DO UPDATE SET n = n + excluded.n",
+                [key + (n,) for key, n in counts.items()])
+            conn.executemany("INSERT OR REPLACE INTO cohort_state VALUES (?, ?)",
+                             [("watermark", json.dumps(last)), ("counted", json.dumps(counted + seen)),
+                              ("generation", json.dumps(generation)), ("updated_at", json.dumps(time.time()))])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return {"new_events": seen, "cells": len(counts), "full": full,
+                "seconds": time.perf_counter() - started}
+    raise RuntimeError("cohort cube refresh kept racing with another refresh")
+
+
+def version(store):
+    """Changes whenever `refresh()` adds events; use it to key cached cubes."""
+    conn = store.conn
+    conn.executescript(_SCHEMA)
+    state = _state(conn)
+    return state.get("watermark", 0), state.get("counted", 0), state.get("generation")
+
+
+# -- queries ------------------------------------------------------------------
+
+class CohortCube:
+
+    def __init__(self, drugs, counts):
+        self.drugs = list(drugs)
+        self.counts = counts
+        self._drug_codes = {drug.lower(): code for code, drug in enumerate(self.drugs)}
+
+    @classmethod
+    def load(cls, store):
+        conn = store.conn
+        conn.executescript(_SCHEMA)
+        rows = conn.execute("SELECT drug, age_band, sex, region, comorbidity, severity, n "
+                            "FROM cohort_cells").fetchall()
+        names = {}
+        for row in rows:
+            names.setdefault(row[0].lower(), row[0])
+        drugs = sorted(names.values(), key=str.lower)
+        codes = {drug.lower(): code for code, drug in enumerate(drugs)}
+        counts = np.zeros((len(drugs),) + tuple(len(v) for v in DIMENSIONS.values()), dtype=np.int64)
+        if rows:
+            cells = np.array([(codes[r[0].lower()],) + r[1:] for r in rows], dtype=np.int64)
+            np.add.at(counts, tuple(cells[:, :-1].T), cells[:, -1])
+        return cls(drugs, counts)
+
+    def _axis_index(self, dim, value):
+        values = DIMENSIONS[dim]
+        wanted = value if isinstance(value, (list, tuple, set, range)) else [value]
+        try:
+            return np.array(sorted(values.index(v) for v in wanted), dtype=np.intp)
+        except ValueError:
+            raise ValueError(f"unknown {dim} value in {value!r}; expected {values}") from None
+
+    def select(self, drug=None, **filters):
+        """Counts for the matching drug(s), with every dimension kept as an axis."""
+        unknown = set(filters) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"unknown dimension(s) {sorted(unknown)}; expected {list(DIMENSIONS)}")
+        if drug is None:
+            counts = self.counts.sum(axis=0)
+        else:
+            code = self._drug_codes.get(drug.lower())
+            counts = self.counts[code] if code is not None else np.zeros(self.counts.shape[1:], np.int64)
+        index = [self._axis_index(dim, filters[dim]) if dim in filters else np.arange(len(values))
+                 for dim, values in DIMENSIONS.items()]
+        return counts[np.ix_(*index)], index
+
+    def count(self, drug=None, **filters):
+        return int(self.select(drug, **filters)[0].sum())
+
+    def rollup(self, by=(), drug=None, **filters):
+        """Event counts (and severe share) grouped by the `by` dimensions."""
+        by = [by] if isinstance(by, str) else list(by)
+        dims = list(DIMENSIONS)
+        counts, index = self.select(drug, **filters)
+        severity_axis = dims.index("severity")
+        severe = index[severity_axis] >= SEVERE - 1
+        severe_counts = counts[(slice(None),) * severity_axis + (severe,)]
+        keep = tuple(dims.index(d) for d in by)
+        drop = tuple(i for i in range(len(dims)) if i not in keep)
+        totals = counts.sum(axis=drop)
+        frame = {}
+        for grid, dim in zip(np.meshgrid(*[index[dims.index(d)] for d in by], indexing="ij"), by):
+            frame[dim] = [DIMENSIONS[dim][code] for code in grid.ravel()]
+        frame["events"] = totals.ravel()
+        if "severity" not in by:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                frame["severe_share"] = (severe_counts.sum(axis=drop) / totals).ravel()
+        return pd.DataFrame(frame)
+
+
+# -- significant cohorts ------------------------------------------------------
+
+def _z_test(hits1, n1, hits2, n2):
+    """One-sided two-proportion z statistic for p1 > p2 (0 where undefined)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pooled = (hits1 + hits2) / (n1 + n2)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n2))
+        z = (hits1 / n1 - hits2 / n2) / se
+    return np.where(np.isfinite(z), z, 0.0)
+
+
+def _cohort_tables(cube, drug, dims):
+    """Per-cohort drug counts, other-drug counts and severe counts over `dims`."""
+    code = cube._drug_codes.get(drug.lower())
+    all_dims = list(DIMENSIONS)
+    drop = tuple(i + 1 for i, d in enumerate(all_dims) if d not in dims and d != "severity")
+    by_drug = cube.counts.sum(axis=drop)  # (drugs, *dims, severity)
+    # Leave "not stated" values out of every comparison on that dimension
+    for axis, dim in enumerate(dims, start=1):
+        if dim in _UNSTATED:
+            by_drug = np.delete(by_drug, 0, axis=axis)
+    mine = by_drug[code]
+    others = by_drug.sum(axis=0) - mine
+    return mine.sum(axis=-1), others.sum(axis=-1), mine[..., SEVERE - 1:].sum(axis=-1)
+
+
+def insights(cube, drug, alpha=0.05, min_events=20, limit=None, pairs=True):
+    """Cohorts of `drug` that are significantly over-represented, strongest first."""
+    if cube._drug_codes.get(drug.lower()) is None:
+        return []
+    combos = [(d,) for d in COHORT_DIMENSIONS]
+    if pairs:
+        combos += list(itertools.combinations(COHORT_DIMENSIONS, 2))
+    candidates, tests_run = [], 0
+    normal = NormalDist()
+    for dims in combos:
+        mine, others, severe = _cohort_tables(cube, drug, dims)
+        offsets = [1 if d in _UNSTATED else 0 for d in dims]
+        n_mine, n_others, n_severe = mine.sum(), others.sum(), severe.sum()
+        tests = [
+            ("reports", mine, n_mine, others, n_others),
+            ("severity", severe, mine, n_severe - severe, n_mine - mine),
+        ]
+        for kind, hits1, n1, hits2, n2 in tests:
+            n1 = np.broadcast_to(n1, hits1.shape)
+            n2 = np.broadcast_to(n2, hits1.shape)
+            z = _z_test(hits1, n1, hits2, n2)
+            tests_run += z.size
+            for cell in zip(*np.nonzero((mine >= min_events) & (z > 0))):
+                # "None" comorbidity is an absence of mentions, not a cohort
+                if any(d == "comorbidity" and c == 0 for d, c in zip(dims, cell)):
+                    continue
+                cohort = {d: DIMENSIONS[d][c + o] for d, c, o in zip(dims, cell, offsets)}
+                rate, baseline = hits1[cell] / n1[cell], hits2[cell] / n2[cell]
+                candidates.append({
+                    "kind": kind, "cohort": cohort, "label": " · ".join(cohort.values()),
+                    "events": int(mine[cell]), "rate": float(rate), "baseline": float(baseline),
+                    "lift": float(rate / baseline) if baseline else float("inf"),
+                    "z": float(z[cell]), "p_value": 1.0 - normal.cdf(float(z[cell])),
+                })
+    # Benjamini-Hochberg over every test that was run
+    candidates.sort(key=lambda c: c["p_value"])
+    cutoff = 0
+    for rank, candidate in enumerate(candidates, start=1):
+        if candidate["p_value"] <= alpha * rank / tests_run:
+            cutoff = rank
+    significant = sorted(candidates[:cutoff], key=lambda c: (-c["z"], c["label"]))
+    return significant[:limit] if limit else significant
+
+
+def describe(insight, drug):
+    if insight["kind"] == "reports":
+        return (f"{insight['label']} patients make up {insight['rate']:.0%} of {drug} reports "
+                f"vs {insight['baseline']:.0%} for other drugs ({insight['events']} events)")
+    return (f"Severe reactions in {insight['label']} patients: {insight['rate']:.0%} "
+            f"vs {insight['baseline']:.0%} for other {drug} patients ({insight['events']} events)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh and query the demographic cohort cube.")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--drug", default=None)
+    parser.add_argument("--by", action="append", default=[], choices=list(DIMENSIONS),
+                        help="roll up by this dimension (repeatable)")
+    parser.add_argument("--alpha", type=float, default=0.05, help="false discovery rate for insights")
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.store)
+    result = refresh(store)
+    print(f"{result['new_events']:,} new events folded into {result['cells']:,} cells "
+          f"in {result['seconds']:.2f}s{' (full recount)' if result['full'] else ''}")
+    cube = CohortCube.load(store)
+    if args.by:
+        started = time.perf_counter()
+        frame = cube.rollup(args.by, args.drug)
+        elapsed = time.perf_counter() - started
+        print(frame[frame["events"] > 0].to_string(index=False))
+        print(f"roll-up in {elapsed * 1000:.2f} ms")
+    for drug in [args.drug] if args.drug else cube.drugs:
+        for insight in insights(cube, drug, args.alpha, limit=5):
+            print(f"{drug:12s} {describe(insight, drug)} (p={insight['p_value']:.1e})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Cold tier for events moved out of the hot SQLite table.
+
+Events live in zstd-compressed Parquet files laid out as
+`<cold_dir>/<drug>/<YYYY-MM>/part-*.parquet`.  Each file is sorted by
+`(created_at, event_id)`.  Every tiering pass adds one part per (drug, month)
+it touches.  `compact()` merges a partition's parts into a single sorted file
+and drops duplicate event ids (the newest copy wins).
+
+Reading and writing need `pyarrow`.  A missing or empty cold directory reads
+as no events without it.
+"""
+import calendar
+import heapq
+import os
+import time
+import urllib.parse
+from collections import defaultdict
+
+from .store import EVENT_COLUMNS, EVENT_TYPES, FINGERPRINT_COLUMNS, content_hash
+
+ROW_GROUP_SIZE = 131072
+DAY = 86400
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError("the cold event tier needs pyarrow: pip install pyarrow") from exc
+    return pyarrow
+
+
+def cold_dir(store_path):
+    """Default cold directory for an event store: `cold/` next to the database."""
+    return os.path.join(os.path.dirname(store_path) or ".", "cold")
+
+
+def month_of(created_at):
+    return time.strftime("%Y-%m", time.gmtime(created_at))
+
+
+def month_bounds(month):
+    year, mon = map(int, month.split("-"))
+    start = calendar.timegm((year, mon, 1, 0, 0, 0))
+    end = calendar.timegm((year + mon // 12, mon % 12 + 1, 1, 0, 0, 0))
+    return start, end
+
+
+class ColdStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _partition_dir(self, drug, month):
+        return os.path.join(self.directory, urllib.parse.quote(drug.lower(), safe=""), month)
+
+    def partitions(self, drug=None):
+        """`(drug, month, [part paths])` for every non-empty partition, oldest month first."""
+        if not os.path.isdir(self.directory):
+            return []
+        drugs = [urllib.parse.quote(drug.lower(), safe="")] if drug else sorted(os.listdir(self.directory))
+        found = []
+        for drug_dir in drugs:
+            root = os.path.join(self.directory, drug_dir)
+            if not os.path.isdir(root):
+                continue
+            for month in sorted(os.listdir(root)):
+                parts = sorted(os.path.join(root, month, name) for name in os.listdir(os.path.join(root, month))
+                               if name.startswith("part-") and name.endswith(".parquet"))
+                if parts:
+                    found.append((urllib.parse.unquote(drug_dir), month, parts))
+        return sorted(found, key=lambda p: (p[1], p[0]))
+
+    def size_bytes(self):
+        return sum(os.path.getsize(path) for _, _, parts in self.partitions() for path in parts)
+
+    def count(self, drug=None):
+        """Rows in the cold tier, from the Parquet footers (parts not yet
+        compacted may hold an older copy of an event)."""
+        partitions = self.partitions(drug)
+        if not partitions:
+            return 0
+        pa = _pyarrow()
+        return sum(pa.parquet.ParquetFile(path).metadata.num_rows
+                   for _, _, parts in partitions for path in parts)
+
+    def _schema(self, pa, columns=EVENT_COLUMNS):
+        return pa.schema([(c, getattr(pa, EVENT_TYPES.get(c, "string"))()) for c in columns])
+
+    def _write(self, drug, month, table):
+        pa = _pyarrow()
+        directory = self._partition_dir(drug, month)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{time.time_ns():020d}-{os.getpid()}.parquet")
+        tmp = path + ".tmp"
+        pa.parquet.write_table(table, tmp, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp, path)
+        return path
+
+    def write_part(self, drug, month, rows):
+        """Write event tuples (in `EVENT_COLUMNS` order) of one drug and month as a new part."""
+        pa = _pyarrow()
+        schema = self._schema(pa)
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        table = pa.Table.from_arrays(arrays, schema=schema)
+        return self._write(drug, month, table.sort_by([("created_at", "ascending"), ("event_id", "ascending")]))
+
+    def _read(self, parts, columns=None):
+        pa = _pyarrow()
+        tables = [pa.parquet.read_table(path, columns=list(columns) if columns else None) for path in parts]
+        return pa.concat_tables(tables, promote_options="default") if len(tables) > 1 else tables[0]
+
+    def _dedupe_sorted(self, table):
+        pa = _pyarrow()
+        table = table.append_column("_row", pa.array(range(table.num_rows), type=pa.int64()))
+        keep = table.group_by("event_id").aggregate([("_row", "max")]).column("_row_max")
+        table = table.take(keep).drop_columns(["_row"])
+        return table.sort_by([("created_at", "ascending"), ("event_id", "ascending")])
+
+    def _replace(self, drug, month, parts, table):
+        """Swap `parts` for one file holding `table`; returns the new file's size."""
+        written = os.path.getsize(self._write(drug, month, table)) if table.num_rows else 0
+        for path in parts:
+            os.remove(path)
+        return written
+
+    def compact(self, drug, month, parts):
+        """Merge a partition's parts into one sorted, de-duplicated file; returns bytes saved."""
+        before = sum(os.path.getsize(path) for path in parts)
+        return before - self._replace(drug, month, parts, self._dedupe_sorted(self._read(parts)))
+
+    def expire(self, before, sources=None, exclude_sources=()):
+        """Drop cold events older than `before` from `sources` (default: all but `exclude_sources`)."""
+        pa = _pyarrow()
+        pc = pa.compute
+        removed = 0
+        for drug, month, parts in self.partitions():
+            if month_bounds(month)[0] >= before:
+                continue
+            table = self._read(parts)
+            source = table.column("source")
+            matches = pc.is_in(source, pa.array(list(sources))) if sources is not None else \
+                pc.invert(pc.is_in(source, pa.array(list(exclude_sources), type=pa.string())))
+            drop = pc.and_(matches, pc.less(table.column("created_at"), before))
+            dropped = pc.sum(drop).as_py() or 0
+            if dropped:
+                self._replace(drug, month, parts, self._dedupe_sorted(table.filter(pc.invert(drop))))
+                removed += dropped
+        return removed
+
+    def _batches(self, path, columns, since, until, sources, batch_size):
+        """Filtered record batches of `columns` from one part.
+
+        Row groups whose `created_at` statistics fall outside `[since, until)`
+        are skipped without being read.
+        """
+        pa = _pyarrow()
+        pc = pa.compute
+        parquet = pa.parquet.ParquetFile(path)
+        at = parquet.schema_arrow.get_field_index("created_at")
+        groups = []
+        for i in range(parquet.metadata.num_row_groups):
+            stats = parquet.metadata.row_group(i).column(at).statistics
+            if stats is not None and stats.has_min_max and (
+                    (since is not None and stats.max < since) or (until is not None and stats.min >= until)):
+                continue
+            groups.append(i)
+        if not groups:
+            return
+        for batch in parquet.iter_batches(batch_size=batch_size, row_groups=groups, columns=columns):
+            mask = None
+            for condition in (
+                    pc.greater_equal(batch.column("created_at"), since) if since is not None else None,
+                    pc.less(batch.column("created_at"), until) if until is not None else None,
+                    pc.is_in(batch.column("source"), pa.array(list(sources))) if sources else None):
+                if condition is not None:
+                    mask = condition if mask is None else pc.and_(mask, condition)
+            yield batch.filter(mask) if mask is not None else batch
+
+    def _overlapping(self, drug, since, until):
+        """`{month: [part paths]}` of the partitions that can hold rows in `[since, until)`."""
+        by_month = defaultdict(list)
+        for _, month, parts in self.partitions(drug):
+            start, end = month_bounds(month)
+            if (since is not None and end <= since) or (until is not None and start >= until):
+                continue
+            by_month[month].extend(parts)
+        return by_month
+
+    def day_fingerprints(self, drug, since, until):
+        """Per-UTC-day `(day, count, first_at, last_at, severity_sum,
+        content_sum)` of a drug's cold rows, like `EventStore.day_fingerprints`
+        (rows in parts not yet compacted count once per copy)."""
+        by_month = self._overlapping(drug, since, until)
+        if not by_month:
+            return []
+        pa = _pyarrow()
+        pc = pa.compute
+        days = {}
+        for path in (path for parts in by_month.values() for path in parts):
+            for batch in self._batches(path, ["created_at", "severity", *FINGERPRINT_COLUMNS],
+                                       since, until, None, 65536):
+                day = pc.cast(pc.floor(pc.divide(batch.column("created_at"), float(DAY))), pa.int64())
+                hashes = pa.array([content_hash(*row) for row in zip(
+                    *(batch.column(c).to_pylist() for c in FINGERPRINT_COLUMNS))], type=pa.int64())
+                table = pa.table({"day": day, "created_at": batch.column("created_at"),
+                                  "severity": batch.column("severity"), "content": hashes})
+                grouped = table.group_by("day").aggregate([
+                    ("created_at", "count"), ("created_at", "min"), ("created_at", "max"),
+                    ("severity", "sum"), ("content", "sum")])
+                for d, *values in zip(*(grouped.column(c).to_pylist() for c in (
+                        "day", "created_at_count", "created_at_min", "created_at_max", "severity_sum",
+                        "content_sum"))):
+                    count, first, last, severity, content = values
+                    seen = days.get(d)
+                    days[d] = (count, first, last, severity or 0, content) if seen is None else (
+                        seen[0] + count, min(seen[1], first), max(seen[2], last), seen[3] + (severity or 0),
+                        seen[4] + content)
+        return [(d,) + days[d] for d in sorted(days)]
+
+    def _iter_part(self, path, needed, since, until, sources, batch_size):
+        for batch in self._batches(path, needed, since, until, sources, batch_size):
+            yield from zip(*(batch.column(c).to_pylist() for c in needed))
+
+    def iter_events(self, drug=None, since=None, until=None, sources=None,
+                    columns=EVENT_COLUMNS, batch_size=10000):
+        """Yield lists of event tuples in `(created_at, event_id)` order.
+
+        Months do not overlap, so they are read one after another; within a
+        month the sorted parts (of every matching drug) are streamed and
+        k-way merged, so memory holds one batch per part.  An event id in
+        several parts not yet compacted is yielded once, from the newest part.
+        """
+        by_month = self._overlapping(drug, since, until)
+        if not by_month:
+            return
+        needed = list(dict.fromkeys(list(columns) + ["event_id", "created_at", "source"]))
+        at, key = needed.index("created_at"), needed.index("event_id")
+        project = [needed.index(c) for c in columns]
+        for month in sorted(by_month):
+            # Part names start with their write time, so a higher rank is newer
+            parts = sorted(by_month[month], key=os.path.basename)
+            streams = [((row[at], row[key], rank, row) for row in
+                        self._iter_part(path, needed, since, until, sources, batch_size))
+                       for rank, path in enumerate(parts)]
+            # One row is held back after each full batch so that a newer copy
+            # of the last event can still replace it
+            batch, previous = [], None
+            for created_at, event_id, _, row in heapq.merge(*streams):
+                out = tuple(row[i] for i in project)
+                if previous == (created_at, event_id):
+                    batch[-1] = out
+                else:
+                    batch.append(out)
+                previous = (created_at, event_id)
+                if len(batch) > batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+            if batch:
+                yield batch
+
+
+def iter_cold_only(store, columns, batch_size=10000, drug=None, since=None, until=None, sources=None):
+    """Yield batches of cold-tier event tuples of `columns` whose ids are not
+    in the hot table too (a backfill may have ingested them again)."""
+    cold = ColdStore(cold_dir(store.path))
+    for rows in cold.iter_events(drug, since, until, sources, ("event_id",) + tuple(columns), batch_size):
+        hot = {e["event_id"] for e in store.get_events([row[0] for row in rows], columns=("event_id",))}
+        kept = [row[1:] for row in rows if row[0] not in hot]
+        if kept:
+            yield kept
+
+
+def iter_all_events(store, drug=None, since=None, until=None, sources=None,
+                    columns=EVENT_COLUMNS, batch_size=10000):
+    """Yield batches of event tuples from both tiers: the cold tier first,
+    month by month, then the hot table.  Each tier is in `(created_at,
+    event_id)` order."""
+    yield from iter_cold_only(store, columns, batch_size, drug, since, until, sources)
+    yield from store.iter_events(drug, since, until, sources, columns, batch_size)
+
+
+def day_fingerprints(store, drug, since, until):
+    """`(day, hot fingerprint, cold fingerprint)` for every UTC day with events
+    in either tier; a fingerprint is None when its tier has no rows that day.
+    Tiering a day's rows changes both."""
+    hot = {row[0]: list(row[1:]) for row in store.day_fingerprints(drug, since, until)}
+    cold = {row[0]: list(row[1:]) for row in ColdStore(cold_dir(store.path)).day_fingerprints(drug, since, until)}
+    return [(day, hot.get(day), cold.get(day)) for day in sorted(hot.keys() | cold.keys())]
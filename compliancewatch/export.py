@@ -0,0 +1,167 @@
+"""Streaming exports of events and aggregate tables as CSV, Parquet or Arrow IPC.
+
+Exports are generators of byte chunks built from `cold.iter_all_events`
+batches (the cold tier, then the hot table), so memory stays flat no matter
+how many rows match.  They can be written straight to a file or an HTTP
+response.  Each batch becomes one Parquet row group or Arrow record batch.
+Parquet and Arrow need `pyarrow`; CSV only needs the standard library.
+
+    python -m compliancewatch.export --drug Ozempic --format parquet --out ozempic.parquet
+"""
+import argparse
+import csv
+import importlib.util
+import io
+import time
+
+from .cold import iter_all_events
+from .store import EVENT_COLUMNS, EVENT_TYPES, EventStore
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError("Parquet and Arrow exports need pyarrow: pip install pyarrow") from exc
+    return pyarrow
+
+
+class _Chunks:
+    """Write-only file object whose contents are drained after each batch."""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def _schema(pa, columns, types):
+    return pa.schema([(c, getattr(pa, types.get(c, "string"))()) for c in columns])
+
+
+def stream(batches, columns, fmt, types=None):
+    """Encode an iterable of row-tuple batches as `fmt`, yielding byte chunks."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}; expected one of {sorted(FORMATS)}")
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+        return
+
+    pa = _pyarrow()
+    schema = _schema(pa, columns, types or {})
+    sink = _Chunks()
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+        write = writer.write_batch
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    for rows in batches:
+        if not rows:  # nothing to write; closing the writer still leaves a valid schema-only file
+            continue
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+def _limited(batches, limit):
+    for rows in batches:
+        if len(rows) >= limit:
+            yield rows[:limit]
+            return
+        limit -= len(rows)
+        yield rows
+
+
+def export_events(store, fmt, drug=None, since=None, until=None, sources=None,
+                  columns=EVENT_COLUMNS, batch_size=65536, limit=None):
+    """Stream the events matching the filters, in `(created_at, event_id)` order.
+
+    Events in the cold tier come first, month by month, then the hot table.
+    With `limit`, the export stops after that many events.
+    """
+    batches = iter_all_events(store, drug, since, until, sources, columns, batch_size)
+    if limit is not None:
+        batches = _limited(batches, limit)
+    return stream(batches, columns, fmt, EVENT_TYPES)
+
+
+def export_frame(df, fmt):
+    """Encode a small aggregate DataFrame (regional stats, alerts) in one go."""
+    columns = [str(c) for c in df.columns]
+    types = {c: "float64" for c, dtype in zip(columns, df.dtypes) if dtype.kind == "f"}
+    types.update({c: "int64" for c, dtype in zip(columns, df.dtypes) if dtype.kind in "iu"})
+    rows = [tuple(None if v is None else (v if columns[i] in types else str(v))
+                  for i, v in enumerate(row)) for row in df.itertuples(index=False, name=None)]
+    return b"".join(stream([rows], columns, fmt, types))
+
+
+def available_formats():
+    if importlib.util.find_spec("pyarrow") is None:
+        return ["csv"]
+    return list(FORMATS)
+
+
+def filename(stem, fmt):
+    return f"{stem}.{FORMATS[fmt][1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export events from the event store.")
+    parser.add_argument("--drug", default=None)
+    parser.add_argument("--source", action="append", default=None)
+    parser.add_argument("--days", type=float, default=None, help="only the last N days")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--batch", type=int, default=65536)
+    args = parser.parse_args(argv)
+
+    since = time.time() - args.days * 86400 if args.days else None
+    started = time.perf_counter()
+    written = 0
+    with open(args.out, "wb") as fh:
+        for chunk in export_events(EventStore(args.store), args.format, args.drug, since,
+                                   sources=args.source, batch_size=args.batch):
+            fh.write(chunk)
+            written += len(chunk)
+    elapsed = time.perf_counter() - started
+    print(f"{written / 1e6:,.1f} MB -> {args.out} in {elapsed:.2f}s "
+          f"({written / 1e6 / elapsed if elapsed else 0:,.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Plotly figure builders for the dashboard tabs.
+
+Each builder takes an aggregate frame and returns a figure, so finished
+figures can be cached and shared between sessions like any other result.
+"""
+import plotly.express as px
+import plotly.graph_objects as go
+
+
+def severity_figure(severity_data):
+    fig = go.Figure(data=[
+        go.Bar(
+            x=severity_data['Count'],
+            y=severity_data['Level'],
+            orientation='h',
+            marker=dict(
+                color=['#EF4444', '#F59E0B', '#F59E0B', '#10B981', '#6B7280'],
+                line=dict(width=0)
+            ),
+            text=severity_data['Count'],
+            textposition='outside'
+        )
+    ])
+
+    fig.update_layout(
+        height=350,
+        margin=dict(l=0, r=60, t=20, b=20),
+        plot_bgcolor='#FAFBFF',
+        paper_bgcolor='white',
+        showlegend=False,
+        xaxis=dict(
+            showgrid=True,
+            gridcolor='#E5E7EB',
+            title="Number of Events"
+        ),
+        yaxis=dict(
+            showgrid=False,
+            title=""
+        ),
+        font=dict(family="Plus Jakarta Sans")
+    )
+    return fig
+
+
+def source_figure(source_data, total_events):
+    fig = go.Figure(data=[go.Pie(
+        labels=source_data['Source'],
+        values=source_data['Count'],
+        hole=0.5,
+        marker=dict(
+            colors=['#5E4FDB', '#8B7FF0', '#10B981', '#F59E0B', '#3B82F6'],
+            line=dict(width=0)
+        )
+    )])
+
+    fig.update_layout(
+        height=350,
+        margin=dict(l=20, r=20, t=20, b=20),
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        showlegend=True,
+        font=dict(family="Plus Jakarta Sans"),
+        annotations=[
+            dict(
+                text=f'{total_events:,}<br>Total',
+                x=0.5, y=0.5,
+                font_size=24,
+                showarrow=False,
+                font=dict(family="Plus Jakarta Sans", weight=700)
+            )
+        ]
+    )
+    return fig
+
+
+def trend_figure(trend_data):
+    dates = trend_data['Date']
+    events = trend_data['Events']
+
+    fig = go.Figure()
+
+    # Add gradient fill
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=events,
+        mode='lines',
+        name='Events',
+        line=dict(color='#5E4FDB', width=3),
+        fill='tonexty',
+        fillcolor='rgba(94, 79, 219, 0.1)'
+    ))
+
+    # Add markers for last 7 days
+    fig.add_trace(go.Scatter(
+        x=dates.iloc[-7:],
+        y=events.iloc[-7:],
+        mode='markers',
+        name='Recent',
+        marker=dict(size=8, color='#5E4FDB', symbol='circle')
+    ))
+
+    fig.update_layout(
+        height=300,
+        margin=dict(l=0, r=0, t=20, b=20),
+        plot_bgcolor='#FAFBFF',
+        paper_bgcolor='white',
+        xaxis=dict(
+            showgrid=True,
+            gridcolor='#E5E7EB',
+            title="Date"
+        ),
+        yaxis=dict(
+            showgrid=True,
+            gridcolor='#E5E7EB',
+            title="Number of Events"
+        ),
+        showlegend=False,
+        hovermode='x unified',
+        font=dict(family="Plus Jakarta Sans")
+    )
+    return fig
+
+
+def map_figure(map_data):
+    fig = px.scatter_mapbox(
+        map_data,
+        lat='lat',
+        lon='lon',
+        size='events',
+        color='severity',
+        hover_name='City',
+        hover_data={'State': True, 'events': True, 'lat': False, 'lon': False},
+        color_discrete_map={'High': '#EF4444', 'Medium': '#F59E0B', 'Low': '#10B981'},
+        zoom=3,
+        height=450
+    )
+
+    fig.update_layout(
+        mapbox_style='carto-positron',
+        margin={"r":0,"t":0,"l":0,"b":0},
+        font=dict(family="Plus Jakarta Sans")
+    )
+    return fig
+
+
+def forecast_figure(forecast_data, confidence, title):
+    future_dates = forecast_data['Date']
+
+    fig = go.Figure()
+
+    # Add confidence band
+    fig.add_trace(go.Scatter(
+        x=future_dates,
+        y=forecast_data['Upper'],
+        mode='lines',
+        line=dict(width=0),
+        showlegend=False,
+        hoverinfo='skip'
+    ))
+
+    fig.add_trace(go.Scatter(
+        x=future_dates,
+        y=forecast_data['Lower'],
+        mode='lines',
+        line=dict(width=0),
+        fill='tonexty',
+        fillcolor='rgba(94, 79, 219, 0.15)',
+        name=f'{confidence} Confidence Band',
+        hoverinfo='skip'
+    ))
+
+    # Add prediction line
+    fig.add_trace(go.Scatter(
+        x=future_dates,
+        y=forecast_data['Predicted'],
+        mode='lines+markers',
+        name='Predicted Events',
+        line=dict(color='#5E4FDB', width=3),
+        marker=dict(size=5, color='#5E4FDB')
+    ))
+
+    fig.update_layout(
+        title=title,
+        xaxis_title='Date',
+        yaxis_title='Predicted Event Count',
+        height=400,
+        plot_bgcolor='#FAFBFF',
+        paper_bgcolor='white',
+        xaxis=dict(showgrid=True, gridcolor='#E5E7EB'),
+        yaxis=dict(showgrid=True, gridcolor='#E5E7EB'),
+        hovermode='x unified',
+        font=dict(family="Plus Jakarta Sans"),
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    return fig
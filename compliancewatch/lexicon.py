@@ -0,0 +1,157 @@
+"""Shared vocabularies for preprocessing, scoring and signal detection."""
+import re
+
+# Lexicon-based severity until the GPT-4 scorer is wired in (1-10 scale)
+SYMPTOM_SEVERITY = {
+    "seizure": 10,
+    "trouble breathing": 9,
+    "allergic reaction": 9,
+    "chest pain": 8,
+    "pancreatitis": 8,
+    "fainting": 7,
+    "heart palpitations": 6,
+    "blurred vision": 6,
+    "vomiting": 5,
+    "numbness": 5,
+    "stomach pain": 4,
+    "rash": 4,
+    "dizziness": 3,
+    "hair loss": 3,
+    "insomnia": 3,
+    "headache": 2,
+    "fatigue": 2,
+    "nausea": 2,
+}
+
+DRUGS = [
+    "ozempic", "wegovy", "mounjaro", "trulicity", "keytruda", "humira", "eliquis",
+    "xarelto", "jardiance", "dupixent", "entresto", "stelara", "metformin", "insulin",
+]
+
+ESCALATION_TERMS = re.compile(r"\b(er|hospital|ambulance|icu|emergency)\b")
+
+# Entity codes: symptoms first, then drugs; stored as uint16 in preprocessed batches
+ENTITIES = list(SYMPTOM_SEVERITY) + DRUGS
+ENTITY_CODES = {name: code for code, name in enumerate(ENTITIES)}
+SYMPTOM_CODES = frozenset(ENTITY_CODES[s] for s in SYMPTOM_SEVERITY)
+ENTITY_RE = re.compile(r"\b(" + "|".join(
+    re.escape(e) for e in sorted(ENTITIES, key=len, reverse=True)) + r")")
+
+# MedDRA preferred terms for the lexicon symptoms, used in regulatory reports
+MEDDRA_PT = {
+    "seizure": "Seizure",
+    "trouble breathing": "Dyspnoea",
+    "allergic reaction": "Hypersensitivity",
+    "chest pain": "Chest pain",
+    "pancreatitis": "Pancreatitis",
+    "fainting": "Syncope",
+    "heart palpitations": "Palpitations",
+    "blurred vision": "Vision blurred",
+    "vomiting": "Vomiting",
+    "numbness": "Hypoaesthesia",
+    "stomach pain": "Abdominal pain upper",
+    "rash": "Rash",
+    "dizziness": "Dizziness",
+    "hair loss": "Alopecia",
+    "insomnia": "Insomnia",
+    "headache": "Headache",
+    "fatigue": "Fatigue",
+    "nausea": "Nausea",
+}
+
+# Comorbidity mentions -> cohort category; stored as a bitmask in preprocessed
+# batches, so the category order is fixed (append new ones at the end)
+COMORBIDITY_TERMS = {
+    "diabetes": "Diabetes",
+    "diabetic": "Diabetes",
+    "hypertension": "Hypertension",
+    "high blood pressure": "Hypertension",
+    "heart disease": "Heart disease",
+    "heart failure": "Heart disease",
+    "afib": "Heart disease",
+    "kidney disease": "Kidney disease",
+    "ckd": "Kidney disease",
+    "asthma": "Respiratory disease",
+    "copd": "Respiratory disease",
+    "depression": "Depression",
+    "cancer": "Cancer",
+    "arthritis": "Arthritis",
+}
+COMORBIDITIES = list(dict.fromkeys(COMORBIDITY_TERMS.values()))
+COMORBIDITY_BITS = {term: 1 << COMORBIDITIES.index(name) for term, name in COMORBIDITY_TERMS.items()}
+COMORBIDITY_RE = re.compile(r"\b(" + "|".join(
+    re.escape(t) for t in sorted(COMORBIDITY_TERMS, key=len, reverse=True)) + r")\b")
+
+# Symptom and escalation phrases in the other detected languages -> English
+# lexicon term, so entity extraction and scoring see the same vocabulary
+# whatever language a post was written in (see `translate.LexiconNormalizer`)
+SYMPTOM_TRANSLATIONS = {
+    "es": {
+        "convulsiones": "seizure", "convulsión": "seizure",
+        "dificultad para respirar": "trouble breathing", "falta de aire": "trouble breathing",
+        "reacción alérgica": "allergic reaction",
+        "dolor en el pecho": "chest pain", "dolor de pecho": "chest pain",
+        "desmayo": "fainting", "desmayos": "fainting",
+        "palpitaciones": "heart palpitations", "visión borrosa": "blurred vision",
+        "vómitos": "vomiting", "vómito": "vomiting", "entumecimiento": "numbness",
+        "dolor de estómago": "stomach pain", "sarpullido": "rash", "erupción": "rash",
+        "mareos": "dizziness", "mareo": "dizziness",
+        "caída del cabello": "hair loss", "caída de pelo": "hair loss",
+        "insomnio": "insomnia", "dolor de cabeza": "headache",
+        "cansancio": "fatigue", "fatiga": "fatigue", "náuseas": "nausea",
+        "urgencias": "er",
+    },
+    "fr": {
+        "convulsions": "seizure", "crise d'épilepsie": "seizure",
+        "difficulté à respirer": "trouble breathing", "difficultés respiratoires": "trouble breathing",
+        "réaction allergique": "allergic reaction",
+        "douleur thoracique": "chest pain", "douleur à la poitrine": "chest pain",
+        "pancréatite": "pancreatitis", "évanouissement": "fainting",
+        "palpitations": "heart palpitations", "vision floue": "blurred vision",
+        "vomissements": "vomiting", "engourdissement": "numbness",
+        "mal au ventre": "stomach pain", "douleur à l'estomac": "stomach pain",
+        "éruption cutanée": "rash", "vertiges": "dizziness",
+        "perte de cheveux": "hair loss", "chute de cheveux": "hair loss",
+        "insomnie": "insomnia", "mal de tête": "headache", "maux de tête": "headache",
+        "nausées": "nausea",
+        "urgences": "er", "hôpital": "hospital",
+    },
+    "de": {
+        "krampfanfall": "seizure", "atemnot": "trouble breathing",
+        "allergische reaktion": "allergic reaction", "brustschmerzen": "chest pain",
+        "bauchspeicheldrüsenentzündung": "pancreatitis", "pankreatitis": "pancreatitis",
+        "ohnmacht": "fainting", "herzrasen": "heart palpitations", "herzklopfen": "heart palpitations",
+        "verschwommenes sehen": "blurred vision", "erbrechen": "vomiting",
+        "taubheitsgefühl": "numbness", "magenschmerzen": "stomach pain", "bauchschmerzen": "stomach pain",
+        "hautausschlag": "rash", "ausschlag": "rash", "schwindel": "dizziness",
+        "haarausfall": "hair loss", "schlaflosigkeit": "insomnia", "kopfschmerzen": "headache",
+        "müdigkeit": "fatigue", "erschöpfung": "fatigue", "übelkeit": "nausea",
+        "notaufnahme": "er", "krankenhaus": "hospital", "notarzt": "ambulance",
+    },
+    "pt": {
+        "convulsão": "seizure", "convulsões": "seizure",
+        "falta de ar": "trouble breathing", "dificuldade para respirar": "trouble breathing",
+        "reação alérgica": "allergic reaction", "dor no peito": "chest pain",
+        "pancreatite": "pancreatitis", "desmaio": "fainting", "desmaios": "fainting",
+        "palpitações": "heart palpitations", "visão embaçada": "blurred vision", "visão turva": "blurred vision",
+        "vômitos": "vomiting", "vômito": "vomiting", "vómitos": "vomiting",
+        "dormência": "numbness", "dor de estômago": "stomach pain", "erupção cutânea": "rash",
+        "tontura": "dizziness", "tonturas": "dizziness", "queda de cabelo": "hair loss",
+        "insônia": "insomnia", "insónia": "insomnia", "dor de cabeça": "headache",
+        "cansaço": "fatigue", "fadiga": "fatigue", "náuseas": "nausea", "náusea": "nausea", "enjoo": "nausea",
+        "pronto-socorro": "er",
+    },
+    "it": {
+        "convulsioni": "seizure", "crisi epilettica": "seizure",
+        "difficoltà a respirare": "trouble breathing", "fiato corto": "trouble breathing",
+        "reazione allergica": "allergic reaction", "dolore al petto": "chest pain",
+        "pancreatite": "pancreatitis", "svenimento": "fainting", "svenimenti": "fainting",
+        "palpitazioni": "heart palpitations", "vista offuscata": "blurred vision",
+        "vomito": "vomiting", "intorpidimento": "numbness", "formicolio": "numbness",
+        "mal di stomaco": "stomach pain", "eruzione cutanea": "rash",
+        "vertigini": "dizziness", "capogiri": "dizziness",
+        "perdita di capelli": "hair loss", "caduta dei capelli": "hair loss",
+        "insonnia": "insomnia", "mal di testa": "headache", "stanchezza": "fatigue",
+        "pronto soccorso": "er", "ospedale": "hospital",
+    },
+}
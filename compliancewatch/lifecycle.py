@@ -0,0 +1,316 @@
+"""Storage lifecycle for stored events: retention, tiering and compaction.
+
+One `run_once()` pass does the following:
+
+1. Folds pending events into the aggregates (MGPS scores, cohort cube).
+   These stay hot and keep counting events after the events leave the
+   table.
+2. Deletes events past their source's retention, in the hot table and in
+   the cold tier.
+3. Moves events older than `hot_days` to the cold tier (`cold.ColdStore`),
+   one sorted Parquet part per (drug, month).
+4. Compacts cold partitions that have gathered several parts.
+5. Returns freed SQLite pages to the filesystem.  This only happens for
+   stores created with incremental auto-vacuum (every store created since
+   this change).  On older stores the pages are reused by new events.
+
+Deletes and vacuum steps are paced by `rows_per_second` and
+`vacuum_pages_per_second`, so a pass does not starve the pipeline's writers.
+Only rows below the rowid high-water mark taken before step 1 are touched.
+Anything deleted has therefore already been counted by the aggregates, and
+SQLite never reuses a rowid the aggregates have already passed.
+
+Each pass returns a report: rows expired and tiered, hot and cold bytes
+before and after, and the latency of a fixed set of dashboard-style queries
+before and after.
+
+    python -m compliancewatch.lifecycle --hot-days 90 --retain Twitter/X=365 --retain '*'=730
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from . import cohorts, mgps
+from .cold import ColdStore, cold_dir, month_of
+from .store import EVENT_COLUMNS, EventStore
+
+DAY = 86400
+
+
+class LifecycleManager:
+
+    def __init__(self, store, cold=None, hot_days=90, retention=None, rows_per_second=None,
+                 vacuum_pages_per_second=None, batch_size=5000, part_rows=500_000,
+                 compact_min_parts=2, report_path=None):
+        self.store = store
+        self.cold = cold or ColdStore(cold_dir(store.path))
+        self.hot_days = hot_days
+        self.retention = dict(retention or {})  # source (or "*") -> days
+        self.rows_per_second = rows_per_second
+        self.vacuum_pages_per_second = vacuum_pages_per_second
+        self.batch_size = batch_size
+        self.part_rows = part_rows
+        self.compact_min_parts = compact_min_parts
+        self.report_path = report_path
+        self.last_report = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -- pacing -------------------------------------------------------------
+
+    def _pace(self, budget, rate, n):
+        """Sleep until `n` more units fit in `rate` per second since `budget` started."""
+        if not rate:
+            return
+        budget["done"] += n
+        ahead = budget["done"] / rate - (time.monotonic() - budget["started"])
+        if ahead > 0:
+            self._stop.wait(ahead)
+
+    def _delete(self, sql, params_list, budget):
+        conn = self.store.conn
+        deleted = 0
+        for i in range(0, len(params_list), self.batch_size):
+            chunk = params_list[i:i + self.batch_size]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany(sql, chunk)
+                deleted += conn.total_changes - before
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._pace(budget, self.rows_per_second, len(chunk))
+        return deleted
+
+    # -- steps --------------------------------------------------------------
+
+    def _expire_hot(self, mark, now, budget):
+        conn = self.store.conn
+        named = [s for s in self.retention if s != "*"]
+        expired = 0
+        for source, days in self.retention.items():
+            if source == "*":
+                where = f"source NOT IN ({', '.join('?' for _ in named)})"
+                params = named
+            else:
+                where, params = "source = ?", [source]
+            while True:
+                rowids = [row for row in conn.execute(
+                    f"SELECT rowid FROM events WHERE {where} AND created_at < ? AND rowid < ? LIMIT ?",
+                    params + [now - days * DAY, mark, self.batch_size])]
+                if not rowids:
+                    break
+                expired += self._delete("DELETE FROM events WHERE rowid = ?", rowids, budget)
+        return expired
+
+    def _expire_cold(self, now):
+        named = [s for s in self.retention if s != "*"]
+        expired = 0
+        for source, days in self.retention.items():
+            if source == "*":
+                expired += self.cold.expire(now - days * DAY, exclude_sources=named)
+            else:
+                expired += self.cold.expire(now - days * DAY, sources=[source])
+        return expired
+
+    def _tier(self, mark, now, budget):
+        conn = self.store.conn
+        cutoff = now - self.hot_days * DAY
+        columns = ", ".join(EVENT_COLUMNS)
+        tiered = parts = 0
+        for drug in self.store.drugs():
+            after = (float("-inf"), "")
+            while True:
+                rows = conn.execute(
+                    f"SELECT {columns} FROM events WHERE drug = ? AND created_at < ? AND rowid < ? "
+                    "AND (created_at, event_id) > (?, ?) ORDER BY created_at, event_id LIMIT ?",
+                    (drug, cutoff, mark) + after + (self.part_rows,)).fetchall()
+                if not rows:
+                    break
+                after = (rows[-1][3], rows[-1][0])
+                by_month = {}
+                for row in rows:
+                    by_month.setdefault(month_of(row[3]), []).append(row)
+                for month, month_rows in by_month.items():
+                    # Written before the hot copies are deleted: a crash in
+                    # between leaves duplicates, which compaction removes
+                    self.cold.write_part(drug, month, month_rows)
+                    parts += 1
+                    tiered += self._delete("DELETE FROM events WHERE event_id = ?",
+                                           [(row[0],) for row in month_rows], budget)
+        return tiered, parts
+
+    def _compact(self):
+        compacted = saved = 0
+        for drug, month, parts in self.cold.partitions():
+            if len(parts) >= self.compact_min_parts:
+                saved += self.cold.compact(drug, month, parts)
+                compacted += 1
+        return compacted, saved
+
+    def _vacuum(self):
+        conn = self.store.conn
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        budget = {"started": time.monotonic(), "done": 0}
+        released = 0
+        step = max(1, int(self.vacuum_pages_per_second or 1000))
+        while not self._stop.is_set():
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({min(step, free)})").fetchall()
+            released += min(step, free)
+            self._pace(budget, self.vacuum_pages_per_second, min(step, free))
+        return released
+
+    # -- measurements ---------------------------------------------------------
+
+    def _hot_bytes(self):
+        conn = self.store.conn
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size, pages * page_size
+
+    def _probe(self, drugs, repeat=3):
+        """Milliseconds for a fixed set of dashboard-style queries (best of `repeat`)."""
+        now = time.time()
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            self.store.count_events()
+            for drug in drugs[:8]:
+                self.store.count_events(drug)
+                self.store.day_fingerprints(drug, now - 30 * DAY, now)
+            best = min(best, time.perf_counter() - started)
+        return best * 1000
+
+    # -- entry points -----------------------------------------------------------
+
+    def run_once(self):
+        started = time.perf_counter()
+        now = time.time()
+        drugs = self.store.drugs()
+        hot_live_before, hot_file_before = self._hot_bytes()
+        cold_before = self.cold.size_bytes()
+        probe_before = self._probe(drugs)
+
+        mark = self.store.max_event_rowid()
+        cohorts.refresh(self.store)
+        mgps.refresh(self.store)
+
+        budget = {"started": time.monotonic(), "done": 0}
+        expired_hot = self._expire_hot(mark, now, budget)
+        expired_cold = self._expire_cold(now) if self.retention else 0
+        tiered, parts_written = self._tier(mark, now, budget)
+        compacted, compaction_saved = self._compact()
+        released_pages = self._vacuum()
+
+        hot_live_after, hot_file_after = self._hot_bytes()
+        cold_after = self.cold.size_bytes()
+        report = {
+            "finished_at": time.time(),
+            "expired_hot": expired_hot,
+            "expired_cold": expired_cold,
+            "tiered": tiered,
+            "parts_written": parts_written,
+            "partitions_compacted": compacted,
+            "compaction_saved_bytes": compaction_saved,
+            "released_pages": released_pages,
+            "hot_bytes_before": hot_live_before,
+            "hot_bytes_after": hot_live_after,
+            "hot_file_bytes_before": hot_file_before,
+            "hot_file_bytes_after": hot_file_after,
+            "cold_bytes_before": cold_before,
+            "cold_bytes_after": cold_after,
+            "reclaimed_bytes": (hot_live_before + cold_before) - (hot_live_after + cold_after),
+            "probe_ms_before": round(probe_before, 3),
+            "probe_ms_after": round(self._probe(drugs), 3),
+            "seconds": time.perf_counter() - started,
+        }
+        self.last_report = report
+        if self.report_path:
+            self._write_report(report)
+        return report
+
+    def _write_report(self, report):
+        directory = os.path.dirname(self.report_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(report, fh)
+        os.replace(tmp, self.report_path)
+
+    def start(self, interval=3600.0):
+        """Run a pass now and then every `interval` seconds on a background thread."""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                    self.last_error = None
+                except Exception as exc:  # keep the schedule; the next pass retries
+                    self.last_error = repr(exc)
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name="storage-lifecycle", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=60.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def _mb(n):
+    return f"{n / 1e6:,.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply retention, tier old events to cold storage and compact.")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--cold-dir", default=None, help="default: cold/ next to the store")
+    parser.add_argument("--hot-days", type=float, default=90)
+    parser.add_argument("--retain", action="append", default=[], metavar="SOURCE=DAYS",
+                        help="keep a source's events this long; '*' sets the default for the rest")
+    parser.add_argument("--rows-per-second", type=float, default=None, help="throttle deletes")
+    parser.add_argument("--vacuum-pages-per-second", type=float, default=None)
+    parser.add_argument("--report", default="data/metrics/lifecycle.json")
+    parser.add_argument("--every", type=float, default=None, metavar="SECONDS",
+                        help="keep running a pass every SECONDS in the background")
+    args = parser.parse_args(argv)
+
+    retention = {name: float(days) for name, _, days in (r.rpartition("=") for r in args.retain)}
+    store = EventStore(args.store)
+    manager = LifecycleManager(store, ColdStore(args.cold_dir) if args.cold_dir else None,
+                               hot_days=args.hot_days, retention=retention,
+                               rows_per_second=args.rows_per_second,
+                               vacuum_pages_per_second=args.vacuum_pages_per_second,
+                               report_path=args.report)
+    if args.every:
+        manager.start(args.every)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            manager.close()
+        return
+    r = manager.run_once()
+    print(f"expired {r['expired_hot']:,} hot + {r['expired_cold']:,} cold events, "
+          f"tiered {r['tiered']:,} into {r['parts_written']} parts, "
+          f"compacted {r['partitions_compacted']} partitions in {r['seconds']:.1f}s")
+    print(f"hot {_mb(r['hot_bytes_before'])} -> {_mb(r['hot_bytes_after'])} "
+          f"(file {_mb(r['hot_file_bytes_before'])} -> {_mb(r['hot_file_bytes_after'])}), "
+          f"cold {_mb(r['cold_bytes_before'])} -> {_mb(r['cold_bytes_after'])}, "
+          f"reclaimed {_mb(r['reclaimed_bytes'])}")
+    print(f"query probe {r['probe_ms_before']:.2f} ms -> {r['probe_ms_after']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""Empirical-Bayes disproportionality scores (DuMouchel's MGPS).
+
+Each (drug, reaction) cell has an observed count N and the count expected
+if drug and reaction were independent, E = N_drug * N_reaction / N_total.
+A prior on the true ratio N/E is fitted by maximum likelihood over every
+non-zero cell of the drug x reaction matrix.  The prior is a mixture of two
+gamma distributions, and N is Poisson given the ratio.  Each cell is scored
+from its posterior:
+
+* EBGM: the posterior geometric mean.
+* EB05: the posterior 5th percentile.
+
+Both pull the noisy ratios of rare pairs towards the portfolio average.
+EB05 >= 2 is the usual signal threshold.
+
+The fit runs on a squashed copy of the matrix.  Cells with the same N and
+similar E merge into weighted points, so a refit costs about the same for
+10^4 or 10^7 cells.  Scores live in the event store (`mgps_cells`).  A
+`refresh()` counts only events added since the last run and re-scores only
+cells whose count changed or whose expected count drifted by more than
+`drift`.  Events moved to the cold tier stay counted.  The prior is refitted
+on request.
+
+    python -m compliancewatch.mgps --refit --top 20
+"""
+import argparse
+import json
+import time
+from collections import Counter
+from statistics import NormalDist
+
+import numpy as np
+
+from .cold import iter_cold_only
+from .lexicon import MEDDRA_PT
+from .store import EventStore
+
+SIGNAL_EB05 = 2.0
+# DuMouchel (1999) starting values: alpha1, beta1, alpha2, beta2, mixing weight
+DEFAULT_PRIOR = (0.2, 0.1, 2.0, 4.0, 1 / 3)
+# Parameters are fitted as logs (and a logit) clipped to +-_LOG_BOUND, so a
+# portfolio with no disproportionality converges on a tight prior at 1
+# instead of running off to infinity.
+_LOG_BOUND = 12.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mgps_cells (
+    drug TEXT NOT NULL COLLATE NOCASE,
+    event TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    expected REAL NOT NULL,
+    ebgm REAL NOT NULL,
+    eb05 REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (drug, event)
+);
+CREATE INDEX IF NOT EXISTS mgps_cells_drug_eb05 ON mgps_cells (drug, eb05);
+CREATE TABLE IF NOT EXISTS mgps_state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# -- special functions (vectorised; no SciPy dependency) ------------------
+
+_LANCZOS = np.array([
+    0.99999999999980993, 676.5203681218851, -1259.1392167224028, 771.32342877765313,
+    -176.61502916214059, 12.507343278686905, -0.13857109526572012,
+    9.9843695780195716e-6, 1.5056327351493116e-7,
+])
+
+
+def gammaln(x):
+    """log Gamma(x) for x > 0 (Lanczos, g=7)."""
+    x = np.asarray(x, dtype=np.float64)
+    small = x < 0.5
+    z = np.where(small, x + 1.0, x) - 1.0
+    s = np.full_like(z, _LANCZOS[0])
+    for k in range(1, len(_LANCZOS)):
+        s += _LANCZOS[k] / (z + k)
+    t = z + 7.5
+    out = 0.5 * np.log(2 * np.pi) + (z + 0.5) * np.log(t) - t + np.log(s)
+    return np.where(small, out - np.log(x), out)
+
+
+def digamma(x):
+    x = np.array(x, dtype=np.float64)
+    out = np.zeros_like(x)
+    for _ in range(6):
+        small = x < 6.0
+        if not small.any():
+            break
+        out[small] -= 1.0 / x[small]
+        x[small] += 1.0
+    inv2 = 1.0 / (x * x)
+    return out + np.log(x) - 0.5 / x - inv2 * (
+        1 / 12 - inv2 * (1 / 120 - inv2 * (1 / 252 - inv2 * (1 / 240 - inv2 / 132))))
+
+
+def gammainc(a, x, eps=1e-12, max_iter=2000):
+    """Regularised lower incomplete gamma P(a, x), a > 0, x >= 0."""
+    a, x = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(x, dtype=np.float64))
+    a, x = a.ravel(), x.ravel()
+    out = np.zeros(a.shape)
+    positive = x > 0
+    log_prefix = np.full(a.shape, -np.inf)
+    log_prefix[positive] = (a[positive] * np.log(x[positive]) - x[positive]
+                            - gammaln(a[positive]))
+
+    # Both loops shrink their working arrays to the unconverged entries
+    series = np.flatnonzero(positive & (x < a + 1))
+    if series.size:
+        idx, aa, xx = series, a[series], x[series]
+        term = 1.0 / aa
+        total = term.copy()
+        for _ in range(max_iter):
+            aa = aa + 1.0
+            term *= xx / aa
+            total += term
+            done = np.abs(term) <= np.abs(total) * eps
+            if done.any():
+                out[idx[done]] = total[done]
+                keep = ~done
+                idx, aa, xx, term, total = idx[keep], aa[keep], xx[keep], term[keep], total[keep]
+                if not idx.size:
+                    break
+        out[idx] = total
+        out[series] *= np.exp(log_prefix[series])
+
+    fraction = np.flatnonzero(positive & (x >= a + 1))
+    if fraction.size:
+        # Modified Lentz continued fraction for the upper tail Q(a, x)
+        idx, aa = fraction, a[fraction]
+        tiny = 1e-300
+        b = x[fraction] + 1.0 - aa
+        c = np.full(fraction.size, 1.0 / tiny)
+        d = 1.0 / b
+        h = d.copy()
+        for i in range(1, max_iter):
+            an = -i * (i - aa)
+            b = b + 2.0
+            d = an * d + b
+            d[np.abs(d) < tiny] = tiny
+            c = b + an / c
+            c[np.abs(c) < tiny] = tiny
+            d = 1.0 / d
+            delta = d * c
+            h *= delta
+            done = np.abs(delta - 1.0) <= eps
+            if done.any():
+                out[idx[done]] = h[done]
+                keep = ~done
+                idx, aa, b, c, d, h = idx[keep], aa[keep], b[keep], c[keep], d[keep], h[keep]
+                if not idx.size:
+                    break
+        out[idx] = h
+        out[fraction] = 1.0 - np.exp(log_prefix[fraction]) * out[fraction]
+    return out.reshape(np.shape(a))
+
+
+# -- model ----------------------------------------------------------------
+
+def _log_nb(n, e, alpha, beta):
+    """log P(N = n) for the negative binomial marginal of one prior component."""
+    return (gammaln(alpha + n) - gammaln(alpha) - gammaln(n + 1.0)
+            + alpha * np.log(beta / (beta + e)) + n * np.log(e / (beta + e)))
+
+
+def _negative_log_likelihood(theta, n, e, w):
+    theta = np.clip(theta, -_LOG_BOUND, _LOG_BOUND)
+    alpha1, beta1, alpha2, beta2 = np.exp(theta[:4])
+    p = 1.0 / (1.0 + np.exp(-theta[4]))
+    l1 = np.log(p) + _log_nb(n, e, alpha1, beta1)
+    l2 = np.log1p(-p) + _log_nb(n, e, alpha2, beta2)
+    log_mix = np.logaddexp(l1, l2)
+    # Only non-zero cells are observed, so condition on N >= 1
+    zero = p * (beta1 / (beta1 + e)) ** alpha1 + (1 - p) * (beta2 / (beta2 + e)) ** alpha2
+    value = -np.sum(w * (log_mix - np.log1p(-np.minimum(zero, 1 - 1e-12))))
+    return value if np.isfinite(value) else np.inf
+
+
+def _nelder_mead(f, x0, step=0.5, max_iter=4000, tol=1e-9):
+    dim = len(x0)
+    simplex = np.vstack([x0] + [x0 + step * np.eye(dim)[i] for i in range(dim)])
+    values = np.array([f(x) for x in simplex])
+    for _ in range(max_iter):
+        order = np.argsort(values)
+        simplex, values = simplex[order], values[order]
+        if abs(values[-1] - values[0]) <= tol * (abs(values[0]) + tol):
+            break
+        centroid = simplex[:-1].mean(axis=0)
+        reflected = centroid + (centroid - simplex[-1])
+        fr = f(reflected)
+        if values[0] <= fr < values[-2]:
+            simplex[-1], values[-1] = reflected, fr
+        elif fr < values[0]:
+            expanded = centroid + 2.0 * (centroid - simplex[-1])
+            fe = f(expanded)
+            simplex[-1], values[-1] = (expanded, fe) if fe < fr else (reflected, fr)
+        else:
+            contracted = centroid + 0.5 * (simplex[-1] - centroid)
+            fc = f(contracted)
+            if fc < values[-1]:
+                simplex[-1], values[-1] = contracted, fc
+            else:
+                simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+                values[1:] = [f(x) for x in simplex[1:]]
+    best = int(np.argmin(values))
+    return simplex[best], values[best]
+
+
+def squash(n, e, resolution=0.02):
+    """Merge cells with equal N and E within `resolution` on a log scale into weighted points."""
+    n = np.asarray(n, dtype=np.float64)
+    e = np.asarray(e, dtype=np.float64)
+    keys = np.stack([n, np.round(np.log(e) / resolution)], axis=1)
+    _, group, weights = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    group = group.ravel()
+    return (np.bincount(group, weights=n) / weights, np.bincount(group, weights=e) / weights,
+            weights.astype(np.float64))
+
+
+def fit_prior(n, e, start=DEFAULT_PRIOR, resolution=0.02):
+    """Maximum-likelihood gamma-mixture prior for counts `n` with expectations `e`."""
+    sn, se, sw = squash(n, e, resolution)
+    alpha1, beta1, alpha2, beta2, p = start
+    x0 = np.array([np.log(alpha1), np.log(beta1), np.log(alpha2), np.log(beta2),
+                   np.log(p / (1 - p))])
+    theta, _ = _nelder_mead(lambda t: _negative_log_likelihood(t, sn, se, sw), x0)
+    theta = np.clip(theta, -_LOG_BOUND, _LOG_BOUND)
+    alpha1, beta1, alpha2, beta2 = np.exp(theta[:4]).tolist()
+    return (alpha1, beta1, alpha2, beta2, float(1 / (1 + np.exp(-theta[4]))))
+
+
+def _gamma_quantile_guess(shape, rate, z):
+    # Wilson-Hilferty; only used to bracket the exact root
+    h = 1.0 / (9.0 * shape)
+    return shape * np.maximum(1.0 - h + z * np.sqrt(h), 0.05) ** 3 / rate
+
+
+def _gamma_log_pdf(x, shape, rate):
+    return shape * np.log(rate) + (shape - 1.0) * np.log(x) - rate * x - gammaln(shape)
+
+
+def posterior(prior, n, e, quantile=0.05, tol=1e-6, max_iter=30):
+    """`(ebgm, eb_quantile)` arrays for cells with counts `n` and expectations `e`."""
+    alpha1, beta1, alpha2, beta2, p = prior
+    n = np.asarray(n, dtype=np.float64)
+    e = np.asarray(e, dtype=np.float64)
+    l1 = np.log(p) + _log_nb(n, e, alpha1, beta1)
+    l2 = np.log1p(-p) + _log_nb(n, e, alpha2, beta2)
+    q = np.exp(l1 - np.logaddexp(l1, l2))
+    a1, b1, a2, b2 = alpha1 + n, beta1 + e, alpha2 + n, beta2 + e
+    ebgm = np.exp(q * (digamma(a1) - np.log(b1)) + (1 - q) * (digamma(a2) - np.log(b2)))
+
+    # Safeguarded Newton on u = log(x): keep a bracket and bisect whenever a
+    # step would leave it.  Usually converges in 4-6 iterations.
+    z = NormalDist().inv_cdf(quantile)
+    guess1, guess2 = _gamma_quantile_guess(a1, b1, z), _gamma_quantile_guess(a2, b2, z)
+    lo = np.log(np.minimum(guess1, guess2) * 0.5)
+    hi = np.log(np.maximum(a1 / b1, a2 / b2))
+    for _ in range(8):  # widen the lower bound where the guess overshot
+        x = np.exp(lo)
+        over = q * gammainc(a1, b1 * x) + (1 - q) * gammainc(a2, b2 * x) > quantile
+        if not over.any():
+            break
+        lo[over] -= 2.0
+    u = np.log(q * guess1 + (1 - q) * guess2)
+    u = np.where((u > lo) & (u < hi), u, 0.5 * (lo + hi))
+    active = np.arange(n.size)
+    for _ in range(max_iter):
+        qa, x = q[active], np.exp(u[active])
+        aa1, bb1, aa2, bb2 = a1[active], b1[active], a2[active], b2[active]
+        gap = qa * gammainc(aa1, bb1 * x) + (1 - qa) * gammainc(aa2, bb2 * x) - quantile
+        density = x * (qa * np.exp(_gamma_log_pdf(x, aa1, bb1))
+                       + (1 - qa) * np.exp(_gamma_log_pdf(x, aa2, bb2)))
+        below = gap < 0
+        lo[active] = np.where(below, u[active], lo[active])
+        hi[active] = np.where(below, hi[active], u[active])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = u[active] - gap / density
+        inside = np.isfinite(step) & (step > lo[active]) & (step < hi[active])
+        stepped = np.where(inside, step, 0.5 * (lo[active] + hi[active]))
+        moved = np.abs(stepped - u[active])
+        u[active] = stepped
+        active = active[(moved > tol) & (hi[active] - lo[active] > tol)]
+        if not active.size:
+            break
+    return ebgm, np.exp(u)
+
+
+# -- incremental scoring over the event store -------------------------------
+
+def _state(conn):
+    return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM mgps_state")}
+
+
+def _count_rows(rows, counts, names):
+    for drug, symptoms in rows:
+        if symptoms:
+            key = drug.lower()
+            names.setdefault(key, drug)
+            for symptom in set(symptoms.split(",")):
+                counts[key, MEDDRA_PT.get(symptom, symptom)] += 1
+
+
+def _count_new(store, after_rowid, cold=False, batch_size=50000):
+    """Count hot events past `after_rowid`, plus every cold-tier event if `cold`."""
+    counts, names, last, seen = Counter(), {}, after_rowid, 0
+    if cold:
+        for rows in iter_cold_only(store, ("drug", "symptoms"), batch_size):
+            _count_rows(rows, counts, names)
+            seen += len(rows)
+    cursor = store.conn.execute(
+        "SELECT rowid, drug, symptoms FROM events WHERE rowid > ? ORDER BY rowid", (after_rowid,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        _count_rows((row[1:] for row in rows), counts, names)
+        last = rows[-1][0]
+        seen += len(rows)
+    return counts, names, last, seen
+
+
+def refresh(store, refit=False, drift=0.05, batch_size=1_000_000):
+    """Fold new events into the count matrix and re-score the cells that need it."""
+    conn = store.conn
+    conn.executescript(_SCHEMA)
+    timings = {}
+    started = time.perf_counter()
+    state = _state(conn)
+    watermark, counted = state.get("watermark", 0), state.get("counted", 0)
+    generation = store.events_generation()
+    # A swapped-in events table invalidates the watermark: recount hot and cold
+    full = generation != state.get("generation", generation)
+    if full:
+        watermark, counted = 0, 0
+
+    existing = [] if full else conn.execute(
+        "SELECT drug, event, n, expected FROM mgps_cells").fetchall()
+    new_counts, names, watermark, seen = _count_new(store, watermark, cold=full)
+    timings["count"] = time.perf_counter() - started
+
+    index = {}
+    drugs, events, n, scored_e = [], [], [], []
+    for drug, event, count, expected in existing:
+        index[drug.lower(), event] = len(drugs)
+        names.setdefault(drug.lower(), drug)
+        drugs.append(drug.lower())
+        events.append(event)
+        n.append(count)
+        scored_e.append(expected)
+    changed = np.zeros(len(drugs) + len(new_counts), dtype=bool)
+    for key, count in new_counts.items():
+        i = index.get(key)
+        if i is None:
+            i = index[key] = len(drugs)
+            drugs.append(key[0])
+            events.append(key[1])
+            n.append(0)
+            scored_e.append(np.nan)
+        n[i] += count
+        changed[i] = True
+    changed = changed[:len(drugs)]
+    n = np.array(n, dtype=np.float64)
+    scored_e = np.array(scored_e, dtype=np.float64)
+    if not n.size:
+        return {"cells": 0, "rescored": 0, "new_events": seen, "refit": False, "timings": timings}
+
+    drug_codes, drug_index = np.unique(drugs, return_inverse=True)
+    event_codes, event_index = np.unique(events, return_inverse=True)
+    drug_totals = np.bincount(drug_index, weights=n)
+    event_totals = np.bincount(event_index, weights=n)
+    expected = drug_totals[drug_index] * event_totals[event_index] / n.sum()
+
+    prior = state.get("prior")
+    refit = refit or full or prior is None
+    if refit:
+        fit_started = time.perf_counter()
+        prior = fit_prior(n, expected, start=prior or DEFAULT_PRIOR)
+        timings["fit"] = time.perf_counter() - fit_started
+
+    if refit:
+        rescore = np.ones(n.size, dtype=bool)
+    else:
+        with np.errstate(invalid="ignore"):
+            drifted = np.abs(expected / scored_e - 1.0) > drift
+        rescore = changed | np.isnan(scored_e) | drifted
+    targets = np.flatnonzero(rescore)
+
+    score_started = time.perf_counter()
+    now = time.time()
+    rows = []
+    for start in range(0, targets.size, batch_size):
+        chunk = targets[start:start + batch_size]
+        ebgm, eb05 = posterior(prior, n[chunk], expected[chunk])
+        rows.extend(zip((names[drugs[i]] for i in chunk), (events[i] for i in chunk),
+                        n[chunk].astype(int).tolist(), expected[chunk].tolist(),
+                        ebgm.tolist(), eb05.tolist(), [now] * chunk.size))
+    timings["score"] = time.perf_counter() - score_started
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if full:
+            conn.execute("DELETE FROM mgps_cells")
+        conn.executemany(
+            "INSERT INTO mgps_cells VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(drug, event) DO UPDATE SET "
+            "n = excluded.n, expected = excluded.expected, ebgm = excluded.ebgm, "
+            "eb05 = excluded.eb05, updated_at = excluded.updated_at", rows)
+        new_state = {"watermark": watermark, "counted": counted + seen, "generation": generation,
+                     "prior": list(prior)}
+        if refit:
+            new_state["fitted_at"] = now
+        conn.executemany("INSERT OR REPLACE INTO mgps_state VALUES (?, ?)",
+                         [(k, json.dumps(v)) for k, v in new_state.items()])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    timings["total"] = time.perf_counter() - started
+    return {"cells": int(n.size), "rescored": int(targets.size), "new_events": seen,
+            "refit": refit, "prior": prior, "timings": timings}
+
+
+def scored_version(store):
+    """Changes whenever `refresh()` re-scores anything; a cache key for `signals()`."""
+    conn = store.conn
+    conn.executescript(_SCHEMA)
+    state = _state(conn)
+    return state.get("generation"), state.get("watermark"), state.get("fitted_at")
+
+
+def signals(store, drug, limit=20):
+    """The drug's reactions ordered by EB05, highest first."""
+    conn = store.conn
+    conn.executescript(_SCHEMA)
+    columns = ("event", "n", "expected", "ebgm", "eb05")
+    cursor = conn.execute(
+        f"SELECT {', '.join(columns)} FROM mgps_cells WHERE drug = ? ORDER BY eb05 DESC LIMIT ?",
+        (drug, limit))
+    return [dict(zip(columns, row), signal=row[4] >= SIGNAL_EB05) for row in cursor]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update MGPS (EBGM/EB05) disproportionality scores.")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--refit", action="store_true", help="refit the prior and re-score every cell")
+    parser.add_argument("--drift", type=float, default=0.05,
+                        help="re-score cells whose expected count moved by more than this fraction")
+    parser.add_argument("--top", type=int, default=0, help="print the strongest signals per drug")
+    parser.add_argument("--drug", action="append", default=None)
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.store)
+    result = refresh(store, refit=args.refit, drift=args.drift)
+    timings = ", ".join(f"{k} {v:.2f}s" for k, v in result["timings"].items())
+    print(f"{result['new_events']:,} new events, {result['cells']:,} cells, "
+          f"{result['rescored']:,} re-scored{' after refit' if result['refit'] else ''} ({timings})")
+    if result.get("prior"):
+        print("prior alpha1={:.3f} beta1={:.3f} alpha2={:.3f} beta2={:.3f} p={:.3f}".format(*result["prior"]))
+    if args.top:
+        drugs = args.drug or store.drugs()
+        for drug in drugs:
+            for row in signals(store, drug, args.top):
+                flag = "SIGNAL" if row["signal"] else ""
+                print(f"{drug:12s} {row['event']:24s} N={row['n']:<6d} E={row['expected']:8.2f} "
+                      f"EBGM={row['ebgm']:6.2f} EB05={row['eb05']:6.2f} {flag}")
+
+
+if __name__ == "__main__":
+    main()
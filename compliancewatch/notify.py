@@ -0,0 +1,359 @@
+"""Alert routing and notification fan-out.
+
+`Dispatcher.submit()` only records alerts in memory and returns, so the
+ingestion path never waits on SMTP or HTTP.  A background thread delivers
+them to the sinks routed for each alert level:
+
+* Coalescing: the detector re-emits an alert every time its cluster grows,
+  so updates are keyed by `alert_id` and held for `coalesce_seconds`.  The
+  newest version is sent once, and later updates to an alert that was
+  already sent are held for `renotify_seconds`.  A 500-event cluster
+  therefore produces one notification, plus one update with its final
+  `event_count` when the window ends (or the dispatcher closes) if the
+  cluster grew after the send.
+* Retry: a failed delivery is retried with exponential backoff for that one
+  sink, without holding up the others; a retry sends the newest version.
+* Overflow: past `max_pending` queued alerts, the oldest alert of the lowest
+  pending level is dropped to make room, or the new alert itself if nothing
+  pending is less severe.  Critical alerts are never dropped; they are
+  queued even past the limit.
+
+Routes come from a JSON-able config such as
+`{"Critical": [{"type": "webhook", "url": "https://..."}], "High": [{"type": "file", "path": "data/notifications.jsonl"}]}`.
+"""
+import heapq
+import itertools
+import json
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from email.message import EmailMessage
+
+LEVELS = ("Critical", "High", "Medium", "Low")
+
+
+def default_routes(data_dir):
+    """Critical alerts to `notifications.jsonl` in `data_dir`."""
+    return {"Critical": [{"type": "file", "path": os.path.join(data_dir, "notifications.jsonl")}]}
+
+
+def _message(alert):
+    return {
+        "alert_id": alert["alert_id"], "drug": alert["drug"], "level": alert["level"],
+        "title": alert["title"], "desc": alert.get("desc"), "source": alert.get("source"),
+        "created_at": alert.get("created_at"), "event_count": alert.get("event_count"),
+        "confidence": alert.get("confidence"),
+    }
+
+
+class FileSink:
+    """Appends one JSON line per notification; one `write` per line keeps
+    concurrent worker processes from interleaving."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def send(self, alert):
+        line = (json.dumps(_message(alert), ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+class WebhookSink:
+
+    def __init__(self, url, timeout=10.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def send(self, alert):
+        request = urllib.request.Request(self.url, data=json.dumps(_message(alert)).encode("utf-8"),
+                                         headers=self.headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SMTPSink:
+
+    def __init__(self, host, sender, recipients, port=25, username=None, password=None,
+                 starttls=False, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, alert):
+        message = EmailMessage()
+        message["Subject"] = f"[{alert['level']}] {alert['drug']}: {alert['title']}"
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message.set_content(json.dumps(_message(alert), indent=2, ensure_ascii=False))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+class MemorySink:
+    """Local stand-in that keeps notifications in a list; `fail` makes the
+    next N sends raise, to exercise retries."""
+
+    def __init__(self, fail=0):
+        self.sent = []
+        self.fail = fail
+
+    def send(self, alert):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("simulated delivery failure")
+        self.sent.append(_message(alert))
+
+
+SINKS = {"file": FileSink, "webhook": WebhookSink, "smtp": SMTPSink, "memory": MemorySink}
+
+
+def build_routes(config):
+    """Turn a `{level: [{"type": ..., **options}]}` config into sink instances."""
+    routes = {}
+    for level, specs in (config or {}).items():
+        if level not in LEVELS:
+            raise ValueError(f"unknown alert level {level!r}")
+        routes[level] = [SINKS[spec["type"]](**{k: v for k, v in spec.items() if k != "type"})
+                         for spec in specs]
+    return routes
+
+
+class Dispatcher:
+
+    def __init__(self, routes, coalesce_seconds=30.0, renotify_seconds=6 * 3600,
+                 max_attempts=6, backoff=1.0, max_pending=10000, metrics_path=None,
+                 metrics_interval=1.0):
+        self.routes = routes
+        self.coalesce_seconds = coalesce_seconds
+        self.renotify_seconds = renotify_seconds
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_pending = max_pending
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # alert_id -> [first_seen, alert]
+        self._pending_levels = {level: OrderedDict() for level in LEVELS}  # level -> alert_ids, oldest first
+        # alert_id -> [sent at, event_count sent, newest held (received at, alert) or None]
+        self._sent = OrderedDict()
+        self._retries = []  # heap of (due, seq, attempt, first_seen, sink, alert)
+        self._seq = itertools.count()
+        self._latencies = deque(maxlen=1000)
+        self._counts = {"submitted": 0, "coalesced": 0, "suppressed": 0, "dropped": 0,
+                        "delivered": 0, "retried": 0, "failed": 0}
+        self._closed = False
+        self._metrics_at = 0.0
+        self._worker = threading.Thread(target=self._run, name="alert-dispatch", daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(build_routes(config), **kwargs)
+
+    def submit(self, alerts):
+        """Queue alerts for delivery; never blocks on I/O."""
+        now = time.time()
+        with self._cond:
+            for alert in alerts:
+                if not self.routes.get(alert["level"]):
+                    continue
+                alert_id = alert["alert_id"]
+                self._counts["submitted"] += 1
+                sent = self._sent.get(alert_id)
+                if sent is not None and now - sent[0] < self.renotify_seconds:
+                    self._counts["suppressed"] += 1
+                    if (alert.get("event_count") or 0) > (sent[1] or 0):
+                        sent[2] = (now, alert)
+                    continue
+                entry = self._pending.get(alert_id)
+                if entry is not None:
+                    if entry[1]["level"] != alert["level"]:
+                        del self._pending_levels[entry[1]["level"]][alert_id]
+                        self._pending_levels[alert["level"]][alert_id] = None
+                    entry[1] = alert
+                    self._counts["coalesced"] += 1
+                    continue
+                if len(self._pending) >= self.max_pending and not self._make_room(alert["level"]):
+                    self._counts["dropped"] += 1
+                    continue
+                self._pending[alert_id] = [now, alert]
+                self._pending_levels[alert["level"]][alert_id] = None
+            self._cond.notify_all()
+
+    def _make_room(self, level):
+        """Drop the oldest pending alert of the lowest level, if it is not
+        Critical and not more severe than `level`.  False if `level` should
+        be dropped instead."""
+        for lower in reversed(LEVELS[max(LEVELS.index(level), 1):]):
+            if self._pending_levels[lower]:
+                alert_id, _ = self._pending_levels[lower].popitem(last=False)
+                del self._pending[alert_id]
+                self._counts["dropped"] += 1
+                return True
+        return level == LEVELS[0]
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            return dict(
+                self._counts,
+                pending=len(self._pending),
+                retrying=len(self._retries),
+                latency_p50=latencies[len(latencies) // 2] if latencies else None,
+                latency_p95=latencies[int(len(latencies) * 0.95)] if latencies else None,
+                updated_at=time.time(),
+            )
+
+    def close(self, timeout=30.0):
+        """Send everything still coalescing, then wait up to `timeout` for retries."""
+        with self._cond:
+            self._closed = True
+            self._drain_deadline = time.time() + timeout
+            self._cond.notify_all()
+        self._worker.join(timeout + 5)
+        self._write_metrics(force=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                horizon = now if self._closed else now - self.coalesce_seconds
+                ready = []
+                while self._pending:
+                    alert_id, (first_seen, alert) = next(iter(self._pending.items()))
+                    if first_seen > horizon:
+                        break
+                    del self._pending[alert_id]
+                    del self._pending_levels[alert["level"]][alert_id]
+                    self._sent[alert_id] = [now, alert.get("event_count"), None]
+                    ready.append((first_seen, alert))
+                while self._retries and (self._retries[0][0] <= now or self._closed):
+                    if self._closed and now >= self._drain_deadline:
+                        self._counts["failed"] += len(self._retries)
+                        self._retries = []
+                        break
+                    if self._retries[0][0] > now:
+                        break
+                    ready.append(heapq.heappop(self._retries)[1:])
+                ready.extend(self._expire_sent(now))
+                if not ready:
+                    if self._closed and not self._pending and not self._retries:
+                        return
+                    wake = [self._retries[0][0]] if self._retries else []
+                    if self._pending:
+                        wake.append(next(iter(self._pending.values()))[0] + self.coalesce_seconds)
+                    wait = min(wake) - now if wake else self.metrics_interval
+                    self._cond.wait(max(0.01, min(wait, self.metrics_interval)))
+            for item in ready:
+                if len(item) == 2:
+                    first_seen, alert = item
+                    for sink in self.routes[alert["level"]]:
+                        self._deliver(sink, alert, first_seen, 1)
+                else:
+                    _, attempt, first_seen, sink, alert = item
+                    self._deliver(sink, alert, first_seen, attempt)
+            self._write_metrics()
+
+    def _deliver(self, sink, alert, first_seen, attempt):
+        if attempt > 1:
+            with self._cond:
+                sent = self._sent.get(alert["alert_id"])
+                if sent is not None and sent[2] is not None:
+                    alert = sent[2][1]
+                    sent[1], sent[2] = alert.get("event_count"), None
+        try:
+            sink.send(alert)
+        except Exception:
+            with self._cond:
+                if attempt >= self.max_attempts:
+                    self._counts["failed"] += 1
+                else:
+                    self._counts["retried"] += 1
+                    due = time.time() + self.backoff * 2 ** (attempt - 1)
+                    heapq.heappush(self._retries, (due, next(self._seq), attempt + 1, first_seen, sink, alert))
+            return
+        with self._cond:
+            self._counts["delivered"] += 1
+            self._latencies.append(time.time() - first_seen)
+
+    def _expire_sent(self, now):
+        """Forget sends older than `renotify_seconds`; returns the held updates
+        to send as `(received at, alert)` (all of them once closed)."""
+        updates = []
+        while self._sent:
+            alert_id, (sent_at, _, held) = next(iter(self._sent.items()))
+            if now - sent_at < self.renotify_seconds:
+                break
+            del self._sent[alert_id]
+            if held is not None:
+                self._sent[alert_id] = [now, held[1].get("event_count"), None]
+                updates.append(held)
+        if self._closed:
+            for sent in self._sent.values():
+                if sent[2] is not None:
+                    updates.append(sent[2])
+                    sent[1], sent[2] = sent[2][1].get("event_count"), None
+        return updates
+
+    def _write_metrics(self, force=False):
+        if self.metrics_path is None:
+            return
+        now = time.time()
+        if not force and now - self._metrics_at < self.metrics_interval:
+            return
+        self._metrics_at = now
+        directory = os.path.dirname(self.metrics_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(self.stats(), fh)
+        os.replace(tmp, self.metrics_path)
+
+
+def read_metrics(directory):
+    """Combine the metrics files written by each worker's dispatcher."""
+    totals = {"pending": 0, "retrying": 0, "delivered": 0, "failed": 0, "latency_p95": None}
+    if not directory or not os.path.isdir(directory):
+        return None
+    found = False
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("notify-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as fh:
+                stats = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        found = True
+        for key in ("pending", "retrying", "delivered", "failed"):
+            totals[key] += stats.get(key, 0)
+        if stats.get("latency_p95") is not None:
+            totals["latency_p95"] = max(totals["latency_p95"] or 0.0, stats["latency_p95"])
+    return totals if found else None
@@ -0,0 +1,511 @@
+"""Partitioned ingestion -> scoring -> signal pipeline.
+
+Raw posts are published to a queue keyed by drug, so every post for a drug
+lands in the same partition.  Each worker process owns a disjoint set of
+partitions and runs scoring and signal detection for them, which keeps the
+per-drug signal state local to one process and lets throughput scale with
+the number of workers.
+
+    python -m compliancewatch.pipeline --drug Ozempic --drug Keytruda --workers 4
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+from . import cohorts, mgps
+from .audit import AuditLog, read_after
+from .bundles import BundleStore, Materializer, bundle_dir
+from .broker import SQLiteQueue, partition_for
+from .lexicon import ENTITIES, SYMPTOM_SEVERITY
+from .notify import Dispatcher, default_routes
+from .preprocess import Preprocessor, preprocess, scrub_rows
+from .scheduler import PollScheduler
+from .similar import HashingEmbedder, VectorIndex, index_events
+from .snapshot import SnapshotManager
+from .sources import SyntheticSource
+from .store import EventStore
+from .translate import TRANSLATORS, MultilingualStage, TranslationCache, make_translator
+
+
+# Severity per entity code; drug mentions score 0 so they never raise severity
+_ENTITY_SEVERITY = np.array([SYMPTOM_SEVERITY.get(e, 0) for e in ENTITIES], dtype=np.int16)
+
+
+def score_arrays(batch):
+    """Vectorised `(severity 1-10, confidence)` arrays for a preprocessed batch."""
+    n = len(batch)
+    severity = np.ones(n, dtype=np.int16)
+    symptom_counts = np.zeros(n, dtype=np.int64)
+    nonempty = np.diff(batch.entity_offsets) > 0
+    if nonempty.any():
+        entity_severity = _ENTITY_SEVERITY[batch.entity_codes]
+        starts = batch.entity_offsets[:-1][nonempty]
+        severity[nonempty] = np.maximum(np.maximum.reduceat(entity_severity, starts), 1)
+        symptom_counts[nonempty] = np.add.reduceat((entity_severity > 0).astype(np.int64), starts)
+    severity = np.minimum(10, severity + batch.escalated)
+    confidence = np.round(np.minimum(0.99, 0.55 + 0.15 * symptom_counts), 2)
+    return severity, confidence
+
+
+def score_events(posts, batch):
+    """Turn raw posts and their preprocessed batch into scored event records."""
+    severity, confidence = score_arrays(batch)
+    severity, confidence = severity.tolist(), confidence.tolist()
+    events = []
+    for i, post in enumerate(posts):
+        events.append({
+            "event_id": post["post_id"],
+            "drug": post["drug"],
+            "source": post["source"],
+            "created_at": post["created_at"],
+            "region": post.get("region"),
+            "language": batch.language(i),
+            "text": batch.text(i, post["text"]),
+            "severity": severity[i],
+            "confidence": confidence[i],
+            "symptoms": ",".join(batch.symptoms(i)),
+            "age": batch.age(i),
+            "sex": batch.sex(i),
+            "comorbidities": ",".join(batch.comorbidities(i)),
+        })
+    return events
+
+
+def score_post(post):
+    return score_events([post], preprocess([post["text"]]))[0]
+
+
+class SignalDetector:
+    """Counts distinct severe events per drug and time window.
+
+    A window with at least `min_cluster` events at or above
+    `severity_threshold` raises a "Severe Adverse Reaction Cluster" alert.
+    A 64-bit hash of each event id is tracked per window so redelivered
+    messages are not double-counted.
+    """
+
+    def __init__(self, severity_threshold=8, window_seconds=3600, min_cluster=5,
+                 retain_windows=48):
+        self.severity_threshold = severity_threshold
+        self.window_seconds = window_seconds
+        self.min_cluster = min_cluster
+        self.retain_windows = retain_windows
+        self.windows = {}  # (drug, window) -> {"ids": set, "regions": Counter, "sources": Counter}
+
+    @staticmethod
+    def _id_key(event_id):
+        return int.from_bytes(hashlib.blake2b(event_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+    def observe(self, events):
+        touched = set()
+        for event in events:
+            if event["severity"] < self.severity_threshold:
+                continue
+            key = (event["drug"], int(event["created_at"] // self.window_seconds))
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = {"ids": set(), "regions": Counter(), "sources": Counter()}
+            id_key = self._id_key(event["event_id"])
+            if id_key in window["ids"]:
+                continue
+            window["ids"].add(id_key)
+            window["regions"][event.get("region") or "Unknown"] += 1
+            window["sources"][event["source"]] += 1
+            touched.add(key)
+
+        alerts = [self._alert(key) for key in sorted(touched)
+                  if len(self.windows[key]["ids"]) >= self.min_cluster]
+        self._prune()
+        return alerts
+
+    def _alert(self, key):
+        drug, window_index = key
+        window = self.windows[key]
+        region = window["regions"].most_common(1)[0][0]
+        count = len(window["ids"])
+        return {
+            "alert_id": hashlib.sha1(f"{drug.lower()}:{window_index}:severe-cluster".encode()).hexdigest(),
+            "drug": drug,
+            "level": "Critical",
+            "title": "Severe Adverse Reaction Cluster",
+            "desc": f"{count} severe reactions to {drug} reported in {region} region",
+            "source": window["sources"].most_common(1)[0][0],
+            "created_at": (window_index + 1) * self.window_seconds,
+            "confidence": min(99, 70 + 5 * count),
+            "event_count": count,
+        }
+
+    def _prune(self):
+        if not self.windows:
+            return
+        newest = max(w for _, w in self.windows)
+        for key in [k for k in self.windows if k[1] < newest - self.retain_windows]:
+            del self.windows[key]
+
+    def state_dict(self):
+        """Flat arrays plus small JSON metadata, for `snapshot.SnapshotManager`."""
+        keys = sorted(self.windows)
+        sizes = [len(self.windows[k]["ids"]) for k in keys]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        ids = np.empty(int(offsets[-1]), dtype=np.uint64)
+        for key, start, size in zip(keys, offsets, sizes):
+            ids[start:start + size] = np.fromiter(self.windows[key]["ids"], dtype=np.uint64, count=size)
+        return {
+            "arrays": {
+                "window_index": np.array([k[1] for k in keys], dtype=np.int64),
+                "id_offsets": offsets,
+                "ids": ids,
+            },
+            "meta": {
+                "drugs": [k[0] for k in keys],
+                "regions": [dict(self.windows[k]["regions"]) for k in keys],
+                "sources": [dict(self.windows[k]["sources"]) for k in keys],
+                "window_seconds": self.window_seconds,
+            },
+        }
+
+    def load_state_dict(self, state):
+        arrays, meta = state["arrays"], state["meta"]
+        if meta["window_seconds"] != self.window_seconds:
+            raise ValueError("snapshot was taken with a different window size")
+        offsets, ids = arrays["id_offsets"], arrays["ids"]
+        self.windows = {}
+        for i, (drug, window_index) in enumerate(zip(meta["drugs"], arrays["window_index"].tolist())):
+            self.windows[(drug, window_index)] = {
+                "ids": set(ids[offsets[i]:offsets[i + 1]].tolist()),
+                "regions": Counter(meta["regions"][i]),
+                "sources": Counter(meta["sources"][i]),
+            }
+
+
+def ingest(sources, drugs, queue, posts_per_source=None):
+    published = 0
+    for source in sources:
+        for drug in drugs:
+            posts = source.fetch(drug, limit=posts_per_source)
+            published += queue.publish((post["drug"], post) for post in posts)
+    return published
+
+
+def poll(sources, drugs, queue, scheduler, duration, store=None, schedule_path=None,
+         refresh_interval=30.0, alert_horizon=6 * 3600):
+    """Publish new posts as the scheduler makes each (drug, source) feed due.
+
+    Every `refresh_interval` the latest alert per drug is fed to the scheduler
+    as its alert level and the schedule is written to `schedule_path`.
+    """
+    by_name = {source.name: source for source in sources}
+    for drug in drugs:
+        for source in sources:
+            scheduler.add(drug, source.name)
+    last_poll = {}
+    published = 0
+    refreshed = 0.0
+    deadline = time.time() + duration
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        if now - refreshed >= refresh_interval:
+            if store is not None:
+                for drug in drugs:
+                    latest = store.alerts(drug, limit=1)
+                    fresh = latest and now - latest[0]["created_at"] < alert_horizon
+                    scheduler.set_alert_level(drug, latest[0]["level"] if fresh else None, now)
+            if schedule_path:
+                scheduler.write(schedule_path)
+            refreshed = now
+        key, wait = scheduler.next_poll(now)
+        if key is None:
+            time.sleep(min(wait, deadline - now, 1.0))
+            continue
+        drug, name = key
+        posts = by_name[name].fetch(drug, since=last_poll.get(key))
+        last_poll[key] = now
+        published += queue.publish((post["drug"], post) for post in posts)
+        scheduler.record(drug, name, len(posts), now)
+    if schedule_path:
+        scheduler.write(schedule_path)
+    return published
+
+
+def process_batch(messages, store, detector, preprocessor, audit=None,
+                  vector_index=None, embedder=None, dispatcher=None, multilingual=None):
+    """Score a claimed batch, write events and alerts; returns the event count."""
+    posts = [payload for _, payload in messages]
+    texts = [p["text"] for p in posts]
+    languages = None
+    if multilingual is not None:
+        texts, languages = multilingual.run(texts)
+    batch = preprocessor.run(texts)
+    texts = [batch.text(i, text) for i, text in enumerate(texts)]  # what gets embedded
+    if languages is not None:
+        batch.languages = languages  # the post's own language, not the translation's
+        batch.scrubbed = scrub_rows([p["text"] for p in posts])  # and its own text is stored
+    events = score_events(posts, batch)
+    alerts = detector.observe(events)
+    store.write_events(events)
+    store.write_alerts(alerts)
+    if dispatcher is not None:
+        dispatcher.submit(alerts)
+    if vector_index is not None:
+        index_events(vector_index, embedder, events, texts)
+    if audit is not None:
+        for event in events:
+            audit.append("event", event["drug"], {
+                "event_id": event["event_id"], "source": event["source"],
+                "created_at": event["created_at"], "region": event["region"],
+                "severity": event["severity"],
+                "confidence": event["confidence"], "symptoms": event["symptoms"],
+            })
+        for alert in alerts:
+            audit.append("alert", alert["drug"], {
+                "alert_id": alert["alert_id"], "level": alert["level"],
+                "title": alert["title"], "event_count": alert["event_count"],
+            })
+    return len(events)
+
+
+def worker_name(worker_index):
+    return f"pipeline-{worker_index:03d}"
+
+
+def _replay(detector, records, owns, replay_batch):
+    replayed, batch = 0, []
+    for record in records:
+        if record["kind"] != "event" or not owns(record["drug"]):
+            continue
+        batch.append(dict(record["data"], drug=record["drug"]))
+        if len(batch) >= replay_batch:
+            detector.observe(batch)
+            replayed += len(batch)
+            batch = []
+    detector.observe(batch)
+    return replayed + len(batch)
+
+
+def restore_detector(detector, snapshots, audit_dir, worker_index, workers, partitions,
+                     replay_batch=10000):
+    """Load the latest snapshot, then replay audit-log events written after it.
+
+    Returns `(snapshot_seq, replayed)`.  A snapshot taken with a different
+    worker or partition count covered a different set of drugs, and one
+    taken with a different severity threshold counted different events, so
+    either is ignored.  Then every worker's chain is replayed in time order,
+    keeping the events of the drugs this worker owns now.
+    """
+    after_seq = -1
+    layout = {"workers": workers, "partitions": partitions,
+              "severity_threshold": detector.severity_threshold}
+    restored = False
+    if snapshots is not None:
+        states, manifest = snapshots.load_latest()
+        if manifest and all(manifest["extra"].get(k) == v for k, v in layout.items()):
+            detector.load_state_dict(states["detector"])
+            after_seq = manifest["wal_seq"] if manifest["wal_seq"] is not None else -1
+            restored = True
+    if not audit_dir or not os.path.isdir(audit_dir):
+        return after_seq, 0
+    own = os.path.join(audit_dir, worker_name(worker_index))
+    if restored:
+        records = read_after(own, after_seq) if os.path.isdir(own) else ()
+        return after_seq, _replay(detector, records, lambda drug: True, replay_batch)
+    chains = [os.path.join(audit_dir, d) for d in sorted(os.listdir(audit_dir))
+              if d.startswith("pipeline-") and os.path.isdir(os.path.join(audit_dir, d))]
+    records = heapq.merge(*(read_after(chain, -1) for chain in chains), key=lambda r: r["ts"])
+    return after_seq, _replay(
+        detector, records,
+        lambda drug: partition_for(drug, partitions) % workers == worker_index, replay_batch)
+
+
+def run_worker(worker_index, workers, queue_dir, partitions, store_path,
+               batch_size=500, stop_when_idle=True, poll_interval=0.5,
+               preprocess_processes=1, audit_dir=None, vector_dir=None, embedder=None,
+               snapshot_dir=None, snapshot_interval=300.0, notify_routes=None, metrics_dir=None,
+               stop_event=None, translator=None, translation_cache=None):
+    queue = SQLiteQueue(queue_dir, "raw", partitions=partitions)
+    store = EventStore(store_path)
+    # A backfill swap saves the threshold it rescored with; alerts raised
+    # from here on must agree with the rescored history
+    detector = SignalDetector(severity_threshold=store.severity_threshold())
+    preprocessor = Preprocessor(preprocess_processes)
+    name = worker_name(worker_index)
+    # One audit chain per worker: a chain must have a single writer. It also
+    # serves as the write-ahead log replayed on top of the last snapshot.
+    audit_path = os.path.join(audit_dir, name) if audit_dir else None
+    snapshots = (SnapshotManager(os.path.join(snapshot_dir, name), snapshot_interval)
+                 if snapshot_dir else None)
+    restore_detector(detector, snapshots, audit_dir, worker_index, workers, partitions)
+    audit = AuditLog(audit_path) if audit_path else None
+    embedder = embedder or HashingEmbedder()
+    vector_index = VectorIndex(os.path.join(vector_dir, name), embedder.dim) if vector_dir else None
+    dispatcher = (Dispatcher.from_config(
+        notify_routes,
+        metrics_path=os.path.join(metrics_dir, f"notify-{name}.json") if metrics_dir else None,
+    ) if notify_routes else None)
+    cache = TranslationCache(translation_cache) if translator is not None and translation_cache else None
+    multilingual = MultilingualStage(translator, cache) if translator is not None else None
+
+    def snapshot():
+        snapshots.save({"detector": detector},
+                       wal_seq=audit.head_seq() if audit is not None else None,
+                       extra={"workers": workers, "partitions": partitions,
+                              "severity_threshold": detector.severity_threshold})
+    owned = [p for p in range(partitions) if p % workers == worker_index]
+    processed = 0
+    while True:
+        idle = True
+        for partition in owned:
+            messages = queue.claim(partition, batch_size)
+            if not messages:
+                continue
+            idle = False
+            processed += process_batch(messages, store, detector, preprocessor, audit,
+                                       vector_index, embedder, dispatcher, multilingual)
+            if audit is not None:
+                audit.flush()  # durable before the messages leave the queue
+            queue.ack(partition, [msg_id for msg_id, _ in messages])
+            if snapshots is not None and snapshots.due():
+                snapshot()
+        if idle:
+            if stop_when_idle or (stop_event is not None and stop_event.is_set()):
+                break
+            time.sleep(poll_interval)
+    preprocessor.close()
+    if dispatcher is not None:
+        dispatcher.close()
+    if snapshots is not None:
+        snapshot()
+    if audit is not None:
+        audit.close()
+    if cache is not None:
+        cache.close()
+    queue.close()
+    store.close()
+    return processed
+
+
+def run_pipeline(drugs, sources, queue_dir, store_path, workers=4, partitions=16,
+                 posts_per_source=None, audit_dir=None, vector_dir=None, snapshot_dir=None,
+                 notify_routes=None, metrics_dir=None, follow=None, scheduler=None,
+                 translator=None, translation_cache=None, bundle_drugs=None, bundle_interval=60.0):
+    """Ingest once, then drain the queue with `workers` processes.
+
+    With `follow` (seconds), workers run alongside an adaptive `poll` loop
+    for that long instead, then drain what is left and stop.  Dashboard
+    bundles for `bundle_drugs` (default: `drugs`) are refreshed every
+    `bundle_interval` seconds while following, and once at the end.
+    """
+    queue = SQLiteQueue(queue_dir, "raw", partitions=partitions)
+    stop_event = multiprocessing.Event() if follow else None
+    started = time.perf_counter()
+    published = 0 if follow else ingest(sources, drugs, queue, posts_per_source)
+    ingested = time.perf_counter()
+    procs = [
+        multiprocessing.Process(target=run_worker,
+                                args=(i, workers, queue_dir, partitions, store_path),
+                                kwargs={"audit_dir": audit_dir, "vector_dir": vector_dir,
+                                        "snapshot_dir": snapshot_dir,
+                                        "notify_routes": notify_routes,
+                                        "metrics_dir": metrics_dir,
+                                        "stop_when_idle": not follow,
+                                        "stop_event": stop_event,
+                                        "translator": translator,
+                                        "translation_cache": translation_cache})
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    materializer = Materializer(EventStore(store_path), BundleStore(bundle_dir(store_path)),
+                                bundle_drugs or drugs)
+    if follow:
+        materializer.start(bundle_interval)
+        published = poll(sources, drugs, queue, scheduler or PollScheduler(), follow,
+                         store=EventStore(store_path),
+                         schedule_path=os.path.join(metrics_dir, "schedule.json") if metrics_dir else None)
+        stop_event.set()
+    for proc in procs:
+        proc.join()
+    finished = time.perf_counter()
+    queue.close()
+    final_store = EventStore(store_path)
+    cohorts.refresh(final_store)
+    mgps.refresh(final_store)
+    materializer.close()
+    materializer.refresh()
+    return {
+        "published": published,
+        "ingest_seconds": ingested - started,
+        "process_seconds": finished - ingested,
+        "posts_per_second": published / (finished - ingested) if finished > ingested else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ComplianceWatch ingestion pipeline once.")
+    parser.add_argument("--drug", action="append", required=True)
+    parser.add_argument("--source", action="append", default=None)
+    parser.add_argument("--posts", type=int, default=1000, help="posts per (source, drug)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--queue-dir", default="data/queue")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--audit-dir", default="data/audit")
+    parser.add_argument("--vector-dir", default="data/vectors")
+    parser.add_argument("--snapshot-dir", default="data/snapshots")
+    parser.add_argument("--notify-config", default=None,
+                        help="JSON file mapping alert levels to sinks "
+                             "(default: Critical -> notifications.jsonl next to the store)")
+    parser.add_argument("--metrics-dir", default="data/metrics")
+    parser.add_argument("--follow", type=float, default=None, metavar="SECONDS",
+                        help="keep polling sources on an adaptive schedule for this long")
+    parser.add_argument("--budget", action="append", default=[], metavar="SOURCE=N",
+                        help="API budget in requests per hour for a source (with --follow)")
+    parser.add_argument("--posts-per-hour", action="append", default=[], metavar="[DRUG=]N",
+                        help="synthetic post velocity for --follow, overall or per drug")
+    parser.add_argument("--translator", choices=[*TRANSLATORS, "none"], default="lexicon",
+                        help="how non-English posts reach the English lexicon")
+    parser.add_argument("--translation-cache", default="data/translations.db")
+    parser.add_argument("--bundle-drug", action="append", default=None,
+                        help="drugs to keep dashboard bundles for (default: every --drug)")
+    parser.add_argument("--bundle-every", type=float, default=60.0, metavar="SECONDS",
+                        help="bundle refresh interval with --follow")
+    parser.add_argument("--foreign-share", type=float, default=0.0,
+                        help="share of synthetic posts written in another language")
+    args = parser.parse_args(argv)
+
+    notify_routes = default_routes(os.path.dirname(args.store) or ".")
+    if args.notify_config:
+        with open(args.notify_config) as fh:
+            notify_routes = json.load(fh)
+
+    per_drug = dict(spec.split("=", 1) for spec in args.posts_per_hour if "=" in spec)
+    overall = [float(spec) for spec in args.posts_per_hour if "=" not in spec]
+    velocity = ({drug: float(rate) for drug, rate in per_drug.items()} if per_drug
+                else overall[-1] if overall else None)
+    budgets = {name: float(n) for name, _, n in (b.rpartition("=") for b in args.budget)}
+    sources = [SyntheticSource(name, posts_per_hour=velocity, foreign_share=args.foreign_share)
+               for name in (args.source or ["Reddit", "Twitter/X"])]
+    translator = make_translator(args.translator)
+    stats = run_pipeline(args.drug, sources, args.queue_dir, args.store,
+                         workers=args.workers, partitions=args.partitions,
+                         posts_per_source=args.posts, audit_dir=args.audit_dir,
+                         vector_dir=args.vector_dir, snapshot_dir=args.snapshot_dir,
+                         notify_routes=notify_routes, metrics_dir=args.metrics_dir,
+                         follow=args.follow, scheduler=PollScheduler(budgets),
+                         translator=translator, translation_cache=args.translation_cache,
+                         bundle_drugs=args.bundle_drug, bundle_interval=args.bundle_every)
+    print(f"{stats['published']} posts in {stats['process_seconds']:.2f}s "
+          f"({stats['posts_per_second']:.0f} posts/s with {args.workers} workers)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Text preprocessing stage: PII scrubbing, tokenization, language detection,
+drug/symptom entity extraction and patient demographics (age, sex,
+comorbidities) where the post states them.
+
+This work is CPU-bound pure Python, so `Preprocessor` fans batches out over
+a process pool.  Post texts are packed once into a shared-memory block
+(offsets + UTF-8 bytes) and workers receive only the block name and a row
+range, so the raw text is never pickled.  Results come back as flat NumPy
+arrays with offset indexes (`PreprocessedBatch`), which is what the scoring
+and signal stages consume.  The scrubbed text of the (usually few) posts
+that contained PII comes back too; it is what gets stored, exported and
+embedded, never the raw post.
+"""
+import multiprocessing
+import re
+import zlib
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .lexicon import (COMORBIDITIES, COMORBIDITY_BITS, COMORBIDITY_RE, ENTITIES, ENTITY_CODES,
+                      ENTITY_RE, ESCALATION_TERMS, SYMPTOM_CODES)
+
+LANGUAGES = ["und", "en", "es", "fr", "de", "pt", "it"]
+LANGUAGE_CODES = {lang: code for code, lang in enumerate(LANGUAGES)}
+SEXES = [None, "F", "M"]
+
+_STOPWORDS = {
+    "en": {"the", "and", "i", "my", "is", "it", "on", "to", "of", "a", "have", "with", "after", "now", "so", "just"},
+    "es": {"el", "la", "y", "de", "que", "en", "mi", "con", "tengo", "después", "los", "por", "muy", "una"},
+    "fr": {"le", "la", "et", "de", "je", "mon", "ma", "avec", "après", "les", "des", "une", "est", "j'ai"},
+    "de": {"der", "die", "und", "ich", "mit", "nach", "habe", "das", "ist", "mein", "meine", "nicht", "eine"},
+    "pt": {"o", "a", "e", "de", "que", "com", "meu", "minha", "depois", "tenho", "não", "uma", "os"},
+    "it": {"il", "la", "e", "di", "che", "con", "mio", "mia", "dopo", "ho", "non", "una", "gli"},
+}
+
+PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<url>"),
+    (re.compile(r"\+?\d[\d\s().-]{7,}\d"), "<phone>"),
+    (re.compile(r"(?<!\w)@\w{2,}"), "<user>"),
+]
+_TOKEN_RE = re.compile(r"<\w+>|[^\W\d_]+(?:'[^\W\d_]+)?|\d+")
+
+# "34F", "(m 52)", "I'm 41", "67 years old"; the patient may be a relative
+# ("my mom"), which is who the sex words describe
+_AGE_SEX_RE = re.compile(r"(?<![\w'])(?:(\d{2})\s?([fm])|([fm])\s?(\d{2}))\b")
+_AGE_RE = re.compile(r"\b(?:i'm|i am)\s+(\d{2})\b(?!\s*(?:days?|weeks?|months?|mg|%))"
+                     r"|\b(\d{1,2})\s?(?:yo|y/o|yrs? old|years? old|year-old)\b")
+_SEX_RE = re.compile(r"\b(?:my|i'm a|i am a)\s+(?:(woman|girl|mom|mother|wife|daughter|sister|grandma|grandmother)"
+                     r"|(man|guy|dad|father|husband|son|brother|grandpa|grandfather))\b")
+
+
+def scrub_pii(text):
+    found = 0
+    for pattern, placeholder in PII_PATTERNS:
+        text, n = pattern.subn(placeholder, text)
+        found += n
+    return text, found
+
+
+def scrub_rows(texts):
+    """`{row: scrubbed text}` for the texts that contain PII."""
+    out = {}
+    for i, text in enumerate(texts):
+        clean, found = scrub_pii(text)
+        if found:
+            out[i] = clean
+    return out
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def extract_demographics(lowered):
+    """`(age or -1, index into SEXES, comorbidity bitmask)` from lower-cased text."""
+    age, sex = -1, 0
+    match = _AGE_SEX_RE.search(lowered)
+    if match:
+        age = int(match.group(1) or match.group(4))
+        sex = SEXES.index((match.group(2) or match.group(3)).upper())
+    else:
+        match = _AGE_RE.search(lowered)
+        if match:
+            age = int(match.group(1) or match.group(2))
+    if not sex:
+        match = _SEX_RE.search(lowered)
+        if match:
+            sex = 1 if match.group(1) else 2
+    mask = 0
+    for term in COMORBIDITY_RE.findall(lowered):
+        mask |= COMORBIDITY_BITS[term]
+    return (age if 0 < age < 100 else -1), sex, mask
+
+
+def detect_language(tokens):
+    best, best_hits = "und", 0
+    for lang, words in _STOPWORDS.items():
+        hits = sum(1 for t in tokens if t in words)
+        if hits > best_hits:
+            best, best_hits = lang, hits
+    return best
+
+
+@dataclass
+class PreprocessedBatch:
+    token_ids: np.ndarray       # uint32 CRC32 of each token
+    token_offsets: np.ndarray   # int64, len(batch) + 1
+    languages: np.ndarray       # uint8 index into LANGUAGES
+    entity_codes: np.ndarray    # uint16 index into lexicon.ENTITIES
+    entity_offsets: np.ndarray  # int64, len(batch) + 1
+    pii_counts: np.ndarray      # uint16 PII spans scrubbed per post
+    escalated: np.ndarray       # bool, mentions ER/hospital/etc.
+    ages: np.ndarray            # int8 patient age, -1 if not stated
+    sexes: np.ndarray           # uint8 index into SEXES
+    comorbidity_masks: np.ndarray  # uint16 bitmask over lexicon.COMORBIDITIES
+    scrubbed: dict              # row -> text with PII replaced, for rows that had any
+
+    def __len__(self):
+        return len(self.languages)
+
+    def text(self, i, raw):
+        """Row `i`'s text with PII replaced, given the `raw` text it was built from."""
+        return self.scrubbed.get(i, raw)
+
+    def tokens(self, i):
+        return self.token_ids[self.token_offsets[i]:self.token_offsets[i + 1]]
+
+    def entities(self, i):
+        return self.entity_codes[self.entity_offsets[i]:self.entity_offsets[i + 1]]
+
+    def symptoms(self, i):
+        return sorted({ENTITIES[c] for c in self.entities(i) if c in SYMPTOM_CODES})
+
+    def language(self, i):
+        return LANGUAGES[self.languages[i]]
+
+    def age(self, i):
+        return int(self.ages[i]) if self.ages[i] >= 0 else None
+
+    def sex(self, i):
+        return SEXES[self.sexes[i]]
+
+    def comorbidities(self, i):
+        mask = int(self.comorbidity_masks[i])
+        return [name for bit, name in enumerate(COMORBIDITIES) if mask >> bit & 1]
+
+
+def _preprocess_texts(texts):
+    token_ids, token_counts = [], []
+    entity_codes, entity_counts = [], []
+    languages, pii_counts, escalated = [], [], []
+    ages, sexes, masks = [], [], []
+    scrubbed = []
+    for row, text in enumerate(texts):
+        clean, pii = scrub_pii(text)
+        if pii:
+            scrubbed.append((row, clean))
+        lowered = clean.lower()
+        tokens = _TOKEN_RE.findall(lowered)
+        token_ids.extend(zlib.crc32(t.encode("utf-8")) for t in tokens)
+        token_counts.append(len(tokens))
+        codes = sorted({ENTITY_CODES[m] for m in ENTITY_RE.findall(lowered)})
+        entity_codes.extend(codes)
+        entity_counts.append(len(codes))
+        languages.append(LANGUAGE_CODES[detect_language(tokens)])
+        pii_counts.append(min(pii, 65535))
+        escalated.append(ESCALATION_TERMS.search(lowered) is not None)
+        age, sex, mask = extract_demographics(lowered)
+        ages.append(age)
+        sexes.append(sex)
+        masks.append(mask)
+    return (
+        np.array(token_ids, dtype=np.uint32), np.array(token_counts, dtype=np.int64),
+        np.array(entity_codes, dtype=np.uint16), np.array(entity_counts, dtype=np.int64),
+        np.array(languages, dtype=np.uint8), np.array(pii_counts, dtype=np.uint16),
+        np.array(escalated, dtype=bool),
+        np.array(ages, dtype=np.int8), np.array(sexes, dtype=np.uint8),
+        np.array(masks, dtype=np.uint16), scrubbed,
+    )
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _combine(chunks):
+    parts = list(zip(*chunks))
+    scrubbed, start = {}, 0
+    for rows, count in zip(parts[-1], (len(languages) for languages in parts[4])):
+        scrubbed.update((start + row, clean) for row, clean in rows)
+        start += count
+    cat = [np.concatenate(p) for p in parts[:-1]]
+    return PreprocessedBatch(
+        token_ids=cat[0], token_offsets=_offsets(cat[1]),
+        entity_codes=cat[2].astype(np.uint16), entity_offsets=_offsets(cat[3]),
+        languages=cat[4].astype(np.uint8), pii_counts=cat[5].astype(np.uint16),
+        escalated=cat[6].astype(bool), ages=cat[7].astype(np.int8),
+        sexes=cat[8].astype(np.uint8), comorbidity_masks=cat[9].astype(np.uint16),
+        scrubbed=scrubbed,
+    )
+
+
+def preprocess(texts):
+    """Preprocess in the current process."""
+    return _combine([_preprocess_texts(texts)])
+
+
+def _pack(texts):
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    header = offsets.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(1, header + int(offsets[-1])))
+    shm.buf[:header] = offsets.tobytes()
+    shm.buf[header:header + int(offsets[-1])] = b"".join(encoded)
+    return shm, len(encoded)
+
+
+def _attach(name):
+    # Only the creating process may unlink the block.  Before Python 3.13
+    # attaching registers the block with the resource tracker, but pool
+    # workers share the parent's tracker (see `Preprocessor.run`), where a
+    # second registration of the same name is a no-op and the parent's
+    # unlink unregisters it.  Unregistering here would make that unlink fail
+    # with a KeyError in the tracker.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _work(shm_name, count, start, end):
+    shm = _attach(shm_name)
+    try:
+        header = (count + 1) * 8
+        offsets = np.frombuffer(bytes(shm.buf[(start * 8):((end + 1) * 8)]), dtype=np.int64)
+        raw = bytes(shm.buf[header + offsets[0]:header + offsets[-1]])
+    finally:
+        shm.close()
+    rel = offsets - offsets[0]
+    texts = [raw[rel[i]:rel[i + 1]].decode("utf-8") for i in range(end - start)]
+    return _preprocess_texts(texts)
+
+
+class Preprocessor:
+    """Process-pool preprocessing over shared-memory text batches.
+
+    With `processes=1` everything runs inline, which is what the partitioned
+    pipeline workers use since they are already one process per core.
+    """
+
+    def __init__(self, processes=None, chunk_size=2000):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def run(self, texts):
+        if self.processes <= 1 or len(texts) <= self.chunk_size:
+            return preprocess(texts)
+        if self._pool is None:
+            # Start the tracker first so every worker inherits it, whatever
+            # the start method; a worker that started its own would unlink
+            # the parent's blocks when it exits.
+            resource_tracker.ensure_running()
+            self._pool = multiprocessing.Pool(self.processes)
+        shm, count = _pack(texts)
+        try:
+            ranges = [(i, min(i + self.chunk_size, count)) for i in range(0, count, self.chunk_size)]
+            chunks = self._pool.starmap(_work, [(shm.name, count, a, b) for a, b in ranges])
+        finally:
+            shm.close()
+            shm.unlink()
+        return _combine(chunks)
@@ -0,0 +1,328 @@
+"""Regulatory report generation per drug and period.
+
+Each run writes two files:
+
+* an ICH E2B(R2) ICSR XML message (the `ichicsr` 2.1 DTD that FDA's
+  gateway accepts) with one `<safetyreport>` per event, and
+* a PDF periodic summary laid out along the MedWatch 3500A sections
+  (adverse event, suspect product, reporting source).
+
+R2 rather than R3 (HL7 ICSR) is deliberate: its flat layout lets each day's
+reports be cached and concatenated as a plain fragment.  A post is a consumer
+report (qualification 5) from `COUNTRY`; the platform and post id are kept as
+the case's other identifier (`reportduplicate`).
+
+Output is streamed: events are read from both tiers of the store in batches
+and written straight to disk, so memory stays flat however long the period
+is.  With a `cache_dir`, each UTC day's XML fragment and summary counts are
+kept next to a fingerprint of that day's events in each tier; a rerun only
+re-renders days whose fingerprint changed (typically just the most recent
+one, or a day whose events were moved to the cold tier) and copies the rest.
+
+    python -m compliancewatch.reports --drug Ozempic --days 30 --out reports/
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from .cold import day_fingerprints, iter_all_events
+from .lexicon import MEDDRA_PT
+from .store import EventStore
+
+DAY = 86400
+SERIOUS_SEVERITY = 8
+# Reports are sent as this organisation; the monitored regions
+# (`sources.REGIONS`) are all in this country
+SENDER = "ComplianceWatch"
+COUNTRY = "US"
+_FIELDS = ("event_id", "source", "created_at", "region", "text", "severity", "symptoms")
+
+
+def _slug(drug):
+    return re.sub(r"[^a-z0-9]+", "-", drug.lower()).strip("-") or "drug"
+
+
+def _stamp(ts, fmt="%Y%m%d"):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime(fmt)
+
+
+def _safety_report_xml(drug, event):
+    symptoms = [s for s in (event["symptoms"] or "").split(",") if s]
+    serious = (event["severity"] or 0) >= SERIOUS_SEVERITY
+    received = _stamp(event["created_at"])
+    reactions = "".join(
+        "      <reaction>\n"
+        f"        <primarysourcereaction>{escape(s)}</primarysourcereaction>\n"
+        f"        <reactionmeddrapt>{escape(MEDDRA_PT.get(s, s))}</reactionmeddrapt>\n"
+        "      </reaction>\n"
+        for s in symptoms
+    )
+    return (
+        "  <safetyreport>\n"
+        "    <safetyreportversion>1</safetyreportversion>\n"
+        f"    <safetyreportid>{COUNTRY}-{SENDER}-{escape(event['event_id'][:20])}</safetyreportid>\n"
+        f"    <primarysourcecountry>{COUNTRY}</primarysourcecountry>\n"
+        f"    <occurcountry>{COUNTRY}</occurcountry>\n"
+        "    <reporttype>1</reporttype>\n"
+        f"    <serious>{1 if serious else 2}</serious>\n"
+        + ("    <seriousnessother>1</seriousnessother>\n" if serious else "")
+        + "    <receivedateformat>102</receivedateformat>\n"
+        f"    <receivedate>{received}</receivedate>\n"
+        "    <receiptdateformat>102</receiptdateformat>\n"
+        f"    <receiptdate>{received}</receiptdate>\n"
+        f"    <fulfillexpeditecriteria>{1 if serious else 2}</fulfillexpeditecriteria>\n"
+        f"    <companynumb>{COUNTRY}-{SENDER}-{escape(event['event_id'][:20])}</companynumb>\n"
+        "    <duplicate>1</duplicate>\n"
+        "    <reportduplicate>\n"
+        f"      <duplicatesource>{escape(event['source'])}</duplicatesource>\n"
+        f"      <duplicatenumb>{escape(event['event_id'])}</duplicatenumb>\n"
+        "    </reportduplicate>\n"
+        "    <primarysource>\n"
+        f"      <reportercountry>{COUNTRY}</reportercountry>\n"
+        "      <qualification>5</qualification>\n"
+        "    </primarysource>\n"
+        "    <sender>\n"
+        "      <sendertype>6</sendertype>\n"
+        f"      <senderorganization>{SENDER}</senderorganization>\n"
+        "    </sender>\n"
+        "    <patient>\n"
+        "      <patientinitial>UNK</patientinitial>\n"
+        + reactions
+        + "      <drug>\n"
+        "        <drugcharacterization>1</drugcharacterization>\n"
+        f"        <medicinalproduct>{escape(drug)}</medicinalproduct>\n"
+        "      </drug>\n"
+        "      <summary>\n"
+        f"        <narrativeincludeclinical>{escape(event['text'] or '')}</narrativeincludeclinical>\n"
+        f"        <reportercomment>Consumer post on {escape(event['source'])}</reportercomment>\n"
+        "      </summary>\n"
+        "    </patient>\n"
+        "  </safetyreport>\n"
+    )
+
+
+def _render_day(store, drug, start, end, fh):
+    """Write one day's safety reports to `fh`; returns that day's summary counts."""
+    counts = {"events": 0, "serious": 0, "severity": Counter(), "reactions": Counter(),
+              "sources": Counter(), "regions": Counter()}
+    for rows in iter_all_events(store, drug, start, end, columns=_FIELDS, batch_size=2000):
+        for row in rows:
+            event = dict(zip(_FIELDS, row))
+            fh.write(_safety_report_xml(drug, event))
+            counts["events"] += 1
+            counts["serious"] += (event["severity"] or 0) >= SERIOUS_SEVERITY
+            counts["severity"][str(event["severity"])] += 1
+            counts["sources"][event["source"]] += 1
+            counts["regions"][event["region"] or "Unknown"] += 1
+            for s in (event["symptoms"] or "").split(","):
+                if s:
+                    counts["reactions"][MEDDRA_PT.get(s, s)] += 1
+    return counts
+
+
+def _merge(total, day):
+    total["events"] += day["events"]
+    total["serious"] += day["serious"]
+    for key in ("severity", "reactions", "sources", "regions"):
+        total[key].update(day[key])
+
+
+class _PDFWriter:
+    """Minimal text-only PDF written page by page to an open binary file."""
+
+    LINES_PER_PAGE = 56
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.offsets = {}
+        self.pages = []
+        self._next = 4  # 1 catalog, 2 page tree, 3 font
+        self.fh.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(3, b"<< /Type /Font /Subtype /Type1 /Name /F1 /BaseFont /Helvetica >>")
+
+    def _object(self, num, body):
+        self.offsets[num] = self.fh.tell()
+        self.fh.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+    def _alloc(self):
+        num = self._next
+        self._next += 1
+        return num
+
+    @staticmethod
+    def _text(line):
+        line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        return line.encode("latin-1", errors="replace")
+
+    def page(self, lines):
+        ops = [b"BT /F1 10 Tf 14 TL 50 800 Td"]
+        for line in lines:
+            if line.startswith("# "):
+                ops.append(b"/F1 14 Tf (" + self._text(line[2:]) + b") ' /F1 10 Tf")
+            else:
+                ops.append(b"(" + self._text(line) + b") '")
+        ops.append(b"ET")
+        stream = b"\n".join(ops)
+        content = self._alloc()
+        self._object(content, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page = self._alloc()
+        self._object(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                           b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content)
+        self.pages.append(page)
+
+    def write_lines(self, lines):
+        for i in range(0, max(len(lines), 1), self.LINES_PER_PAGE):
+            self.page(lines[i:i + self.LINES_PER_PAGE])
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % p for p in self.pages)
+        self._object(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(self.pages))
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = self.fh.tell()
+        size = self._next
+        self.fh.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for num in range(1, size):
+            self.fh.write(b"%010d 00000 n \n" % self.offsets[num])
+        self.fh.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+
+
+def _summary_lines(drug, since, until, totals, days):
+    def top(counter, n=15):
+        return [f"    {name}: {count:,}" for name, count in counter.most_common(n)] or ["    none"]
+
+    return [
+        f"# ComplianceWatch periodic safety summary: {drug}",
+        f"Period: {_stamp(since, '%Y-%m-%d')} to {_stamp(until - 1, '%Y-%m-%d')} (UTC)",
+        f"Generated: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC",
+        "",
+        "# B. Adverse event or product problem",
+        f"Total reports: {totals['events']:,}",
+        f"Serious (severity >= {SERIOUS_SEVERITY}): {totals['serious']:,}",
+        "Reactions (MedDRA PT):",
+        *top(totals["reactions"]),
+        "Severity distribution (1-10):",
+        *[f"    {level}: {totals['severity'].get(str(level), 0):,}" for level in range(10, 0, -1)],
+        "",
+        "# D. Suspect product",
+        f"Product name: {drug}",
+        "",
+        "# G. Reporting source",
+        *top(totals["sources"]),
+        "Regions:",
+        *top(totals["regions"], 10),
+        "",
+        "# Daily report counts",
+        *[f"    {_stamp(day * DAY, '%Y-%m-%d')}: {count:,}" for day, count in days],
+    ]
+
+
+def generate_report(store, drug, since, until, out_dir, cache_dir=None):
+    """Write the E2B XML and PDF summary for `drug` over `[since, until)`."""
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f"{_slug(drug)}_{_stamp(since)}_{_stamp(until - 1)}")
+    section_dir = os.path.join(cache_dir, _slug(drug)) if cache_dir else None
+    if section_dir:
+        os.makedirs(section_dir, exist_ok=True)
+
+    totals = {"events": 0, "serious": 0, "severity": Counter(), "reactions": Counter(),
+              "sources": Counter(), "regions": Counter()}
+    daily, reused, rendered = [], 0, 0
+    with open(base + ".xml.tmp", "w", encoding="utf-8") as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<!DOCTYPE ichicsr SYSTEM "http://www.fda.gov/FDA/ICH/ICH_E2B/ichicsr-2-1.dtd">\n'
+                  '<ichicsr lang="en">\n'
+                  "  <ichicsrmessageheader>\n"
+                  "    <messagetype>ichicsr</messagetype>\n"
+                  "    <messageformatversion>2.1</messageformatversion>\n"
+                  "    <messageformatrelease>2.0</messageformatrelease>\n"
+                  f"    <messagenumb>{uuid.uuid4().hex}</messagenumb>\n"
+                  f"    <messagesenderidentifier>{SENDER}</messagesenderidentifier>\n"
+                  "    <messagereceiveridentifier>ZZFDA</messagereceiveridentifier>\n"
+                  "    <messagedateformat>204</messagedateformat>\n"
+                  f"    <messagedate>{_stamp(time.time(), '%Y%m%d%H%M%S')}</messagedate>\n"
+                  "  </ichicsrmessageheader>\n")
+        for day, *fingerprint in day_fingerprints(store, drug, since, until):
+            start, end = max(since, day * DAY), min(until, (day + 1) * DAY)
+            if section_dir is None:
+                counts = _render_day(store, drug, start, end, out)
+                rendered += 1
+            else:
+                fragment = os.path.join(section_dir, f"{day}.xml")
+                manifest_path = os.path.join(section_dir, f"{day}.json")
+                manifest = None
+                if os.path.exists(manifest_path) and os.path.exists(fragment):
+                    with open(manifest_path, encoding="utf-8") as fh:
+                        manifest = json.load(fh)
+                if manifest and manifest["fingerprint"] == fingerprint:
+                    counts = manifest["counts"]
+                    for key in ("severity", "reactions", "sources", "regions"):
+                        counts[key] = Counter(counts[key])
+                    reused += 1
+                else:
+                    with open(fragment + ".tmp", "w", encoding="utf-8") as fh:
+                        counts = _render_day(store, drug, start, end, fh)
+                    os.replace(fragment + ".tmp", fragment)
+                    with open(manifest_path, "w", encoding="utf-8") as fh:
+                        json.dump({"fingerprint": fingerprint, "counts": counts}, fh)
+                    rendered += 1
+                with open(fragment, encoding="utf-8") as fh:
+                    shutil.copyfileobj(fh, out)
+            _merge(totals, counts)
+            daily.append((day, counts["events"]))
+        out.write("</ichicsr>\n")
+    os.replace(base + ".xml.tmp", base + ".xml")
+
+    with open(base + ".pdf.tmp", "wb") as fh:
+        pdf = _PDFWriter(fh)
+        pdf.write_lines(_summary_lines(drug, since, until, totals, daily))
+        pdf.close()
+    os.replace(base + ".pdf.tmp", base + ".pdf")
+
+    return {"drug": drug, "xml": base + ".xml", "pdf": base + ".pdf", "events": totals["events"],
+            "sections_reused": reused, "sections_rendered": rendered}
+
+
+def _generate_one(store_path, drug, since, until, out_dir, cache_dir):
+    store = EventStore(store_path)
+    try:
+        return generate_report(store, drug, since, until, out_dir, cache_dir)
+    finally:
+        store.close()
+
+
+def generate_watchlist(store_path, drugs, since, until, out_dir, cache_dir=None, workers=None):
+    """Generate reports for every drug on the watchlist in parallel processes."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_generate_one, store_path, drug, since, until, out_dir, cache_dir)
+                   for drug in drugs]
+        return [f.result() for f in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate E2B XML and PDF safety reports.")
+    parser.add_argument("--drug", action="append", required=True)
+    parser.add_argument("--days", type=int, default=30, help="period length ending now")
+    parser.add_argument("--store", default="data/events.db")
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--cache-dir", default="data/report-sections")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    until = time.time()
+    since = until - args.days * DAY
+    for result in generate_watchlist(args.store, args.drug, since, until, args.out,
+                                     args.cache_dir, args.workers):
+        print(f"{result['drug']}: {result['events']:,} events -> {result['xml']}, {result['pdf']} "
+              f"({result['sections_reused']} sections reused, {result['sections_rendered']} rendered)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Adaptive per-(drug, source) polling.
+
+Every feed has its own poll interval, aiming for about `target_events` new
+posts per poll based on an exponentially weighted event rate.  Drugs with a
+recent High or Critical alert are polled faster.  Intervals stay within
+`[min_interval, max_interval]`.  When a source's feeds together would exceed
+its API budget, their intervals are stretched proportionally, and a token
+bucket per source enforces the budget.  Due feeds come off a priority queue
+ordered by next poll time.
+"""
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import time
+
+LEVEL_SPEEDUP = {"Critical": 4.0, "High": 2.0}
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class PollScheduler:
+
+    def __init__(self, budgets=None, default_budget=600, min_interval=60.0, max_interval=3600.0,
+                 target_events=50, halflife=1800.0, burst=10):
+        self.budgets = dict(budgets or {})  # source -> requests per hour
+        self.default_budget = default_budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_events = target_events
+        self.halflife = halflife
+        self.burst = burst
+        self.feeds = {}  # (drug, source) -> state dict
+        self.levels = {}  # drug -> current alert level
+        self.buckets = {}
+        self._heap = []
+        self._seq = itertools.count()
+
+    def add(self, drug, source, now=None):
+        now = time.time() if now is None else now
+        key = (drug, source)
+        if key in self.feeds:
+            return
+        self.feeds[key] = {"rate": 0.0, "interval": self.min_interval, "next_due": now,
+                           "last_poll": None, "polls": 0, "events": 0}
+        if source not in self.buckets:
+            budget = self.budgets.get(source, self.default_budget)
+            self.buckets[source] = TokenBucket(budget / 3600.0, self.burst, now)
+        self._push(key)
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.feeds[key]["next_due"], next(self._seq), key))
+
+    def next_poll(self, now=None):
+        """Return `(drug, source)` to poll now, or `(None, seconds_to_wait)`."""
+        now = time.time() if now is None else now
+        while self._heap:
+            due, _, key = self._heap[0]
+            feed = self.feeds[key]
+            if due != feed["next_due"]:
+                heapq.heappop(self._heap)  # superseded by a reschedule
+                continue
+            if due > now:
+                return None, due - now
+            heapq.heappop(self._heap)
+            bucket = self.buckets[key[1]]
+            if bucket.take(now):
+                return key, 0.0
+            feed["next_due"] = now + bucket.wait_time(now)
+            self._push(key)
+        return None, self.max_interval
+
+    def record(self, drug, source, events, now=None):
+        """Feed back the number of new posts a poll returned and reschedule it."""
+        now = time.time() if now is None else now
+        feed = self.feeds[(drug, source)]
+        if feed["last_poll"] is not None and now > feed["last_poll"]:
+            elapsed = now - feed["last_poll"]
+            # The first measured gap seeds the average instead of decaying from zero
+            alpha = 1.0 if feed["polls"] == 1 else 1 - 0.5 ** (elapsed / self.halflife)
+            feed["rate"] += alpha * (events / elapsed - feed["rate"])
+        feed["last_poll"] = now
+        feed["polls"] += 1
+        feed["events"] += events
+        self._rebalance(source, now)
+
+    def set_alert_level(self, drug, level, now=None):
+        if self.levels.get(drug) == level:
+            return
+        self.levels[drug] = level
+        for source in {s for d, s in self.feeds if d == drug}:
+            self._rebalance(source, time.time() if now is None else now)
+
+    def _wanted_interval(self, drug, feed):
+        if feed["polls"] < 2:
+            return self.min_interval  # no rate measured yet
+        interval = self.target_events / feed["rate"] if feed["rate"] > 0 else self.max_interval
+        interval /= LEVEL_SPEEDUP.get(self.levels.get(drug), 1.0)
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def _rebalance(self, source, now):
+        keys = [k for k in self.feeds if k[1] == source]
+        wanted = {k: self._wanted_interval(k[0], self.feeds[k]) for k in keys}
+        demand = sum(1.0 / i for i in wanted.values())  # polls per second
+        capacity = self.buckets[source].rate
+        stretch = max(1.0, demand / capacity) if capacity > 0 else 1.0
+        for key in keys:
+            feed = self.feeds[key]
+            feed["interval"] = wanted[key] * stretch
+            base = feed["last_poll"] if feed["last_poll"] is not None else now
+            next_due = base + feed["interval"]
+            if next_due != feed["next_due"]:
+                feed["next_due"] = next_due
+                self._push(key)
+
+    def schedule(self):
+        return [
+            {"drug": drug, "source": source, "interval": feed["interval"],
+             "next_due": feed["next_due"], "rate_per_hour": feed["rate"] * 3600,
+             "level": self.levels.get(drug), "polls": feed["polls"]}
+            for (drug, source), feed in sorted(self.feeds.items(), key=lambda kv: kv[1]["next_due"])
+        ]
+
+    def write(self, path):
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump({"updated_at": time.time(), "feeds": self.schedule()}, fh)
+        os.replace(tmp, path)
+
+
+def read_schedule(path, drug=None):
+    try:
+        with open(path) as fh:
+            state = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if drug is not None:
+        state["feeds"] = [f for f in state["feeds"] if f["drug"].lower() == drug.lower()]
+    return state
@@ -0,0 +1,393 @@
+"""Similar-case retrieval over embedded event narratives.
+
+Narratives are embedded in batches as they are ingested and appended to a
+`VectorIndex`: flat, memory-mapped files holding int8-quantized unit vectors
+with a per-row scale, the event ids and a drug hash per row.  Search is a
+brute-force matmul over the mapped rows in chunks, which is exact and fast
+enough for smaller corpora.  For millions of rows, `build_ivf` adds an
+inverted-file layer (k-means lists stored contiguously) so a query only
+scans the few lists closest to it, keeping top-k in the tens of
+milliseconds.
+
+The embedding model is pluggable: anything with `dim` and
+`embed(texts) -> float32 array` works.  `HashingEmbedder` needs no model
+files; `SentenceTransformerEmbedder` uses a local sentence-transformers model
+when that package is installed.
+"""
+import argparse
+import os
+import re
+import shutil
+import threading
+import zlib
+
+import numpy as np
+
+from .lexicon import ENTITY_RE
+
+ID_WIDTH = 40  # sha1 hex event ids
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def _drug_hash(drug):
+    return zlib.crc32((drug or "").lower().encode("utf-8"))
+
+
+class HashingEmbedder:
+    """Signed feature hashing of word unigrams/bigrams, with lexicon entities up-weighted."""
+
+    def __init__(self, dim=256, entity_weight=3.0):
+        self.dim = dim
+        self.entity_weight = entity_weight
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            lowered = text.lower()
+            words = _WORD_RE.findall(lowered)
+            features = [(w, 1.0) for w in words]
+            features += [(a + " " + b, 0.5) for a, b in zip(words, words[1:])]
+            features += [("ent:" + e, self.entity_weight) for e in ENTITY_RE.findall(lowered)]
+            for feature, weight in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model (optional dependency)."""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", batch_size=256):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise ImportError("SentenceTransformerEmbedder needs `pip install sentence-transformers`") from exc
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), batch_size=self.batch_size,
+                                 normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def quantize(vectors):
+    """Symmetric per-row int8 quantization; returns `(int8 rows, float32 scales)`."""
+    peak = np.abs(vectors).max(axis=1)
+    scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+    rows = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return rows, scales
+
+
+class VectorIndex:
+    """Append-only int8 vector index stored as raw memory-mappable files.
+
+    A directory has one writer; the pipeline gives each worker its own shard
+    and `search_shards` merges the results.  `add` skips event ids the shard
+    already holds, so redelivered or replayed batches are not indexed twice.
+    """
+
+    def __init__(self, directory, dim):
+        self.directory = directory
+        self.dim = dim
+        os.makedirs(directory, exist_ok=True)
+        self._paths = {name: os.path.join(directory, name)
+                       for name in ("vectors.i8", "scales.f4", "ids.bin", "drugs.u4")}
+        meta = os.path.join(directory, "dim")
+        if os.path.exists(meta):
+            with open(meta) as fh:
+                stored = int(fh.read())
+            if stored != dim:
+                raise ValueError(f"index at {directory} has dim {stored}, not {dim}")
+        else:
+            with open(meta, "w") as fh:
+                fh.write(str(dim))
+        self._mapped = None
+        self._ivf = None
+        self._known = None  # (sorted ids on disk when loaded, ids added since)
+        self._repaired = False
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self._paths["scales.f4"]) // 4
+        except FileNotFoundError:
+            return 0
+
+    def _new_rows(self, id_bytes):
+        """Mask of the first occurrence of each id not yet in the index."""
+        if self._known is None:
+            n = len(self)
+            on_disk = np.fromfile(self._paths["ids.bin"], dtype=f"S{ID_WIDTH}", count=n) if n else \
+                np.empty(0, dtype=f"S{ID_WIDTH}")
+            self._known = (np.sort(on_disk), set())
+        on_disk, added = self._known
+        if len(added) > 65536:
+            on_disk = np.sort(np.concatenate([on_disk, np.array(sorted(added), dtype=f"S{ID_WIDTH}")]))
+            added = set()
+            self._known = (on_disk, added)
+        keep = np.zeros(len(id_bytes), dtype=bool)
+        _, first = np.unique(id_bytes, return_index=True)
+        keep[first] = True
+        if len(on_disk):
+            at = np.minimum(np.searchsorted(on_disk, id_bytes), len(on_disk) - 1)
+            keep &= on_disk[at] != id_bytes
+        keep &= np.fromiter((i not in added for i in id_bytes.tolist()), dtype=bool, count=len(id_bytes))
+        return keep
+
+    def _repair(self):
+        """Cut every file back to the committed row count.
+
+        A writer that died part-way through `add` leaves rows in some files
+        and not in `scales.f4`; appending after them would misalign every
+        later row.  Only the writer may do this, since a reader could catch
+        the writer between two of its appends.
+        """
+        n = len(self)
+        for name, width in (("vectors.i8", self.dim), ("scales.f4", 4), ("ids.bin", ID_WIDTH),
+                            ("drugs.u4", 4)):
+            path = self._paths[name]
+            if os.path.exists(path) and os.path.getsize(path) != n * width:
+                with open(path, "r+b") as fh:
+                    fh.truncate(n * width)
+        self._repaired = True
+
+    def add(self, ids, drugs, vectors):
+        """Append rows for ids not already indexed; returns the number added."""
+        if not self._repaired:
+            self._repair()
+        id_bytes = np.array([i.encode("ascii")[:ID_WIDTH] for i in ids], dtype=f"S{ID_WIDTH}")
+        keep = self._new_rows(id_bytes)
+        if not keep.any():
+            return 0
+        id_bytes = id_bytes[keep]
+        rows, scales = quantize(np.asarray(vectors, dtype=np.float32)[keep])
+        drug_hashes = np.array([_drug_hash(d) for d, k in zip(drugs, keep) if k], dtype=np.uint32)
+        # Scales go last: their file length is the committed row count
+        for name, data in (("vectors.i8", rows), ("ids.bin", id_bytes),
+                           ("drugs.u4", drug_hashes), ("scales.f4", scales)):
+            with open(self._paths[name], "ab") as fh:
+                fh.write(data.tobytes())
+        self._known[1].update(id_bytes.tolist())
+        self._mapped = None
+        return len(id_bytes)
+
+    def _maps(self):
+        n = len(self)
+        if self._mapped is None or self._mapped[0] != n:
+            if n == 0:
+                return 0, None, None, None, None
+            self._mapped = (
+                n,
+                np.memmap(self._paths["vectors.i8"], dtype=np.int8, mode="r", shape=(n, self.dim)),
+                np.memmap(self._paths["scales.f4"], dtype=np.float32, mode="r", shape=(n,)),
+                np.memmap(self._paths["ids.bin"], dtype=f"S{ID_WIDTH}", mode="r", shape=(n,)),
+                np.memmap(self._paths["drugs.u4"], dtype=np.uint32, mode="r", shape=(n,)),
+            )
+        return self._mapped
+
+    def build_ivf(self, nlist=None, iterations=8, seed=0, chunk_rows=32768):
+        """Cluster the current rows into `nlist` inverted lists (spherical k-means).
+
+        Rows are copied into `ivf/` sorted by list so every list is one
+        contiguous range.  Rows appended later stay in the flat files and
+        are scanned exhaustively until the next build.
+        """
+        n, vectors, scales, ids, drugs = self._maps()
+        if n == 0:
+            return
+        nlist = nlist or int(np.clip(np.sqrt(n) / 4, 1, 1024))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))
+        sample = vectors[sample_rows].astype(np.float32) * scales[sample_rows, None]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        lists = np.empty(n, dtype=np.int32)
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            lists[start:stop] = np.argmax(vectors[start:stop].astype(np.float32) @ centroids.T, axis=1)
+        order = np.argsort(lists, kind="stable")
+        offsets = np.searchsorted(lists[order], np.arange(nlist + 1)).astype(np.int64)
+
+        tmp = os.path.join(self.directory, "ivf.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, source in (("vectors.i8", vectors), ("scales.f4", scales),
+                             ("ids.bin", ids), ("drugs.u4", drugs)):
+            with open(os.path.join(tmp, name), "wb") as fh:
+                for start in range(0, n, chunk_rows):
+                    fh.write(np.ascontiguousarray(source[order[start:start + chunk_rows]]).tobytes())
+        centroids.astype(np.float32).tofile(os.path.join(tmp, "centroids.f4"))
+        offsets.tofile(os.path.join(tmp, "offsets.i8"))
+        final = os.path.join(self.directory, "ivf")
+        old = os.path.join(self.directory, "ivf.old")
+        if os.path.exists(final):
+            os.replace(final, old)
+        os.replace(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+        self._ivf = None
+
+    def _ivf_maps(self):
+        path = os.path.join(self.directory, "ivf")
+        try:
+            stamp = os.stat(os.path.join(path, "offsets.i8")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if getattr(self, "_ivf", None) is None or self._ivf[0] != stamp:
+            offsets = np.fromfile(os.path.join(path, "offsets.i8"), dtype=np.int64)
+            rows = int(offsets[-1])
+            self._ivf = (stamp, {
+                "offsets": offsets,
+                "centroids": np.fromfile(os.path.join(path, "centroids.f4"), dtype=np.float32
+                                         ).reshape(len(offsets) - 1, self.dim),
+                "arrays": (
+                    np.memmap(os.path.join(path, "vectors.i8"), dtype=np.int8, mode="r", shape=(rows, self.dim)),
+                    np.memmap(os.path.join(path, "scales.f4"), dtype=np.float32, mode="r", shape=(rows,)),
+                    np.memmap(os.path.join(path, "ids.bin"), dtype=f"S{ID_WIDTH}", mode="r", shape=(rows,)),
+                    np.memmap(os.path.join(path, "drugs.u4"), dtype=np.uint32, mode="r", shape=(rows,)),
+                ),
+            })
+        return self._ivf[1]
+
+    def search(self, query, k=10, drug=None, nprobe=8, chunk_rows=32768):
+        """Return up to `k` `(event_id, cosine score)` pairs, best first.
+
+        Uses the IVF lists when `build_ivf` has run (probing the `nprobe`
+        closest lists), otherwise scans every row.
+        """
+        n, vectors, scales, ids, drugs = self._maps()
+        if n == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        wanted = _drug_hash(drug) if drug else None
+        hits = []
+        ivf = self._ivf_maps()
+        flat_start = 0
+        if ivf is not None:
+            offsets = ivf["offsets"]
+            probe = np.argsort(-(ivf["centroids"] @ query))[:nprobe]
+            ranges = [(offsets[c], offsets[c + 1]) for c in sorted(probe)]
+            hits += _top_k(ivf["arrays"], ranges, query, k, wanted, chunk_rows)
+            flat_start = int(offsets[-1])
+        if flat_start < n:
+            hits += _top_k((vectors, scales, ids, drugs), [(flat_start, n)], query, k, wanted, chunk_rows)
+        hits.sort(key=lambda hit: -hit[1])
+        return hits[:k]
+
+
+def _top_k(arrays, ranges, query, k, wanted, chunk_rows):
+    vectors, scales, ids, drugs = arrays
+    best_scores = np.empty(0, dtype=np.float32)
+    best_rows = np.empty(0, dtype=np.int64)
+    for range_start, range_stop in ranges:
+        for start in range(int(range_start), int(range_stop), chunk_rows):
+            stop = min(start + chunk_rows, int(range_stop))
+            scores = (vectors[start:stop].astype(np.float32) @ query) * scales[start:stop]
+            if wanted is not None:
+                scores[drugs[start:stop] != wanted] = -np.inf
+            take = min(k, stop - start)
+            top = np.argpartition(scores, -take)[-take:]
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+    return [(ids[row].decode("ascii"), float(score))
+            for row, score in zip(best_rows, best_scores) if np.isfinite(score)]
+
+
+def index_events(index, embedder, events, texts=None):
+    """Embed a batch of scored events and append the ones not yet in `index`.
+
+    `texts` overrides the narratives embedded, e.g. the multilingual stage's
+    English-normalized copies, so near-duplicates match across languages.
+    """
+    if not events:
+        return 0
+    texts = texts if texts is not None else [e["text"] for e in events]
+    # Only embed what is new: redelivered batches cost an id lookup
+    id_bytes = np.array([e["event_id"].encode("ascii")[:ID_WIDTH] for e in events], dtype=f"S{ID_WIDTH}")
+    new = np.flatnonzero(index._new_rows(id_bytes))
+    if not len(new):
+        return 0
+    return index.add([events[i]["event_id"] for i in new], [events[i]["drug"] for i in new],
+                     embedder.embed([texts[i] or "" for i in new]))
+
+
+# Open shards, reused across searches; each refreshes its maps when rows are
+# appended or its IVF lists are rebuilt
+_SHARDS = {}
+_SHARDS_LOCK = threading.Lock()
+
+
+def _shard(path, dim):
+    with _SHARDS_LOCK:
+        index = _SHARDS.get((path, dim))
+        if index is None:
+            index = _SHARDS[(path, dim)] = VectorIndex(path, dim)
+        return index
+
+
+def shard_generation(root):
+    """Changes whenever any shard under `root` gains rows or rebuilds its IVF lists."""
+    if not os.path.isdir(root):
+        return ()
+    generation = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            try:
+                rows = os.path.getsize(os.path.join(path, "scales.f4"))
+            except FileNotFoundError:
+                rows = 0
+            try:
+                ivf = os.stat(os.path.join(path, "ivf", "offsets.i8")).st_mtime_ns
+            except FileNotFoundError:
+                ivf = None
+            generation.append((name, rows, ivf))
+    return tuple(generation)
+
+
+def search_shards(root, query, dim, k=10, drug=None):
+    """Top-k distinct event ids across every shard directory under `root`.
+
+    An event can sit in two shards after the worker count changed, or twice
+    in a shard written before `add` skipped known ids, so shards are asked
+    for extra hits and duplicates keep their best score.
+    """
+    if not os.path.isdir(root):
+        return []
+    best = {}
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            for event_id, score in _shard(path, dim).search(query, 2 * k, drug):
+                if score > best.get(event_id, -np.inf):
+                    best[event_id] = score
+    return sorted(best.items(), key=lambda hit: -hit[1])[:k]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build IVF lists for similar-case vector shards.")
+    parser.add_argument("root", nargs="?", default="data/vectors")
+    parser.add_argument("--dim", type=int, default=HashingEmbedder().dim)
+    parser.add_argument("--nlist", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    for name in sorted(os.listdir(args.root)):
+        path = os.path.join(args.root, name)
+        if os.path.isdir(path):
+            index = VectorIndex(path, args.dim)
+            index.build_ivf(args.nlist)
+            print(f"{name}: {len(index):,} rows indexed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Post sources feeding the ingestion pipeline.
+
+A source only needs `name` and `fetch(drug, since, limit)` returning post
+dicts with `post_id`, `drug`, `source`, `created_at`, `region` and `text`.
+`SyntheticSource` generates reproducible posts for local runs, tests and
+benchmarks until the live Reddit/Twitter/FAERS connectors are wired in.
+"""
+import hashlib
+import random
+import time
+
+from .lexicon import SYMPTOM_TRANSLATIONS
+
+REGIONS = ['Northeast', 'Southeast', 'Midwest', 'Southwest', 'West Coast']
+
+SYMPTOM_PHRASES = [
+    "mild nausea", "a headache", "some fatigue", "dizziness", "stomach pain",
+    "vomiting all night", "blurred vision", "heart palpitations", "a rash",
+    "severe allergic reaction", "trouble breathing", "chest pain", "a seizure",
+    "pancreatitis", "fainting", "insomnia", "hair loss", "numbness in my hands",
+]
+
+TEMPLATES = [
+    "Started {drug} last week and now I have {symptom}.",
+    "Anyone else get {symptom} on {drug}? Second dose was rough.",
+    "My mom is on {drug}, she had {symptom} and went to the ER.",
+    "{drug} day 3: {symptom}, and also {symptom2}.",
+    "Doctor switched me to {drug}. So far just {symptom}.",
+    "Reporting {symptom} after increasing my {drug} dose.",
+]
+
+# Self-descriptions prefixed to some first-person posts, so demographic
+# extraction and the cohort cube have something to work with
+PERSONAS = ["{age}{sex} here.", "({age}{sex})", "I'm {age}, {condition}.", "{age}{sex}, {condition}."]
+CONDITION_PHRASES = [
+    "type 2 diabetic", "high blood pressure", "heart failure", "asthma", "CKD stage 3",
+    "depression", "rheumatoid arthritis", "no other conditions",
+]
+
+# Non-English posts, for the multilingual stage; symptom phrases are drawn
+# from the lexicon translations of each language
+FOREIGN_TEMPLATES = {
+    "es": ["Empecé {drug} la semana pasada y ahora tengo {symptom}.",
+           "¿Alguien más con {symptom} por {drug}? La segunda dosis fue muy dura.",
+           "Mi madre toma {drug}, tuvo {symptom} y la llevamos a urgencias."],
+    "fr": ["J'ai commencé {drug} la semaine dernière et depuis j'ai des {symptom}.",
+           "Quelqu'un d'autre a des {symptom} avec {drug} ? Après la deuxième dose c'est dur.",
+           "Ma mère est sous {drug}, elle a eu des {symptom} et est allée aux urgences."],
+    "de": ["Ich habe letzte Woche mit {drug} angefangen und habe jetzt {symptom}.",
+           "Hat noch jemand {symptom} nach {drug}? Die zweite Dosis war nicht gut.",
+           "Meine Mutter nimmt {drug}, sie hatte {symptom} und ist in die Notaufnahme."],
+    "pt": ["Comecei {drug} semana passada e agora tenho {symptom}.",
+           "Mais alguém com {symptom} depois de {drug}? Não está fácil.",
+           "Minha mãe toma {drug}, teve {symptom} e foi ao pronto-socorro."],
+    "it": ["Ho iniziato {drug} la settimana scorsa e ora ho {symptom}.",
+           "Qualcun altro ha {symptom} con {drug}? Dopo la seconda dose non sto bene.",
+           "Mia madre prende {drug}, dopo ha avuto {symptom} ed è andata al pronto soccorso."],
+}
+FOREIGN_SYMPTOMS = {
+    lang: [p for p, term in phrases.items() if term not in ("er", "hospital", "ambulance")]
+    for lang, phrases in SYMPTOM_TRANSLATIONS.items()
+}
+
+
+class SyntheticSource:
+
+    def __init__(self, name, seed=0, posts_per_fetch=200, posts_per_hour=None, foreign_share=0.0):
+        self.name = name
+        self.seed = seed
+        self.posts_per_fetch = posts_per_fetch
+        # Share of posts written in one of FOREIGN_TEMPLATES' languages
+        self.foreign_share = foreign_share
+        # Number or {drug: rate}; when set, a fetch with `since` returns only
+        # the posts "published" since then, like a real incremental API.
+        self.posts_per_hour = posts_per_hour
+        self._cursor = {}
+
+    def _velocity(self, drug):
+        if isinstance(self.posts_per_hour, dict):
+            return self.posts_per_hour.get(drug, 0)
+        return self.posts_per_hour
+
+    @staticmethod
+    def _persona(rng, drug):
+        # Each drug gets its own typical patient age
+        mode = 25 + int(hashlib.sha1(drug.lower().encode()).hexdigest(), 16) % 45
+        return rng.choice(PERSONAS).format(
+            age=int(rng.triangular(16, 90, mode)), sex=rng.choice("FM"),
+            condition=rng.choice(CONDITION_PHRASES))
+
+    def fetch(self, drug, since=None, limit=None):
+        start = self._cursor.get(drug, 0)
+        rng = random.Random(f"{self.seed}:{self.name}:{drug}:{start}")
+        now = time.time() if since is None else max(since, time.time())
+        if limit is None and since is not None and self.posts_per_hour is not None:
+            expected = self._velocity(drug) * (now - since) / 3600
+            limit = min(self.posts_per_fetch, int(expected) + (rng.random() < expected % 1))
+        limit = self.posts_per_fetch if limit is None else limit
+        span = 3600 if since is None else min(3600, now - since)
+        posts = []
+        for seq in range(start, start + limit):
+            symptom, symptom2 = rng.sample(SYMPTOM_PHRASES, 2)
+            template = rng.choice(TEMPLATES)
+            text = template.format(drug=drug, symptom=symptom, symptom2=symptom2)
+            if not template.startswith("My mom") and rng.random() < 0.5:
+                text = self._persona(rng, drug) + " " + text
+            if self.foreign_share and rng.random() < self.foreign_share:
+                lang = rng.choice(sorted(FOREIGN_TEMPLATES))
+                text = rng.choice(FOREIGN_TEMPLATES[lang]).format(
+                    drug=drug, symptom=rng.choice(FOREIGN_SYMPTOMS[lang]))
+            posts.append({
+                "post_id": hashlib.sha1(f"{self.name}:{drug}:{seq}".encode()).hexdigest(),
+                "drug": drug,
+                "source": self.name,
+                "created_at": now - rng.uniform(0, span),
+                "region": rng.choice(REGIONS),
+                "text": text,
+            })
+        self._cursor[drug] = start + limit
+        return posts
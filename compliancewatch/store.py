@@ -0,0 +1,295 @@
+"""SQLite event store for scored adverse-event reports and raised alerts.
+
+Writes are upserts keyed by `event_id` / `alert_id`, so replaying the same
+messages (at-least-once delivery, retries, backfills) leaves the store in the
+same state.
+"""
+import os
+import sqlite3
+import threading
+import zlib
+
+_TABLES = {
+    "events": """
+CREATE TABLE IF NOT EXISTS {name} (
+    event_id TEXT PRIMARY KEY,
+    drug TEXT NOT NULL COLLATE NOCASE,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    region TEXT,
+    language TEXT,
+    text TEXT,
+    severity INTEGER,
+    confidence REAL,
+    symptoms TEXT,
+    age INTEGER,
+    sex TEXT,
+    comorbidities TEXT
+)""",
+    "alerts": """
+CREATE TABLE IF NOT EXISTS {name} (
+    alert_id TEXT PRIMARY KEY,
+    drug TEXT NOT NULL COLLATE NOCASE,
+    level TEXT NOT NULL,
+    title TEXT NOT NULL,
+    desc TEXT,
+    source TEXT,
+    created_at REAL NOT NULL,
+    confidence REAL,
+    event_count INTEGER
+)""",
+}
+# Columns added after the first release, added in place to older stores
+_ADDED_COLUMNS = {"events": [("age", "INTEGER"), ("sex", "TEXT"), ("comorbidities", "TEXT")]}
+SHADOW_SUFFIX = "_shadow"
+
+EVENT_COLUMNS = ("event_id", "drug", "source", "created_at", "region", "language",
+                 "text", "severity", "confidence", "symptoms", "age", "sex", "comorbidities")
+# Arrow types for the non-text event columns (exports, cold tier)
+EVENT_TYPES = {"created_at": "float64", "severity": "int64", "confidence": "float64", "age": "int64"}
+ALERT_COLUMNS = ("alert_id", "drug", "level", "title", "desc", "source",
+                 "created_at", "confidence", "event_count")
+# `store_meta` key of the signal detector's severity threshold, set by a backfill swap
+SEVERITY_THRESHOLD_KEY = "severity_threshold"
+DEFAULT_SEVERITY_THRESHOLD = 8
+# Report-visible text columns summed into `day_fingerprints` as `content_hash`
+FINGERPRINT_COLUMNS = ("source", "region", "text", "symptoms")
+
+
+def content_hash(*values):
+    """CRC32 of a row's `FINGERPRINT_COLUMNS` values; per-day sums of it change
+    when any of them is edited in place."""
+    return zlib.crc32("\x1f".join("" if v is None else str(v) for v in values).encode("utf-8"))
+
+
+def _create_table(conn, kind, name, index_tag=""):
+    conn.execute(_TABLES[kind].format(name=name))
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+    for column, decl in _ADDED_COLUMNS.get(kind, ()):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {name} ADD COLUMN {column} {decl}")
+    # Index names are schema-global and follow a table through a rename, so
+    # only add one if the table has no (drug, created_at) index yet.
+    for (index_name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (name,)):
+        columns = [row[2] for row in conn.execute(f"PRAGMA index_info({index_name})")]
+        if columns[:2] == ["drug", "created_at"]:
+            return
+    conn.execute(f"CREATE INDEX {name}_drug_time{index_tag} ON {name} (drug, created_at)")
+
+
+def upsert_sql(table, columns, key):
+    updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != key)
+    return (f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT({key}) DO UPDATE SET {updates}")
+
+
+class EventStore:
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # One connection per thread (dashboard sessions) and per process (workers)
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            # Only takes effect on a new file; lets the lifecycle manager
+            # return freed pages to the OS without a full VACUUM
+            local.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("PRAGMA synchronous=NORMAL")
+            for kind in _TABLES:
+                _create_table(local.conn, kind, kind)
+            local.conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT)")
+            local.conn.create_function("content_hash", -1, content_hash, deterministic=True)
+            local.pid = os.getpid()
+        return local.conn
+
+    def write_events(self, events, table="events"):
+        rows = [tuple(e.get(c) for c in EVENT_COLUMNS) for e in events]
+        if not rows:
+            return 0
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(upsert_sql(table, EVENT_COLUMNS, "event_id"), rows)
+        conn.execute("COMMIT")
+        return len(rows)
+
+    def write_alerts(self, alerts, table="alerts"):
+        rows = [tuple(a.get(c) for c in ALERT_COLUMNS) for a in alerts]
+        if not rows:
+            return 0
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(upsert_sql(table, ALERT_COLUMNS, "alert_id"), rows)
+        conn.execute("COMMIT")
+        return len(rows)
+
+    def iter_events(self, drug=None, since=None, until=None, sources=None,
+                    columns=EVENT_COLUMNS, batch_size=10000):
+        """Yield lists of event tuples in `(created_at, event_id)` order."""
+        clauses, params = [], []
+        if drug is not None:
+            clauses.append("drug = ?")
+            params.append(drug)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if sources:
+            clauses.append(f"source IN ({', '.join('?' for _ in sources)})")
+            params.extend(sources)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM events {where} ORDER BY created_at, event_id",
+            params,
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def day_fingerprints(self, drug, since, until):
+        """Per-UTC-day `(day, count, first_at, last_at, severity_sum, content_sum)`
+        for a drug.
+
+        Changes whenever events in that day are added, rescored or edited
+        (`content_sum` adds up `content_hash` over `FINGERPRINT_COLUMNS`).
+        """
+        return self.conn.execute(
+            "SELECT CAST(created_at / 86400 AS INTEGER) AS day, COUNT(*), MIN(created_at), MAX(created_at), "
+            f"TOTAL(severity), TOTAL(content_hash({', '.join(FINGERPRINT_COLUMNS)})) FROM events WHERE drug = ? "
+            "AND created_at >= ? AND created_at < ? GROUP BY day ORDER BY day",
+            (drug, since, until),
+        ).fetchall()
+
+    def events_after(self, drug, after=None, limit=10000, columns=EVENT_COLUMNS, table="events"):
+        """One keyset page of a drug's events strictly after `(created_at, event_id)`.
+
+        Unlike `iter_events` no cursor stays open between pages, so the caller
+        can write on the same connection while paging through history.
+        """
+        where, params = "drug = ?", [drug]
+        if after is not None:
+            where += " AND (created_at, event_id) > (?, ?)"
+            params.extend(after)
+        return self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE {where} "
+            "ORDER BY created_at, event_id LIMIT ?",
+            params + [limit],
+        ).fetchall()
+
+    def drugs(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT drug FROM events ORDER BY drug")]
+
+    def alerts(self, drug, limit=50, since=None):
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(ALERT_COLUMNS)} FROM alerts WHERE drug = ? AND created_at >= ? "
+            "ORDER BY created_at DESC LIMIT ?",
+            (drug, since if since is not None else float("-inf"), limit),
+        )
+        return [dict(zip(ALERT_COLUMNS, row)) for row in cursor]
+
+    def count_events(self, drug=None):
+        if drug is None:
+            return self.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM events WHERE drug = ?", (drug,)
+        ).fetchone()[0]
+
+    def get_events(self, event_ids, columns=EVENT_COLUMNS):
+        """Fetch events by id, returned as dicts in the order of `event_ids`."""
+        found = {}
+        ids = list(event_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor = self.conn.execute(
+                f"SELECT {', '.join(columns)} FROM events "
+                f"WHERE event_id IN ({', '.join('?' for _ in chunk)})",
+                chunk,
+            )
+            for row in cursor:
+                record = dict(zip(columns, row))
+                found[record["event_id"]] = record
+        return [found[i] for i in ids if i in found]
+
+    def create_shadow(self, tag):
+        """Create empty `events_shadow` / `alerts_shadow` tables for a backfill run."""
+        for kind in _TABLES:
+            _create_table(self.conn, kind, kind + SHADOW_SUFFIX, index_tag=f"_{tag}")
+
+    def drop_shadow(self):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        for kind in _TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {kind}{SHADOW_SUFFIX}")
+        conn.execute("COMMIT")
+
+    def events_generation(self):
+        """Bumped by every `swap_shadow()`.  Rows deleted by retention or
+        tiering do not change it, so aggregates built on top keep their history."""
+        row = self.conn.execute("SELECT value FROM store_meta WHERE key = 'events_generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def severity_threshold(self):
+        return int(self.get_meta(SEVERITY_THRESHOLD_KEY, DEFAULT_SEVERITY_THRESHOLD))
+
+    def max_event_rowid(self):
+        return self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM events").fetchone()[0]
+
+    def swap_shadow(self, carry_over_after=None, meta=None):
+        """Atomically replace the live tables with the shadow tables.
+
+        Events inserted into the live table after rowid `carry_over_after`
+        (written while the shadow was being filled) are upserted across as-is
+        inside the same transaction, together with the live alerts of the
+        windows they fall in that the shadow does not have.  `meta` is a dict
+        of `store_meta` values written in the same transaction.
+        """
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if carry_over_after is not None:
+                columns = ", ".join(EVENT_COLUMNS)
+                updates = ", ".join(f"{c} = excluded.{c}" for c in EVENT_COLUMNS if c != "event_id")
+                # "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint
+                conn.execute(f"INSERT INTO events{SHADOW_SUFFIX} ({columns}) "
+                             f"SELECT {columns} FROM events WHERE rowid > ? AND true "
+                             f"ON CONFLICT(event_id) DO UPDATE SET {updates}", (carry_over_after,))
+                # An alert's created_at is the end of its window
+                columns = ", ".join(ALERT_COLUMNS)
+                conn.execute(f"INSERT OR IGNORE INTO alerts{SHADOW_SUFFIX} ({columns}) "
+                             f"SELECT {columns} FROM alerts AS a WHERE a.created_at > ("
+                             "SELECT MIN(e.created_at) FROM events AS e WHERE e.rowid > ? AND e.drug = a.drug)",
+                             (carry_over_after,))
+            for key, value in (meta or {}).items():
+                conn.execute("INSERT INTO store_meta VALUES (?, ?) ON CONFLICT(key) "
+                             "DO UPDATE SET value = excluded.value", (key, str(value)))
+            for kind in _TABLES:
+                conn.execute(f"ALTER TABLE {kind} RENAME TO {kind}_retired")
+                conn.execute(f"ALTER TABLE {kind}{SHADOW_SUFFIX} RENAME TO {kind}")
+                conn.execute(f"DROP TABLE {kind}_retired")
+            conn.execute("INSERT INTO store_meta VALUES ('events_generation', '1') ON CONFLICT(key) "
+                         "DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        if getattr(self._local, "conn", None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
@@ -0,0 +1,198 @@
+"""Multilingual stage: batch language detection and translation or
+normalization to the English lexicon before preprocessing.
+
+Scoring, entity extraction and similar-case dedup all work on the English
+lexicon.  `MultilingualStage.run` detects each post's language, groups the
+non-English posts by language, and sends each group to the translator in a
+single call.  Only the scored copy of the text changes; the event keeps its
+original text, and its detected language overrides the one preprocessing
+would report.
+
+The translator is pluggable.  Anything with a `name` and
+`translate(texts, lang) -> list of str` works:
+
+- `LexiconNormalizer` needs no model files.  It rewrites symptom and
+  escalation phrases (`lexicon.SYMPTOM_TRANSLATIONS`) to their English
+  lexicon terms, so they score and map to the same MedDRA preferred terms.
+- `MarianTranslator` runs local MarianMT models when `transformers` is
+  installed.
+
+Results are cached in SQLite (`TranslationCache`), keyed by a hash of the
+translator name, the language and the whitespace- and case-normalized text.
+Reposts and retweets are therefore translated only once.
+
+    python benchmarks/bench_multilingual.py --posts 20000
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+from .lexicon import SYMPTOM_TRANSLATIONS
+from .preprocess import LANGUAGE_CODES, detect_language, tokenize
+
+PASS_THROUGH = ("und", "en")
+
+
+class LexiconNormalizer:
+    """Rewrites known symptom/escalation phrases to their English lexicon terms."""
+
+    name = "lexicon-v1"
+
+    def __init__(self, translations=SYMPTOM_TRANSLATIONS):
+        self._patterns = {}
+        for lang, phrases in translations.items():
+            ordered = sorted(phrases, key=len, reverse=True)
+            pattern = re.compile(r"(?<!\w)(" + "|".join(re.escape(p) for p in ordered) + r")(?!\w)",
+                                 re.IGNORECASE)
+            lookup = {p.lower(): term for p, term in phrases.items()}
+            self._patterns[lang] = (pattern, lookup)
+
+    def translate(self, texts, lang):
+        if lang not in self._patterns:
+            return list(texts)
+        pattern, lookup = self._patterns[lang]
+        return [pattern.sub(lambda m: lookup[m.group(1).lower()], text) for text in texts]
+
+
+class MarianTranslator:
+    """Local MarianMT models, one per source language (optional dependency)."""
+
+    def __init__(self, model_template="Helsinki-NLP/opus-mt-{lang}-en", batch_size=32, max_length=256):
+        try:
+            import transformers  # noqa: F401
+        except ImportError as exc:
+            raise ImportError("MarianTranslator needs `pip install transformers sentencepiece torch`") from exc
+        self.name = model_template
+        self.model_template = model_template
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._models = {}
+
+    def _model(self, lang):
+        if lang not in self._models:
+            from transformers import MarianMTModel, MarianTokenizer
+            name = self.model_template.format(lang=lang)
+            self._models[lang] = (MarianTokenizer.from_pretrained(name), MarianMTModel.from_pretrained(name))
+        return self._models[lang]
+
+    def translate(self, texts, lang):
+        tokenizer, model = self._model(lang)
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            inputs = tokenizer(list(texts[i:i + self.batch_size]), return_tensors="pt",
+                               padding=True, truncation=True, max_length=self.max_length)
+            out.extend(tokenizer.batch_decode(model.generate(**inputs), skip_special_tokens=True))
+        return out
+
+
+TRANSLATORS = {"lexicon": LexiconNormalizer, "marian": MarianTranslator}
+
+
+def make_translator(name):
+    """Translator for a CLI choice (`lexicon`, `marian` or `none`)."""
+    return None if name in (None, "none") else TRANSLATORS[name]()
+
+
+def content_key(translator_name, lang, text):
+    normalized = " ".join(text.split()).casefold()
+    raw = f"{translator_name}\x00{lang}\x00{normalized}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class TranslationCache:
+    """Content-hash -> translated text, in a SQLite file shared by workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS translations "
+                         "(key BLOB PRIMARY KEY, text TEXT NOT NULL, created_at REAL) WITHOUT ROWID")
+        return conn
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            found.update(self.conn.execute(
+                f"SELECT key, text FROM translations WHERE key IN ({', '.join('?' for _ in chunk)})", chunk))
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        self.conn.executemany("INSERT OR IGNORE INTO translations VALUES (?, ?, ?)",
+                              [(key, text, now) for key, text in items])
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def close(self):
+        if getattr(self._local, "conn", None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+
+@dataclass
+class LanguageStats:
+    posts: int = 0
+    cache_hits: int = 0
+    translated: int = 0
+    seconds: float = 0.0
+
+
+class MultilingualStage:
+    """Detect languages and translate non-English posts, per language, through the cache."""
+
+    def __init__(self, translator=None, cache=None):
+        self.translator = translator or LexiconNormalizer()
+        self.cache = cache
+        self.stats = defaultdict(LanguageStats)
+
+    def run(self, texts):
+        """`(texts for preprocessing, uint8 language codes into preprocess.LANGUAGES)`."""
+        languages = [detect_language(tokenize(text)) for text in texts]
+        out = list(texts)
+        groups = defaultdict(list)
+        for i, lang in enumerate(languages):
+            self.stats[lang].posts += 1
+            if lang not in PASS_THROUGH:
+                groups[lang].append(i)
+        for lang, rows in groups.items():
+            started = time.perf_counter()
+            stats = self.stats[lang]
+            keys = [content_key(self.translator.name, lang, texts[i]) for i in rows]
+            cached = self.cache.get_many(set(keys)) if self.cache is not None else {}
+            # Reposts inside one batch are translated once too
+            pending = {}
+            for key, i in zip(keys, rows):
+                if key not in cached:
+                    pending.setdefault(key, texts[i])
+            if pending:
+                translated = self.translator.translate(list(pending.values()), lang)
+                fresh = dict(zip(pending, translated))
+                if self.cache is not None:
+                    self.cache.put_many(fresh.items())
+                cached.update(fresh)
+                stats.translated += len(pending)
+            stats.cache_hits += len(rows) - len(pending)
+            for key, i in zip(keys, rows):
+                out[i] = cached[key]
+            stats.seconds += time.perf_counter() - started
+        return out, np.array([LANGUAGE_CODES[lang] for lang in languages], dtype=np.uint8)
+
+    def stats_dict(self):
+        return {lang: vars(s) for lang, s in sorted(self.stats.items())}
@@ -1,14 +1,25 @@
 # compliancewatch_beautiful.py - Beautiful Clean UI
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
+import os
 import random
 import time
+import urllib.parse
 import numpy as np
 
+from compliancewatch import aggregates, cohorts, figures, mgps
+from compliancewatch.audit import AuditLog
+from compliancewatch.bundles import BundleStore, data_version
+from compliancewatch.cache import ResultCache, signature
+from compliancewatch.export import FORMATS, available_formats, export_events, export_frame, filename
+from compliancewatch.notify import read_metrics
+from compliancewatch.scheduler import read_schedule
+from compliancewatch.similar import HashingEmbedder, search_shards, shard_generation
+from compliancewatch.store import EventStore
+
 # Page config
 st.set_page_config(
     page_title="ComplianceWatch | Pharmaceutical Monitoring",
@@ -23,6 +34,97 @@ if 'monitoring' not in st.session_state:
 if 'counter' not in st.session_state:
     st.session_state.counter = 0
 
+# Pipeline output (event store, vector index, audit chains) lives here
+DATA_DIR = os.environ.get("COMPLIANCEWATCH_DATA_DIR", "data")
+# Base URL of a running `python -m compliancewatch.api`; raw-event exports
+# stream from it instead of going through this server's memory
+API_URL = os.environ.get("COMPLIANCEWATCH_API_URL", "").rstrip("/")
+# Without the API, a raw-event download is built in memory, so it is capped
+APP_EXPORT_ROWS = 100_000
+TIME_RANGE_DAYS = {"Last 24 Hours": 1, "Last 7 Days": 7, "Last 30 Days": 30, "Last 90 Days": 90, "Last Year": 365}
+
+# Process-wide result cache, shared by every browser session on this server.
+# Set COMPLIANCEWATCH_CACHE_DIR to share results between server processes too.
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(disk_dir=os.environ.get("COMPLIANCEWATCH_CACHE_DIR"))
+
+result_cache = get_result_cache()
+
+def cached(*query, compute):
+    return result_cache.get_or_compute(signature(*query), compute)
+
+# Audit trail for analyst actions. A chain has a single writer, so each
+# server process needs its own COMPLIANCEWATCH_AUDIT_DIR.
+@st.cache_resource
+def get_audit_log():
+    return AuditLog(os.environ.get("COMPLIANCEWATCH_AUDIT_DIR", os.path.join(DATA_DIR, "audit", "app")))
+
+@st.cache_resource
+def get_event_store():
+    return EventStore(os.path.join(DATA_DIR, "events.db"))
+
+# Per-drug dashboard bundles materialized by the pipeline
+@st.cache_resource
+def get_bundle_store():
+    return BundleStore(os.path.join(DATA_DIR, "bundles"))
+
+def bundled(bundle, name, compute):
+    """An aggregate from the drug's materialized bundle, else `compute()`."""
+    if bundle is not None and name in bundle["data"]:
+        return bundle["data"][name]
+    return compute()
+
+@st.cache_resource
+def get_embedder():
+    return HashingEmbedder()
+
+def format_duration(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f}s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
+
+def export_controls(label, stem, build, key):
+    """Format picker plus a download button; `build(fmt)` runs only on click."""
+    col_format, col_button = st.columns([1, 2])
+    with col_format:
+        fmt = st.selectbox("Format", available_formats(), key=f"{key}_format",
+                           label_visibility="collapsed")
+    with col_button:
+        st.download_button(f"⬇️ {label}", data=lambda: build(fmt), file_name=filename(stem, fmt),
+                           mime=FORMATS[fmt][0], key=f"{key}_download", on_click="ignore")
+
+def export_link(label, path, params, key):
+    """Format picker plus a link to a streamed API export."""
+    col_format, col_button = st.columns([1, 2])
+    with col_format:
+        fmt = st.selectbox("Format", available_formats(), key=f"{key}_format",
+                           label_visibility="collapsed")
+    with col_button:
+        st.link_button(f"⬇️ {label}", f"{API_URL}{path}?{urllib.parse.urlencode({**params, 'format': fmt})}")
+
+def similar_cases(alert, drug, k=5):
+    """Indexed reports closest to the severe reports behind `alert`, excluding those."""
+    root = os.path.join(DATA_DIR, "vectors")
+
+    def compute():
+        store, embedder = get_event_store(), get_embedder()
+        cluster = aggregates.alert_events(store, drug, alert['created_at'])
+        texts = [text or "" for _, text in cluster] or [f"{alert['title']}. {alert['desc']}"]
+        query = embedder.embed(texts).mean(axis=0)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        own = {event_id for event_id, _ in cluster}
+        hits = [hit for hit in search_shards(root, query, embedder.dim, k=k + len(own), drug=drug)
+                if hit[0] not in own][:k]
+        scores = dict(hits)
+        events = store.get_events([event_id for event_id, _ in hits])
+        return [(event, scores[event['event_id']]) for event in events]
+
+    return cached("similar_cases", alert['alert_id'], alert['event_count'], shard_generation(root),
+                  compute=compute)
+
 # Beautiful, clean CSS
 st.markdown("""
 <style>
@@ -385,10 +487,12 @@ with st.sidebar:
     st.markdown("### ⏱️ Time Period")
     time_range = st.selectbox(
         "Analysis window",
-        ["Last 24 Hours", "Last 7 Days", "Last 30 Days", "Last 90 Days", "Last Year"],
+        list(TIME_RANGE_DAYS),
         index=1,
         label_visibility="visible"
     )
+    # Exports cover the window; rounded to the minute so export links stay stable
+    export_since = (time.time() - TIME_RANGE_DAYS[time_range] * 86400) // 60 * 60
     
     # Severity threshold
     st.markdown("### 🎯 Alert Settings")
@@ -411,6 +515,14 @@ with st.sidebar:
         label_visibility="visible"
     )
     
+    # Record threshold changes in the audit trail.  A session's first render
+    # only sets the baseline, so opening the page does not log the defaults.
+    thresholds = {"severity_threshold": severity_threshold, "confidence_threshold": confidence_threshold}
+    previous = st.session_state.get("audited_thresholds")
+    if previous is not None and previous != thresholds:
+        get_audit_log().append("threshold", drug_name or None, {**thresholds, "previous": previous})
+    st.session_state.audited_thresholds = thresholds
+    
     st.markdown("---")
     
     # Start monitoring button
@@ -426,14 +538,58 @@ with st.sidebar:
         col1, col2 = st.columns(2)
         with col1:
             st.metric("Status", "Active", "● Live")
+        schedule = read_schedule(os.path.join(DATA_DIR, "metrics", "schedule.json"),
+                                 drug_name.strip() or None)
+        feeds = schedule["feeds"] if schedule else []
         with col2:
-            st.metric("Health", "Optimal", "100%")
+            if feeds:
+                next_due = min(f["next_due"] for f in feeds) - time.time()
+                st.metric("Polling", f"every {format_duration(min(f['interval'] for f in feeds))}",
+                          f"next in {format_duration(max(0, next_due))}", delta_color="off")
+            else:
+                st.metric("Polling", "Idle", "no schedule", delta_color="off")
+        for feed in feeds:
+            boost = f" · {feed['level']} boost" if feed["level"] in ("Critical", "High") else ""
+            st.caption(f"{feed['source']}: every {format_duration(feed['interval'])} · "
+                       f"{feed['rate_per_hour']:.0f} posts/h{boost}")
         
-        st.markdown(f"**Last Update:** {datetime.now().strftime('%H:%M:%S')}")
+        bundle = get_bundle_store().load_current(
+            drug_name.strip(), data_version(get_event_store(), drug_name.strip())) if drug_name.strip() else None
+        if bundle is not None:
+            built_at = datetime.fromtimestamp(bundle["built_at"])
+            st.markdown(f"**Last Update:** {built_at.strftime('%H:%M:%S')} "
+                        f"· {format_duration(time.time() - bundle['built_at'])} old")
+        else:
+            st.markdown(f"**Last Update:** {datetime.now().strftime('%H:%M:%S')} · live")
+        
+        cache_stats = result_cache.stats()
+        st.caption(
+            f"Cache: {cache_stats.hits + cache_stats.disk_hits + cache_stats.coalesced} hits · "
+            f"{cache_stats.misses} misses · {cache_stats.hit_rate:.0%} hit rate"
+        )
+        notify_stats = read_metrics(os.path.join(DATA_DIR, "metrics"))
+        if notify_stats:
+            caption = (f"Notifications: {notify_stats['delivered']} sent · "
+                       f"{notify_stats['pending'] + notify_stats['retrying']} queued")
+            if notify_stats["latency_p95"] is not None:
+                caption += f" · p95 dispatch {notify_stats['latency_p95']:.1f}s"
+            st.caption(caption)
 
 # Main content area
 if st.session_state.monitoring and drug_name:
     
+    drug_key = drug_name.strip()
+    # One read of the drug's materialized bundle serves the first view, as long
+    # as it was built from the current data; figures are cached per bundle
+    # build, so a refreshed bundle gets fresh figures.  Otherwise results are
+    # cached per version of the drug's data.
+    store = get_event_store()
+    version = data_version(store, drug_key)
+    bundle = get_bundle_store().load_current(drug_key, version)
+    stamp = bundle["built_at"] if bundle is not None else version
+    kpis = bundled(bundle, "kpis", lambda: cached(
+        "kpis", drug_key, stamp, compute=lambda: aggregates.kpis(store, drug_key)))
+    
     # Top KPI Cards
     st.markdown("### 📊 Key Performance Indicators")
     
@@ -442,29 +598,30 @@ if st.session_state.monitoring and drug_name:
     with col1:
         st.metric(
             label="Total Events",
-            value="1,247",
-            delta="↑ 23 today"
+            value=f"{kpis['total_events']:,}",
+            delta=f"↑ {kpis['events_today']} today"
         )
     
     with col2:
         st.metric(
             label="Critical Alerts",
-            value="3",
+            value=str(kpis['critical_alerts']),
             delta="Requires attention"
         )
     
     with col3:
         st.metric(
             label="Detection Speed",
-            value="48 hours",
+            value=(f"{kpis['detection_speed_hours']} hours"
+                   if kpis['detection_speed_hours'] is not None else "–"),
             delta="Faster than baseline"
         )
     
     with col4:
         st.metric(
             label="AI Accuracy",
-            value="94.7%",
-            delta="↑ 2.1%"
+            value=f"{kpis['ai_accuracy']}%" if kpis['ai_accuracy'] is not None else "–",
+            delta=f"{kpis['ai_accuracy_delta']:+}%" if kpis['ai_accuracy_delta'] is not None else None
         )
     
     with col5:
@@ -495,130 +652,25 @@ if st.session_state.monitoring and drug_name:
         with col1:
             st.markdown("#### Severity Distribution")
             
-            severity_data = pd.DataFrame({
-                'Level': ['Critical', 'High', 'Medium', 'Low', 'Minimal'],
-                'Count': [3, 12, 45, 187, 1000]
-            })
-            
-            fig = go.Figure(data=[
-                go.Bar(
-                    x=severity_data['Count'],
-                    y=severity_data['Level'],
-                    orientation='h',
-                    marker=dict(
-                        color=['#EF4444', '#F59E0B', '#F59E0B', '#10B981', '#6B7280'],
-                        line=dict(width=0)
-                    ),
-                    text=severity_data['Count'],
-                    textposition='outside'
-                )
-            ])
-            
-            fig.update_layout(
-                height=350,
-                margin=dict(l=0, r=60, t=20, b=20),
-                plot_bgcolor='#FAFBFF',
-                paper_bgcolor='white',
-                showlegend=False,
-                xaxis=dict(
-                    showgrid=True,
-                    gridcolor='#E5E7EB',
-                    title="Number of Events"
-                ),
-                yaxis=dict(
-                    showgrid=False,
-                    title=""
-                ),
-                font=dict(family="Plus Jakarta Sans")
-            )
+            fig = cached("severity_fig", drug_key, stamp, compute=lambda: figures.severity_figure(
+                bundled(bundle, "severity", lambda: aggregates.severity_distribution(store, drug_key))))
             
             st.plotly_chart(fig, use_container_width=True)
         
         with col2:
             st.markdown("#### Data Source Breakdown")
             
-            source_data = pd.DataFrame({
-                'Source': ['Reddit', 'FDA FAERS', 'Twitter/X', 'Forums', 'Medical'],
-                'Count': [412, 389, 234, 156, 56]
-            })
-            
-            fig2 = go.Figure(data=[go.Pie(
-                labels=source_data['Source'],
-                values=source_data['Count'],
-                hole=0.5,
-                marker=dict(
-                    colors=['#5E4FDB', '#8B7FF0', '#10B981', '#F59E0B', '#3B82F6'],
-                    line=dict(width=0)
-                )
-            )])
-            
-            fig2.update_layout(
-                height=350,
-                margin=dict(l=20, r=20, t=20, b=20),
-                plot_bgcolor='white',
-                paper_bgcolor='white',
-                showlegend=True,
-                font=dict(family="Plus Jakarta Sans"),
-                annotations=[
-                    dict(
-                        text='1,247<br>Total',
-                        x=0.5, y=0.5,
-                        font_size=24,
-                        showarrow=False,
-                        font=dict(family="Plus Jakarta Sans", weight=700)
-                    )
-                ]
-            )
+            fig2 = cached("source_fig", drug_key, stamp, compute=lambda: figures.source_figure(
+                bundled(bundle, "sources", lambda: aggregates.source_breakdown(store, drug_key)),
+                kpis['total_events']))
             
             st.plotly_chart(fig2, use_container_width=True)
         
         # Trend Analysis
         st.markdown("#### 30-Day Event Trend")
         
-        dates = pd.date_range(end=datetime.now(), periods=30, freq='D')
-        events = 50 + np.cumsum(np.random.randn(30) * 5)
-        
-        fig3 = go.Figure()
-        
-        # Add gradient fill
-        fig3.add_trace(go.Scatter(
-            x=dates,
-            y=events,
-            mode='lines',
-            name='Events',
-            line=dict(color='#5E4FDB', width=3),
-            fill='tonexty',
-            fillcolor='rgba(94, 79, 219, 0.1)'
-        ))
-        
-        # Add markers for last 7 days
-        fig3.add_trace(go.Scatter(
-            x=dates[-7:],
-            y=events[-7:],
-            mode='markers',
-            name='Recent',
-            marker=dict(size=8, color='#5E4FDB', symbol='circle')
-        ))
-        
-        fig3.update_layout(
-            height=300,
-            margin=dict(l=0, r=0, t=20, b=20),
-            plot_bgcolor='#FAFBFF',
-            paper_bgcolor='white',
-            xaxis=dict(
-                showgrid=True,
-                gridcolor='#E5E7EB',
-                title="Date"
-            ),
-            yaxis=dict(
-                showgrid=True,
-                gridcolor='#E5E7EB',
-                title="Number of Events"
-            ),
-            showlegend=False,
-            hovermode='x unified',
-            font=dict(family="Plus Jakarta Sans")
-        )
+        fig3 = cached("trend_fig", drug_key, stamp, compute=lambda: figures.trend_figure(
+            bundled(bundle, "trend", lambda: aggregates.event_trend(store, drug_key))))
         
         st.plotly_chart(fig3, use_container_width=True)
     
@@ -627,57 +679,23 @@ if st.session_state.monitoring and drug_name:
         st.markdown("Real-time alerts requiring attention")
         
         # Alert stats
+        alert_counts = bundled(bundle, "alert_counts", lambda: cached(
+            "alert_counts", drug_key, stamp, compute=lambda: aggregates.alert_counts(store, drug_key)))
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.info("**3** Critical Alerts")
+            st.info(f"**{alert_counts['Critical']}** Critical Alerts")
         with col2:
-            st.warning("**7** High Priority")
+            st.warning(f"**{alert_counts['High']}** High Priority")
         with col3:
-            st.success("**15** Medium Priority")
+            st.success(f"**{alert_counts['Medium']}** Medium Priority")
         with col4:
-            st.success("**42** Low Priority")
+            st.success(f"**{alert_counts['Low']}** Low Priority")
         
         st.markdown("<br>", unsafe_allow_html=True)
         
         # Alert list with better formatting
-        alerts = [
-            {
-                "level": "Critical",
-                "title": "Severe Adverse Reaction Cluster",
-                "desc": f"Multiple severe reactions to {drug_name} reported in Northeast region",
-                "source": "FDA FAERS",
-                "time": "2 minutes ago",
-                "confidence": 95,
-                "color": "#EF4444"
-            },
-            {
-                "level": "High",
-                "title": "Unusual Symptom Pattern",
-                "desc": f"Emerging pattern of neurological symptoms with {drug_name}",
-                "source": "Reddit",
-                "time": "15 minutes ago",
-                "confidence": 87,
-                "color": "#F59E0B"
-            },
-            {
-                "level": "Medium",
-                "title": "Increased Reporting Rate",
-                "desc": f"23% increase in adverse event reports for {drug_name}",
-                "source": "Twitter/X",
-                "time": "1 hour ago",
-                "confidence": 76,
-                "color": "#3B82F6"
-            },
-            {
-                "level": "Low",
-                "title": "Minor Side Effects",
-                "desc": f"Common side effects reported, within expected range",
-                "source": "Forums",
-                "time": "3 hours ago",
-                "confidence": 62,
-                "color": "#10B981"
-            }
-        ]
+        alerts = bundled(bundle, "alerts", lambda: cached(
+            "alerts", drug_key, stamp, compute=lambda: aggregates.alerts(store, drug_key)))
         
         for alert in alerts:
             with st.container():
@@ -699,7 +717,41 @@ if st.session_state.monitoring and drug_name:
                 with col_b:
                     st.caption(f"🎯 Confidence: {alert['confidence']}%")
                 
+                # A toggle rather than an expander: expander bodies run on every rerun
+                if st.toggle("🔎 Similar cases", key=f"similar_{alert['alert_id']}"):
+                    cases = similar_cases(alert, drug_key)
+                    if not cases:
+                        st.caption("No indexed historical reports for this drug yet.")
+                    for case, score in cases:
+                        st.markdown(
+                            f"**{score:.0%} match** · {case['source']} · "
+                            f"severity {case['severity']}/10 · "
+                            f"{datetime.fromtimestamp(case['created_at']).strftime('%Y-%m-%d %H:%M')}"
+                        )
+                        st.caption(case['text'])
+                
                 st.markdown("---")  # Separator between alerts
+
+        st.markdown("### Disproportionality (MGPS)")
+        # Scores change only when `mgps.refresh` folds in new events
+        scores = cached("mgps_signals", drug_key, version, mgps.scored_version(store),
+                        compute=lambda: mgps.signals(store, drug_key, limit=15))
+        if scores:
+            st.dataframe(pd.DataFrame({
+                "Reaction": [row["event"] for row in scores],
+                "N": [row["n"] for row in scores],
+                "E": [round(row["expected"], 2) for row in scores],
+                "EBGM": [round(row["ebgm"], 2) for row in scores],
+                "EB05": [round(row["eb05"], 2) for row in scores],
+                "Signal": ["🚩" if row["signal"] else "" for row in scores],
+            }), hide_index=True, use_container_width=True)
+            st.caption(f"Reactions reported for {drug_key} more often than expected; EB05 ≥ {mgps.SIGNAL_EB05:g} flags a signal.")
+        else:
+            st.caption("No disproportionality scores yet; they are computed at the end of each pipeline run.")
+
+        export_controls(f"Export alerts ({time_range.lower()})", f"alerts-{drug_key}",
+                        lambda fmt: export_frame(aggregates.alerts_frame(store, drug_key, since=export_since), fmt),
+                        "alerts_export")
     
     with tab3:
         st.markdown("## AI Analysis")
@@ -780,11 +832,19 @@ if st.session_state.monitoring and drug_name:
         # Key Insights
         st.markdown("#### AI-Generated Insights")
         
+        cube_version = cohorts.version(get_event_store())
+        cube = cached("cohort_cube", cube_version, compute=lambda: cohorts.CohortCube.load(get_event_store()))
+        cohort_insights = cached("cohort_insights", drug_key, cube_version,
+                                 compute=lambda: cohorts.insights(cube, drug_key, limit=2))
+        over = next((i for i in cohort_insights if i["kind"] == "reports"), None)
+        risk = next((i for i in cohort_insights if i["kind"] == "severity"), None)
         insights = [
             ("📊", "Pattern Detected", "Correlation found between dosage timing and adverse events", "#5E4FDB"),
-            ("⚠️", "Anomaly Alert", "Unusual clustering of events in 25-35 age demographic", "#F59E0B"),
+            ("⚠️", "Cohort Over-representation",
+             cohorts.describe(over, drug_key) if over else "No demographic cohort is significantly over-represented", "#F59E0B"),
             ("📈", "Trend Analysis", "12% week-over-week increase in reported events", "#10B981"),
-            ("🎯", "Risk Assessment", "Elevated risk profile for patients with comorbidities", "#EF4444")
+            ("🎯", "Risk Assessment",
+             cohorts.describe(risk, drug_key) if risk else "No cohort shows a significantly higher share of severe reactions", "#EF4444")
         ]
         
         col1, col2 = st.columns(2)
@@ -795,55 +855,36 @@ if st.session_state.monitoring and drug_name:
                     st.markdown(f"**{icon} {title}**")
                     st.markdown(desc)
                     st.markdown("")  # Add space
+
+        st.markdown("#### Cohort Breakdown")
+        breakdown = st.selectbox("Break down by", ["age_band", "sex", "region", "comorbidity"],
+                                 format_func=lambda d: d.replace("_", " ").capitalize(), key="cohort_dimension")
+        rollup = cube.rollup(breakdown, drug_key)
+        rollup = rollup[rollup["events"] > 0]
+        if rollup.empty:
+            st.caption("No demographic data for this drug yet.")
+        else:
+            st.dataframe(rollup.rename(columns={breakdown: breakdown.replace("_", " ").capitalize(),
+                                                "events": "Events", "severe_share": "Severe share"}),
+                         hide_index=True, use_container_width=True,
+                         column_config={"Severe share": st.column_config.ProgressColumn(
+                             format="percent", min_value=0.0, max_value=1.0)})
     
     with tab4:
         st.markdown("## Geographic Distribution")
         st.markdown("Global and regional adverse event distribution")
         
         # Map
-        map_data = pd.DataFrame({
-            'City': ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix',
-                    'Philadelphia', 'San Antonio', 'San Diego', 'Dallas', 'San Jose'],
-            'State': ['NY', 'CA', 'IL', 'TX', 'AZ', 'PA', 'TX', 'CA', 'TX', 'CA'],
-            'lat': [40.7128, 34.0522, 41.8781, 29.7604, 33.4484,
-                   39.9526, 29.4241, 32.7157, 32.7767, 37.3382],
-            'lon': [-74.0060, -118.2437, -87.6298, -95.3698, -112.0740,
-                   -75.1652, -98.4936, -117.1611, -96.7970, -121.8863],
-            'events': [156, 143, 98, 87, 76, 65, 54, 52, 48, 41],
-            'severity': ['High', 'High', 'Medium', 'Medium', 'Low', 'Medium', 'Low', 'Low', 'Medium', 'Low']
-        })
-        
-        fig_map = px.scatter_mapbox(
-            map_data,
-            lat='lat',
-            lon='lon',
-            size='events',
-            color='severity',
-            hover_name='City',
-            hover_data={'State': True, 'events': True, 'lat': False, 'lon': False},
-            color_discrete_map={'High': '#EF4444', 'Medium': '#F59E0B', 'Low': '#10B981'},
-            zoom=3,
-            height=450
-        )
-        
-        fig_map.update_layout(
-            mapbox_style='carto-positron',
-            margin={"r":0,"t":0,"l":0,"b":0},
-            font=dict(family="Plus Jakarta Sans")
-        )
+        fig_map = cached("map_fig", drug_key, stamp, compute=lambda: figures.map_figure(
+            bundled(bundle, "map", lambda: aggregates.map_cells(store, drug_key))))
         
         st.plotly_chart(fig_map, use_container_width=True)
         
         # Regional Statistics
         st.markdown("#### Regional Statistics")
         
-        regional_data = pd.DataFrame({
-            'Region': ['Northeast', 'Southeast', 'Midwest', 'Southwest', 'West Coast'],
-            'Total Events': [342, 298, 276, 234, 197],
-            'Critical': [8, 5, 4, 3, 2],
-            'Trend': ['↑ Rising', '→ Stable', '↓ Declining', '↑ Rising', '→ Stable'],
-            'Risk Level': ['High', 'Medium', 'Medium', 'Low', 'Low']
-        })
+        regional_data = bundled(bundle, "regional", lambda: cached(
+            "regional_stats", drug_key, stamp, compute=lambda: aggregates.regional_stats(store, drug_key)))
         
         st.dataframe(
             regional_data,
@@ -857,6 +898,23 @@ if st.session_state.monitoring and drug_name:
                 "Risk Level": st.column_config.TextColumn("Risk Level", width="small")
             }
         )
+        
+        export_controls(f"Export regional statistics ({time_range.lower()})", f"regional-{drug_key}",
+                        lambda fmt: export_frame(
+                            aggregates.regional_stats(store, drug_key, since=export_since), fmt),
+                        "regional_export")
+        if API_URL:
+            export_link(f"Export raw events ({time_range.lower()})", "/v1/export/events",
+                        {"drug": drug_key, "since": f"{export_since:.0f}"}, "events_export")
+        else:
+            export_controls(f"Export raw events ({time_range.lower()}, first {APP_EXPORT_ROWS:,})",
+                            f"events-{drug_key}",
+                            lambda fmt: b"".join(export_events(store, fmt, drug=drug_key, since=export_since,
+                                                               limit=APP_EXPORT_ROWS)),
+                            "events_export")
+            st.caption(f"Downloads from the dashboard stop at {APP_EXPORT_ROWS:,} events. For complete "
+                       "exports, run `python -m compliancewatch.api` and set COMPLIANCEWATCH_API_URL; "
+                       "the button then streams from the API.")
     
     with tab5:
         st.markdown("## Predictive Analytics")
@@ -875,70 +933,13 @@ if st.session_state.monitoring and drug_name:
         
         # Generate prediction
         days = int(forecast_days.split()[0])
-        future_dates = pd.date_range(start=datetime.now(), periods=days, freq='D')
-        
-        # Create realistic prediction
-        trend = np.linspace(100, 120, days)
-        seasonal = 15 * np.sin(np.linspace(0, 4*np.pi, days))
-        noise = np.random.normal(0, 5, days)
-        prediction = trend + seasonal + noise
-        
-        # Confidence bands
-        ci_mult = {'90%': 1.645, '95%': 1.96, '99%': 2.576}[confidence]
-        std = 15
-        upper = prediction + ci_mult * std
-        lower = prediction - ci_mult * std
-        
-        fig_pred = go.Figure()
-        
-        # Add confidence band
-        fig_pred.add_trace(go.Scatter(
-            x=future_dates,
-            y=upper,
-            mode='lines',
-            line=dict(width=0),
-            showlegend=False,
-            hoverinfo='skip'
-        ))
-        
-        fig_pred.add_trace(go.Scatter(
-            x=future_dates,
-            y=lower,
-            mode='lines',
-            line=dict(width=0),
-            fill='tonexty',
-            fillcolor='rgba(94, 79, 219, 0.15)',
-            name=f'{confidence} Confidence Band',
-            hoverinfo='skip'
-        ))
-        
-        # Add prediction line
-        fig_pred.add_trace(go.Scatter(
-            x=future_dates,
-            y=prediction,
-            mode='lines+markers',
-            name='Predicted Events',
-            line=dict(color='#5E4FDB', width=3),
-            marker=dict(size=5, color='#5E4FDB')
-        ))
-        
-        fig_pred.update_layout(
-            title=f'{forecast_days} Forecast using {model_type}',
-            xaxis_title='Date',
-            yaxis_title='Predicted Event Count',
-            height=400,
-            plot_bgcolor='#FAFBFF',
-            paper_bgcolor='white',
-            xaxis=dict(showgrid=True, gridcolor='#E5E7EB'),
-            yaxis=dict(showgrid=True, gridcolor='#E5E7EB'),
-            hovermode='x unified',
-            font=dict(family="Plus Jakarta Sans"),
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
+        fig_pred = cached(
+            "forecast_fig", drug_key, days, confidence, model_type, stamp,
+            compute=lambda: figures.forecast_figure(
+                bundled(bundle, ("forecast", days, confidence, model_type),
+                        lambda: aggregates.forecast(store, drug_key, days, confidence, model_type)),
+                confidence,
+                f'{forecast_days} Forecast using {model_type}'
             )
         )
         